@@ -4,21 +4,39 @@ API server for PI-PVR Ultimate Media Stack
 Provides endpoints for the web UI to interact with the system
 """
 
+import time
+
+# Record process start before anything heavy is imported so the startup
+# timings reported by /api/health include module import cost
+_PROCESS_START = time.monotonic()
+
 import os
+import sys
 import json
 import subprocess
 import threading
-import time
+import queue
 import re
 import platform
-import psutil
-from flask import Flask, request, jsonify, send_from_directory
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 
+# psutil is imported lazily inside the functions that need it; loading it
+# up front costs noticeable time and memory on a Pi Zero 2 / 1 GB Pi 3
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Startup timings in milliseconds since process start, reported by /api/health
+STARTUP_TIMINGS = {
+    "imports_ms": round((time.monotonic() - _PROCESS_START) * 1000, 1)
+}
+
+# Fast-start mode defers probes until first use and warms caches in the background
+FAST_START = os.environ.get("PIPVR_FAST_START", "").lower() in ("1", "true", "yes")
+
 # Get script directory with support for symlinks
 SCRIPT_PATH = os.path.abspath(__file__)
 SCRIPT_DIR = os.path.dirname(SCRIPT_PATH)
@@ -27,13 +45,15 @@ CONFIG_DIR = os.path.join(BASE_DIR, "config")
 DOCKER_COMPOSE_DIR = os.path.join(BASE_DIR, "docker-compose")
 LOGS_DIR = os.path.join(BASE_DIR, "logs")
 
-# Ensure directories exist
-os.makedirs(CONFIG_DIR, exist_ok=True)
-os.makedirs(LOGS_DIR, exist_ok=True)
-
 # Configuration file paths
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
 SERVICES_FILE = os.path.join(CONFIG_DIR, "services.json")
+FLEET_FILE = os.path.join(CONFIG_DIR, "fleet.json")
+IMAGE_UPDATES_FILE = os.path.join(CONFIG_DIR, "image-updates.json")
+MEDIA_INDEX_FILE = os.path.join(CONFIG_DIR, "media-index.db")
+DEDUPE_REPORT_FILE = os.path.join(CONFIG_DIR, "dedupe-report.json")
+VPN_BENCHMARK_FILE = os.path.join(CONFIG_DIR, "vpn-benchmark.json")
+INSTALL_TIMINGS_FILE = os.path.join(CONFIG_DIR, "install-timings.json")
 INSTALLATION_LOG = os.path.join(LOGS_DIR, "installation.log")
 
 # Default configuration
@@ -90,6 +110,11 @@ DEFAULT_SERVICES = {
     }
 }
 
+# Ensure directories exist (done on first use rather than at import time)
+def ensure_directories():
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    os.makedirs(LOGS_DIR, exist_ok=True)
+
 # Load configuration
 def load_config():
     if os.path.exists(CONFIG_FILE):
@@ -99,6 +124,8 @@ def load_config():
 
 # Save configuration
 def save_config(config):
+    # Importing the app creates no directories, so the first save creates the config directory
+    os.makedirs(CONFIG_DIR, exist_ok=True)
     with open(CONFIG_FILE, "w") as f:
         json.dump(config, f, indent=2)
 
@@ -111,12 +138,27 @@ def load_services():
 
 # Save services
 def save_services(services):
+    # Importing the app creates no directories, so the first save creates the config directory
+    os.makedirs(CONFIG_DIR, exist_ok=True)
     with open(SERVICES_FILE, "w") as f:
         json.dump(services, f, indent=2)
 
+# Load fleet node registry
+def load_fleet():
+    if os.path.exists(FLEET_FILE):
+        with open(FLEET_FILE, "r") as f:
+            return json.load(f)
+    return {"nodes": []}
+
+# Save fleet node registry
+def save_fleet(fleet):
+    with open(FLEET_FILE, "w") as f:
+        json.dump(fleet, f, indent=2)
+
 # Log to installation log
 def log_installation(message):
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    ensure_directories()
     with open(INSTALLATION_LOG, "a") as f:
         f.write(f"[{timestamp}] {message}\n")
 
@@ -130,6 +172,8 @@ def is_docker_installed():
 
 # Get system information
 def get_system_info():
+    import psutil
+
     # First try to use the detect-system.sh script for more detailed info
     detect_script = os.path.join(SCRIPT_DIR, "detect-system.sh")
     try:
@@ -206,6 +250,84 @@ def get_system_info():
     
     return info
 
+# Cache for get_system_info(); the detect-system.sh run is the slowest probe
+# the API makes, so it is done once and shared by every caller
+SYSTEM_INFO_TTL = 300  # seconds
+_system_info_cache = {"data": None, "timestamp": 0}
+_system_info_lock = threading.Lock()
+
+# Get system information, reusing the cached hardware probe when fresh
+def get_cached_system_info(max_age=SYSTEM_INFO_TTL):
+    import psutil
+
+    # Holding the lock while probing means concurrent callers wait for the
+    # one detect-system.sh run instead of starting their own
+    with _system_info_lock:
+        cached = _system_info_cache["data"]
+        if cached is None or time.time() - _system_info_cache["timestamp"] > max_age:
+            cached = get_system_info()
+            _system_info_cache["data"] = cached
+            _system_info_cache["timestamp"] = time.time()
+
+    # Memory and disk usage change constantly, so refresh them on every call
+    info = dict(cached)
+    try:
+        info["memory_available"] = psutil.virtual_memory().available
+        info["disk_free"] = psutil.disk_usage('/').free
+    except Exception as e:
+        print(f"Warning: Failed to refresh memory/disk usage: {e}")
+    return info
+
+# Get the resident memory of this process in bytes (current and peak)
+def get_process_memory():
+    memory = {"rss_bytes": None, "peak_rss_bytes": None}
+    try:
+        # /proc is cheaper than importing psutil just to report our own RSS
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_bytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss_bytes"] = int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            memory["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+        except (ImportError, OSError):
+            pass
+    return memory
+
+# Record a startup milestone relative to process start
+def record_startup_timing(name):
+    if name not in STARTUP_TIMINGS:
+        STARTUP_TIMINGS[name] = round((time.monotonic() - _PROCESS_START) * 1000, 1)
+
+# Set once the background warm-up has populated the caches
+_caches_warm = threading.Event()
+
+# Warm caches in the background so the first dashboard load is fast
+def warm_caches():
+    started = time.monotonic()
+    try:
+        import psutil
+        # Prime cpu_percent so the first non-blocking reading is meaningful
+        psutil.cpu_percent(interval=None)
+        get_cached_system_info()
+    except Exception as e:
+        print(f"Warning: Cache warm-up failed: {e}")
+    finally:
+        STARTUP_TIMINGS["warmup_duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+        record_startup_timing("caches_warm_ms")
+        _caches_warm.set()
+
+# Start the background cache warm-up thread
+def start_cache_warmup():
+    thread = threading.Thread(target=warm_caches, name="cache-warmup", daemon=True)
+    thread.start()
+    return thread
+
 # Get docker container status
 def get_container_status():
     containers = {}
@@ -351,6 +473,11 @@ def get_container_status():
                         "description": description,
                         "url": url
                     }
+                    
+                    # Keep Docker's own healthcheck result when the image defines one
+                    health_match = re.search(r'\((healthy|unhealthy|health: starting)\)', parts[1])
+                    if health_match:
+                        containers[name]["docker_health"] = health_match.group(1).replace("health: ", "")
     except subprocess.TimeoutExpired:
         print("Warning: Docker status check timed out after 15 seconds")
         # Return empty dictionary with error status
@@ -371,6 +498,569 @@ def get_container_status():
         }
     return containers
 
+# Service health probing settings
+HEALTH_PROBE_INTERVAL = 30  # seconds between probes of a healthy service
+HEALTH_PROBE_TIMEOUT = 3  # seconds per HTTP probe
+HEALTH_MAX_BACKOFF = 600  # longest wait between probes of a failing service
+HEALTH_HISTORY_SIZE = 20  # probe results kept per service
+HEALTH_MAX_WORKERS = 8  # concurrent probes
+
+# Download clients share the VPN container's network namespace
+VPN_CONTAINER_NAME = "vpn"
+VPN_DEPENDENT_SERVICES = ["transmission", "qbittorrent", "nzbget", "sabnzbd", "jdownloader"]
+
+# Per-service probe state, keyed by container name
+_health_state = {}
+_health_lock = threading.Lock()
+_health_executor = None
+_health_prober_thread = None
+
+# Probe a service's web UI once; any HTTP answer below 500 means it is responsive
+def probe_service_url(url, timeout=HEALTH_PROBE_TIMEOUT):
+    import http.client
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+    started = time.monotonic()
+    try:
+        connection.request("GET", parts.path or "/", headers={"User-Agent": "pi-pvr-health"})
+        response = connection.getresponse()
+        latency_ms = round((time.monotonic() - started) * 1000, 1)
+        if response.status >= 500:
+            return {"ok": False, "latency_ms": latency_ms, "error": f"HTTP {response.status}"}
+        return {"ok": True, "latency_ms": latency_ms, "status_code": response.status}
+    except (OSError, http.client.HTTPException) as e:
+        return {"ok": False, "latency_ms": None, "error": str(e) or e.__class__.__name__}
+    finally:
+        connection.close()
+
+# Get (creating if needed) the probe state for a service
+def _get_health_entry(name):
+    from collections import deque
+
+    if name not in _health_state:
+        _health_state[name] = {
+            "history": deque(maxlen=HEALTH_HISTORY_SIZE),
+            "consecutive_failures": 0,
+            "next_probe_at": 0,
+            "in_flight": False,
+            "last_result": None,
+            "last_probe": None
+        }
+    return _health_state[name]
+
+# Probe one service and record the result, backing off while it keeps failing
+def _run_health_probe(name, url, timeout):
+    result = probe_service_url(url, timeout)
+    now = time.time()
+    with _health_lock:
+        entry = _get_health_entry(name)
+        entry["in_flight"] = False
+        entry["last_result"] = result
+        entry["last_probe"] = now
+        entry["history"].append({"timestamp": now, "ok": result["ok"], "latency_ms": result["latency_ms"]})
+        if result["ok"]:
+            entry["consecutive_failures"] = 0
+            entry["next_probe_at"] = now + HEALTH_PROBE_INTERVAL
+        else:
+            entry["consecutive_failures"] += 1
+            backoff = HEALTH_PROBE_INTERVAL * (2 ** (entry["consecutive_failures"] - 1))
+            entry["next_probe_at"] = now + min(backoff, HEALTH_MAX_BACKOFF)
+    return result
+
+# Probe all running services that are due, concurrently
+def probe_services(containers, force=False, timeout=HEALTH_PROBE_TIMEOUT):
+    global _health_executor
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    if _health_executor is None:
+        _health_executor = ThreadPoolExecutor(max_workers=HEALTH_MAX_WORKERS, thread_name_prefix="health-probe")
+
+    futures = []
+    now = time.time()
+    with _health_lock:
+        for name, container in containers.items():
+            if name == "error" or container.get("status") != "running" or not container.get("url"):
+                continue
+            entry = _get_health_entry(name)
+            # A probe still waiting on a hung service is never stacked on top of
+            if entry["in_flight"] or (not force and now < entry["next_probe_at"]):
+                continue
+            entry["in_flight"] = True
+            futures.append(_health_executor.submit(_run_health_probe, name, container["url"], timeout))
+
+    if futures:
+        wait(futures, timeout=timeout + 1)
+    return len(futures)
+
+# Summarize the recorded probe results for a service
+def get_service_health(name, container=None, vpn_container=None):
+    with _health_lock:
+        entry = _health_state.get(name)
+        history = list(entry["history"]) if entry else []
+        last_result = entry["last_result"] if entry else None
+        failures = entry["consecutive_failures"] if entry else 0
+        next_probe_at = entry["next_probe_at"] if entry else None
+        last_probe = entry["last_probe"] if entry else None
+
+    latencies = sorted(h["latency_ms"] for h in history if h["ok"] and h["latency_ms"] is not None)
+    health = {
+        "status": "unknown",
+        "latency_ms": last_result["latency_ms"] if last_result else None,
+        "avg_latency_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+        "p95_latency_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        "success_rate": round(sum(1 for h in history if h["ok"]) / len(history), 2) if history else None,
+        "consecutive_failures": failures,
+        "last_probe": last_probe,
+        "next_probe": next_probe_at,
+        "error": last_result.get("error") if last_result else None,
+        "history": [h["latency_ms"] for h in history]
+    }
+
+    if container is not None and container.get("status") != "running":
+        health["status"] = "stopped"
+    elif last_result is not None:
+        health["status"] = "healthy" if last_result["ok"] else "unhealthy"
+
+    # Docker's own healthcheck and the VPN tunnel can fail while the web UI still answers
+    if health["status"] == "healthy":
+        if container is not None and container.get("docker_health") == "unhealthy":
+            health["status"] = "degraded"
+            health["error"] = "Docker healthcheck reports unhealthy"
+        elif (vpn_container is not None and
+              any(key in name.lower() for key in VPN_DEPENDENT_SERVICES) and
+              (vpn_container.get("status") != "running" or vpn_container.get("docker_health") == "unhealthy")):
+            health["status"] = "degraded"
+            health["error"] = "VPN tunnel is down"
+    return health
+
+# Add health to every container in a get_container_status() result
+def get_services_health(containers):
+    vpn_container = containers.get(VPN_CONTAINER_NAME)
+    return {
+        name: get_service_health(name, container, vpn_container)
+        for name, container in containers.items()
+        if name != "error"
+    }
+
+# Background loop that keeps probing services on their own schedules
+def _health_prober_loop():
+    while True:
+        try:
+            probe_services(get_container_status())
+        except Exception as e:
+            print(f"Warning: Health probe cycle failed: {e}")
+        time.sleep(HEALTH_PROBE_INTERVAL / 3)
+
+# Start the background health prober once, on first use
+def ensure_health_prober():
+    global _health_prober_thread
+    with _health_lock:
+        if _health_prober_thread is None:
+            _health_prober_thread = threading.Thread(target=_health_prober_loop, name="health-prober", daemon=True)
+            _health_prober_thread.start()
+
+# List containers as services for the web UI dashboard, with their probe health
+def get_container_services():
+    containers = get_container_status()
+    ensure_health_prober()
+    health = get_services_health(containers)
+    
+    # Format containers into a list of services for the UI
+    services = []
+    for name, container in containers.items():
+        if name == "error":
+            continue
+            
+        # Create service object
+        service = {
+            "name": name,
+            "status": container["status"],
+            "type": container.get("type", "other"),
+            "description": container.get("description", ""),
+            "url": container.get("url", None)
+        }
+        
+        # Extract port from URL or use container ports
+        if service["url"] and ":" in service["url"]:
+            service["port"] = service["url"].split(":")[-1]
+        elif container.get("ports") and len(container["ports"]) > 0:
+            service["port"] = container["ports"][0].get("host", "")
+        else:
+            service["port"] = ""
+        
+        # Add probe results and latency
+        service["health"] = health.get(name)
+            
+        services.append(service)
+    
+    return services
+
+# Generated compose override merged last by generate-compose.sh
+COMPOSE_OVERRIDE_FILE = os.path.join(BASE_DIR, "docker-compose.override.generated.yml")
+
+# Resource limit profiles per service class. The critical class (the media
+# server) gets a fixed fraction of the memory budget; the other services share
+# what is left by weight, clamped to min/max. cpus is a fraction of the cores.
+# Tune through "resource_limits" in config.json (see get_resource_settings()).
+RESOURCE_PROFILES = {
+    "media_server": {"critical": True, "memory_fraction": 0.5, "min_memory_mb": 512, "max_memory_mb": 4096,
+                     "cpu_fraction": 1.0, "cpu_shares": 1024, "pids_limit": 1024},
+    "download": {"memory_weight": 2, "min_memory_mb": 128, "max_memory_mb": 1024,
+                 "cpu_fraction": 0.5, "cpu_shares": 256, "pids_limit": 512},
+    "arr": {"memory_weight": 1.5, "min_memory_mb": 192, "max_memory_mb": 1024,
+            "cpu_fraction": 0.5, "cpu_shares": 512, "pids_limit": 256},
+    "network": {"memory_weight": 0.5, "min_memory_mb": 64, "max_memory_mb": 256,
+                "cpu_fraction": 0.5, "cpu_shares": 768, "pids_limit": 128},
+    "utility": {"memory_weight": 0.5, "min_memory_mb": 64, "max_memory_mb": 512,
+                "cpu_fraction": 0.25, "cpu_shares": 256, "pids_limit": 128}
+}
+
+# Limits are caps rather than reservations and idle services rarely peak
+# together, so the non-critical pool is overcommitted by this factor
+RESOURCE_OVERCOMMIT = 2.0
+
+# Memory kept back for the host OS, Docker and this API
+RESOURCE_HOST_RESERVE_MB = 256
+RESOURCE_HOST_RESERVE_FRACTION = 0.15
+
+# Resource profile class of each compose service
+SERVICE_RESOURCE_CLASSES = {
+    "jellyfin": "media_server",
+    "plex": "media_server",
+    "emby": "media_server",
+    "transmission": "download",
+    "qbittorrent": "download",
+    "nzbget": "download",
+    "sabnzbd": "download",
+    "jdownloader": "download",
+    "get_iplayer": "download",
+    "sonarr": "arr",
+    "radarr": "arr",
+    "lidarr": "arr",
+    "readarr": "arr",
+    "prowlarr": "arr",
+    "bazarr": "arr",
+    "vpn": "network",
+    "nginx_proxy_manager": "network",
+    "watchtower": "utility",
+    "heimdall": "utility",
+    "overseerr": "utility",
+    "tautulli": "utility",
+    "portainer": "utility"
+}
+
+# Get the compose services generate_docker_compose() will deploy
+def get_compose_services(services):
+    # Mirrors the flags built in generate_docker_compose() and the profiles
+    # used by the fragments in docker-compose/
+    deployed = ["vpn", "watchtower"]
+
+    if any(services["arr_apps"].values()):
+        deployed.extend(["prowlarr", "sonarr", "radarr", "lidarr", "readarr", "bazarr"])
+
+    # Transmission and NZBGet have no profile, so they are always included
+    download_clients = services["download_clients"]
+    deployed.extend(["transmission", "nzbget"])
+    if not download_clients["transmission"] and download_clients["qbittorrent"]:
+        deployed.append("qbittorrent")
+    if not download_clients["nzbget"] and download_clients["sabnzbd"]:
+        deployed.append("sabnzbd")
+    if download_clients["jdownloader"]:
+        deployed.append("jdownloader")
+
+    media_server = get_selected_media_server(services)
+    if media_server:
+        deployed.append(media_server)
+
+    utilities = services["utilities"]
+    deployed.extend(["portainer", "get_iplayer"])
+    for name in ["heimdall", "overseerr", "tautulli", "nginx_proxy_manager"]:
+        if utilities.get(name):
+            deployed.append(name)
+    return deployed
+
+# Get the single media server generate_docker_compose() will deploy
+def get_selected_media_server(services):
+    for name in ["jellyfin", "plex", "emby"]:
+        if services["media_servers"].get(name):
+            return name
+    return None
+
+# Get resource limit settings with config.json overrides applied
+def get_resource_settings(config):
+    overrides = config.get("resource_limits", {})
+    profiles = {}
+    for name, profile in RESOURCE_PROFILES.items():
+        profiles[name] = dict(profile)
+        profiles[name].update(overrides.get("profiles", {}).get(name, {}))
+    return {
+        "enabled": overrides.get("enabled", True),
+        "reserve_mb": overrides.get("reserve_mb"),
+        "overcommit": overrides.get("overcommit", RESOURCE_OVERCOMMIT),
+        "profiles": profiles,
+        "services": overrides.get("services", {})
+    }
+
+# Compute per-service memory, CPU and PID limits for this hardware
+def build_resource_plan(config, services, system_info):
+    settings = get_resource_settings(config)
+    profiles = settings["profiles"]
+    hardware = system_info.get("hardware", {})
+    total_mb = int(float(hardware.get("memory", {}).get("total_gb") or 1) * 1024)
+    cores = hardware.get("cpu", {}).get("cores") or os.cpu_count() or 1
+
+    reserve_mb = settings["reserve_mb"]
+    if reserve_mb is None:
+        reserve_mb = max(RESOURCE_HOST_RESERVE_MB, int(total_mb * RESOURCE_HOST_RESERVE_FRACTION))
+    budget_mb = max(total_mb - reserve_mb, 0)
+
+    deployed = get_compose_services(services)
+    classes = {name: SERVICE_RESOURCE_CLASSES.get(name, "utility") for name in deployed}
+
+    # The critical path is sized first so the rest can never crowd it out
+    memory = {}
+    for name in deployed:
+        profile = profiles[classes[name]]
+        if profile.get("critical"):
+            memory[name] = budget_mb * profile["memory_fraction"]
+    pool_mb = int(max(budget_mb - sum(memory.values()), 0))
+
+    others = [name for name in deployed if name not in memory]
+    total_weight = sum(profiles[classes[name]]["memory_weight"] for name in others) or 1
+    for name in others:
+        share = pool_mb * profiles[classes[name]]["memory_weight"] / total_weight
+        memory[name] = share * settings["overcommit"]
+
+    plan_services = {}
+    for name in deployed:
+        profile = profiles[classes[name]]
+        memory_mb = min(max(memory[name], profile["min_memory_mb"]), profile["max_memory_mb"])
+        if not profile.get("critical"):
+            # A single runaway service must not be able to take the critical share
+            memory_mb = min(memory_mb, max(pool_mb, profile["min_memory_mb"]))
+        limits = {
+            "class": classes[name],
+            "memory_mb": int(memory_mb),
+            "cpus": round(min(max(cores * profile["cpu_fraction"], 0.25), cores), 2),
+            "cpu_shares": profile["cpu_shares"],
+            "pids_limit": profile["pids_limit"]
+        }
+        # Explicit per-service values in config.json always win
+        limits.update(settings["services"].get(name, {}))
+        plan_services[name] = limits
+
+    critical_mb = sum(l["memory_mb"] for l in plan_services.values() if profiles[l["class"]].get("critical"))
+    pool_caps_mb = sum(l["memory_mb"] for l in plan_services.values() if not profiles[l["class"]].get("critical"))
+    warnings = []
+    if critical_mb > budget_mb:
+        warnings.append("Not enough memory for the media server's minimum limit; expect swapping during playback")
+    return {
+        "enabled": settings["enabled"],
+        "hardware": {"memory_total_mb": total_mb, "cpu_cores": cores},
+        "reserved_mb": reserve_mb,
+        "budget_mb": budget_mb,
+        "critical_mb": critical_mb,
+        "pool_mb": pool_mb,
+        "pool_overcommit_ratio": round(pool_caps_mb / pool_mb, 2) if pool_mb else None,
+        "warnings": warnings,
+        "services": plan_services
+    }
+
+# Transcode and cache directories inside each media server container
+# (the defaults used by the linuxserver images)
+MEDIA_SERVER_DIRECTORIES = {
+    "jellyfin": {
+        "transcode": "/config/cache/transcodes",
+        "cache": "/config/cache"
+    },
+    "plex": {
+        "transcode": "/config/Library/Application Support/Plex Media Server/Cache/Transcode",
+        "cache": "/config/Library/Application Support/Plex Media Server/Cache"
+    },
+    "emby": {
+        "transcode": "/config/transcoding-temp",
+        "cache": "/config/cache"
+    }
+}
+
+# Host devices passed through for each hardware transcoding method
+HW_ACCEL_DEVICES = {
+    "v4l2": ["/dev/video10", "/dev/video11", "/dev/video12", "/dev/vchiq"],
+    "vaapi": ["/dev/dri"],
+    "nvdec": ["/dev/nvidia0", "/dev/nvidiactl", "/dev/nvidia-modeset"]
+}
+
+# A tmpfs lives inside the media server's memory limit; this share of the
+# limit goes to transcode segments, and below the minimum it isn't worth it
+TRANSCODE_TMPFS_FRACTION = 0.33
+TRANSCODE_TMPFS_MIN_MB = 256
+TRANSCODE_TMPFS_MAX_MB = 2048
+CACHE_TMPFS_MB = 256
+
+# Work out transcode tmpfs and hardware acceleration for the media server
+def build_media_server_plan(config, services, system_info, resources):
+    media_server = get_selected_media_server(services)
+    if not media_server:
+        return None
+
+    settings = config.get("transcode", {})
+    directories = dict(MEDIA_SERVER_DIRECTORIES[media_server])
+    directories.update(settings.get("paths", {}))
+    warnings = []
+
+    # Hardware acceleration: detected method unless config.json names one
+    requested = settings.get("hardware_acceleration", "auto")
+    if requested == "auto":
+        method = system_info.get("transcoding", {}).get("recommended_method", "software")
+        source = "detected"
+    else:
+        method = "software" if requested in ("none", "software") else requested
+        source = "config"
+    devices = []
+    for device in HW_ACCEL_DEVICES.get(method, []):
+        if os.path.exists(device):
+            devices.append(device)
+        elif device != "/dev/vchiq":
+            warnings.append(f"{device} not found on this host; not passed to {media_server}")
+    if method != "software" and not devices:
+        method = "software"
+
+    # Transcode tmpfs, sized from the media server's own memory limit
+    memory_mb = resources["services"].get(media_server, {}).get("memory_mb", 0)
+    size_mb = settings.get("tmpfs_size_mb")
+    if size_mb is None:
+        size_mb = min(int(memory_mb * TRANSCODE_TMPFS_FRACTION) // 64 * 64, TRANSCODE_TMPFS_MAX_MB)
+    tmpfs_setting = settings.get("tmpfs", "auto")
+    if tmpfs_setting == "auto":
+        tmpfs_enabled = size_mb >= TRANSCODE_TMPFS_MIN_MB
+        reason = "enough memory" if tmpfs_enabled else f"less than {TRANSCODE_TMPFS_MIN_MB} MB available for transcodes"
+    else:
+        tmpfs_enabled = bool(tmpfs_setting)
+        reason = "set in config.json"
+    if tmpfs_enabled and memory_mb and size_mb > memory_mb // 2:
+        warnings.append(f"Transcode tmpfs of {size_mb} MB uses more than half of {media_server}'s {memory_mb} MB memory limit")
+
+    # Cache tmpfs is opt-in: artwork and metadata caches are rebuilt after every restart
+    cache_enabled = bool(settings.get("cache_tmpfs", False))
+    cache_size_mb = settings.get("cache_tmpfs_size_mb", CACHE_TMPFS_MB)
+
+    return {
+        "service": media_server,
+        "hardware_acceleration": {
+            "method": method,
+            "requested": requested,
+            "source": source,
+            "devices": devices,
+            "runtime": "nvidia" if method == "nvdec" else None
+        },
+        "transcode_tmpfs": {
+            "enabled": tmpfs_enabled,
+            "target": directories["transcode"],
+            "size_mb": size_mb,
+            "reason": reason
+        },
+        "cache_tmpfs": {
+            "enabled": cache_enabled,
+            "target": directories["cache"],
+            "size_mb": cache_size_mb
+        },
+        "warnings": warnings
+    }
+
+# Build the full set of generated compose overrides
+def build_compose_overrides(config, services, system_info):
+    resources = build_resource_plan(config, services, system_info)
+    return {
+        "resources": resources,
+        "media_server": build_media_server_plan(config, services, system_info, resources)
+    }
+
+# Convert overrides into compose service definitions
+def compose_overrides_to_services(overrides):
+    compose_services = {}
+    resources = overrides["resources"]
+    if resources["enabled"]:
+        for name, limits in resources["services"].items():
+            compose_services[name] = {
+                "mem_limit": f"{limits['memory_mb']}m",
+                "cpus": limits["cpus"],
+                "cpu_shares": limits["cpu_shares"],
+                "pids_limit": limits["pids_limit"]
+            }
+
+    media = overrides.get("media_server")
+    if media:
+        service = compose_services.setdefault(media["service"], {})
+        acceleration = media["hardware_acceleration"]
+        if acceleration["devices"]:
+            service["devices"] = [f"{device}:{device}" for device in acceleration["devices"]]
+        if acceleration["runtime"]:
+            service["runtime"] = acceleration["runtime"]
+
+        # The cache mount already contains the transcode directory when both are enabled
+        mounts = []
+        if media["cache_tmpfs"]["enabled"]:
+            mounts.append(media["cache_tmpfs"])
+        if media["transcode_tmpfs"]["enabled"] and not (
+                media["cache_tmpfs"]["enabled"] and
+                media["transcode_tmpfs"]["target"].startswith(media["cache_tmpfs"]["target"] + "/")):
+            mounts.append(media["transcode_tmpfs"])
+        if mounts:
+            service["volumes"] = [
+                {"type": "tmpfs", "target": mount["target"], "tmpfs": {"size": mount["size_mb"] * 1024 * 1024}}
+                for mount in mounts
+            ]
+    return compose_services
+
+# Render a small subset of YAML (dicts, lists, scalars) for compose files
+def to_compose_yaml(value, indent=0):
+    pad = "  " * indent
+    lines = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)) and item:
+                lines.append(f"{pad}{key}:")
+                lines.append(to_compose_yaml(item, indent + 1))
+            else:
+                lines.append(f"{pad}{key}: {_yaml_scalar(item)}")
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)) and item:
+                nested = to_compose_yaml(item, indent + 1).lstrip()
+                lines.append(f"{pad}- {nested}")
+            else:
+                lines.append(f"{pad}- {_yaml_scalar(item)}")
+    else:
+        lines.append(f"{pad}{_yaml_scalar(value)}")
+    return "\n".join(lines)
+
+# Render a YAML scalar; JSON-quoted strings are valid YAML
+def _yaml_scalar(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, dict):
+        return "{}"
+    if isinstance(value, list):
+        return "[]"
+    return json.dumps(str(value))
+
+# Write the generated compose override file
+def write_compose_overrides(overrides, path=None):
+    path = path or COMPOSE_OVERRIDE_FILE
+    document = {"services": compose_overrides_to_services(overrides)}
+    with open(path, "w") as f:
+        f.write("# Generated by PI-PVR Web Installer from the detected hardware\n")
+        f.write("# Regenerated on every install; tune through config.json instead of editing\n")
+        f.write(to_compose_yaml(document) + "\n")
+    return path
+
 # Generate docker-compose file
 def generate_docker_compose(config, services):
     # Build command based on selected services
@@ -415,10 +1105,17 @@ def generate_docker_compose(config, services):
     if utilities["nginx_proxy_manager"]:
         cmd.append("--proxy")
     
+    # Add hardware-derived overrides (resource limits) as a final compose file
+    overrides = build_compose_overrides(config, services, get_cached_system_info())
+    try:
+        cmd.extend(["--extra-file", write_compose_overrides(overrides)])
+    except OSError as e:
+        print(f"Warning: Failed to write compose overrides: {e}")
+    
     # Run the command
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return {"success": True, "output": result.stdout}
+        return {"success": True, "output": result.stdout, "overrides": overrides}
     except subprocess.CalledProcessError as e:
         return {"success": False, "error": e.stderr}
 
@@ -458,198 +1155,3398 @@ CONTAINER_NETWORK=vpn_network
     
     return env_file_path
 
-# Run installation in a separate thread
-def run_installation(config, services):
-    max_retries = 3  # Maximum number of retries for failed operations
-    
+# Record of the tuned values last written to each download client's settings,
+# used to tell our own earlier values apart from changes made by the user
+DOWNLOAD_TUNING_STATE_FILE = os.path.join(CONFIG_DIR, "download-tuning.json")
+
+# Where each client keeps its settings under DOCKER_DIR, and the file format.
+# "seed" holds the minimum a new file needs so the container still starts
+# with the linuxserver layout; clients without a seed are tuned after their
+# first start has created the file.
+DOWNLOAD_CLIENT_SETTINGS = {
+    "transmission": {
+        "path": os.path.join("transmission", "settings.json"),
+        "format": "json",
+        "seed": {
+            "download-dir": "/downloads/complete",
+            "incomplete-dir": "/downloads/incomplete",
+            "incomplete-dir-enabled": True,
+            "watch-dir": "/watch",
+            "watch-dir-enabled": True,
+            "rpc-whitelist-enabled": False,
+            "rpc-host-whitelist-enabled": False
+        }
+    },
+    "qbittorrent": {
+        "path": os.path.join("qbittorrent", "qBittorrent", "qBittorrent.conf"),
+        "format": "ini",
+        "separator": "=",
+        "seed": {
+            "LegalNotice": {"Accepted": "true"},
+            "Preferences": {
+                "Downloads\\SavePath": "/downloads/",
+                "Downloads\\TempPath": "/downloads/incomplete/"
+            }
+        }
+    },
+    "nzbget": {
+        "path": os.path.join("nzbget", "nzbget.conf"),
+        "format": "ini",
+        "separator": "=",
+        "seed": None
+    },
+    "sabnzbd": {
+        "path": os.path.join("sabnzbd", "sabnzbd.ini"),
+        "format": "ini",
+        "separator": " = ",
+        "seed": {}
+    }
+}
+
+# Stock value of every tuned setting; an untracked value that still equals
+# the stock default is safe to replace, anything else was set by the user
+DOWNLOAD_CLIENT_STOCK_DEFAULTS = {
+    "transmission": {
+        "peer-limit-global": 200,
+        "peer-limit-per-torrent": 50,
+        "cache-size-mb": 4,
+        "preallocation": 1,
+        "download-queue-size": 5
+    },
+    "qbittorrent": {
+        "BitTorrent/Session\\MaxConnections": "500",
+        "BitTorrent/Session\\MaxConnectionsPerTorrent": "100",
+        "BitTorrent/Session\\DiskCacheSize": "-1",
+        "BitTorrent/Session\\Preallocation": "false",
+        "BitTorrent/Session\\MaxActiveDownloads": "3"
+    },
+    "nzbget": {
+        "ArticleCache": "0",
+        "WriteBuffer": "0",
+        "ParThreads": "0",
+        "ParBuffer": "16",
+        "DirectUnpack": "no",
+        "PostStrategy": "sequential"
+    },
+    "sabnzbd": {
+        "misc/cache_limit": "",
+        "misc/direct_unpack": "0",
+        "misc/par_option": "",
+        "misc/ionice": ""
+    }
+}
+
+# Detect whether a path lives on an SD card, a spinning disk or an SSD
+def detect_storage_type(path):
+    # Walk up to the nearest existing directory (the mount may not be populated yet)
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
     try:
-        # Update installation status
-        config["installation_status"] = "in_progress"
-        save_config(config)
-        
-        # Generate docker-compose file
-        log_installation("Generating docker-compose.yml...")
-        result = generate_docker_compose(config, services)
-        if not result["success"]:
-            log_installation(f"Failed to generate docker-compose.yml: {result.get('error', 'Unknown error')}")
-            config["installation_status"] = "failed"
-            save_config(config)
-            return
-        
-        # Create .env file
-        log_installation("Creating .env file...")
-        try:
-            env_file_path = create_env_file(config)
-            log_installation(f"Created .env file at {env_file_path}")
-        except Exception as e:
-            log_installation(f"Failed to create .env file: {str(e)}")
-            config["installation_status"] = "failed"
-            save_config(config)
-            return
-        
-        # Install Docker if not installed
-        if not is_docker_installed():
-            log_installation("Installing Docker...")
-            for attempt in range(max_retries):
-                try:
-                    # Download the Docker install script with timeout
-                    subprocess.run([
-                        "curl", "-fsSL", "https://get.docker.com", "-o", "get-docker.sh"
-                    ], check=True, timeout=60)
-                    
-                    # Run the Docker install script with timeout
-                    subprocess.run(["sh", "get-docker.sh"], check=True, timeout=300)
-                    
-                    # Clean up
-                    if os.path.exists("get-docker.sh"):
-                        os.remove("get-docker.sh")
-                    
-                    log_installation("Docker installed successfully")
-                    break
-                except subprocess.TimeoutExpired:
-                    log_installation(f"Docker installation timed out (attempt {attempt+1}/{max_retries})")
-                    if attempt == max_retries - 1:
-                        log_installation("Failed to install Docker: operation timed out")
-                        config["installation_status"] = "failed"
-                        save_config(config)
-                        return
-                except subprocess.CalledProcessError as e:
-                    log_installation(f"Error installing Docker (attempt {attempt+1}/{max_retries}): {str(e)}")
-                    if attempt == max_retries - 1:
-                        log_installation("Failed to install Docker after multiple attempts")
-                        config["installation_status"] = "failed"
-                        save_config(config)
-                        return
-                
-                # Wait before retrying
-                time.sleep(5)
-        
-        # Install Tailscale if enabled
-        if config["tailscale"]["enabled"]:
-            log_installation("Installing Tailscale...")
-            for attempt in range(max_retries):
-                try:
-                    # Download the Tailscale install script with timeout
-                    subprocess.run([
-                        "curl", "-fsSL", "https://tailscale.com/install.sh", "-o", "install-tailscale.sh"
-                    ], check=True, timeout=60)
-                    
-                    # Run the Tailscale install script with timeout
-                    subprocess.run(["sh", "install-tailscale.sh"], check=True, timeout=120)
-                    
-                    # Clean up
-                    if os.path.exists("install-tailscale.sh"):
-                        os.remove("install-tailscale.sh")
-                    
-                    # Set up Tailscale if auth key provided
-                    if config["tailscale"]["auth_key"]:
-                        subprocess.run([
-                            "sudo", "tailscale", "up", 
-                            "--authkey", config["tailscale"]["auth_key"],
-                            "--accept-routes=false"
-                        ], check=True, timeout=60)
-                    
-                    log_installation("Tailscale installed successfully")
-                    break
-                except subprocess.TimeoutExpired:
-                    log_installation(f"Tailscale installation timed out (attempt {attempt+1}/{max_retries})")
-                    if attempt == max_retries - 1:
-                        log_installation("Failed to install Tailscale: operation timed out")
-                        # This is non-critical, so we continue with the installation
-                except subprocess.CalledProcessError as e:
-                    log_installation(f"Error installing Tailscale (attempt {attempt+1}/{max_retries}): {str(e)}")
-                    if attempt == max_retries - 1:
-                        log_installation("Failed to install Tailscale after multiple attempts")
-                        # This is non-critical, so we continue with the installation
-                
-                # Wait before retrying
-                time.sleep(5)
-        
-        # Start Docker Compose stack
-        log_installation("Starting Docker Compose stack...")
-        for attempt in range(max_retries):
-            try:
-                # Get the path to the docker-compose.yml file
-                docker_compose_file = os.path.join(BASE_DIR, "docker-compose.yml")
-                
-                # Check if the file exists, if not, look in the docker-compose directory
-                if not os.path.exists(docker_compose_file):
-                    docker_compose_file = os.path.join(DOCKER_COMPOSE_DIR, "docker-compose.yml")
-                
-                # Log the file path for debugging
-                log_installation(f"Using docker-compose file: {docker_compose_file}")
-                
-                # Validate that the file exists
-                if not os.path.exists(docker_compose_file):
-                    log_installation(f"Error: Docker compose file not found at {docker_compose_file}")
-                    config["installation_status"] = "failed"
-                    save_config(config)
-                    return
-                
-                # Start the Docker Compose stack with timeout
-                subprocess.run([
-                    "docker", "compose", 
-                    "-f", docker_compose_file,
-                    "up", "-d"
-                ], check=True, timeout=300)  # 5 minutes timeout
-                
-                log_installation("Docker Compose stack started successfully")
-                config["installation_status"] = "completed"
-                break
-            except subprocess.TimeoutExpired:
-                log_installation(f"Docker Compose startup timed out (attempt {attempt+1}/{max_retries})")
-                if attempt == max_retries - 1:
-                    log_installation("Failed to start Docker Compose: operation timed out")
-                    config["installation_status"] = "failed"
-            except subprocess.CalledProcessError as e:
-                log_installation(f"Error starting Docker Compose (attempt {attempt+1}/{max_retries}): {str(e)}")
-                if attempt == max_retries - 1:
-                    log_installation("Failed to start Docker Compose after multiple attempts")
-                    config["installation_status"] = "failed"
-            
-            # Wait before retrying
-            time.sleep(10)
-        
-        save_config(config)
-        log_installation(f"Installation completed with status: {config['installation_status']}")
-    except Exception as e:
-        log_installation(f"Installation failed with unexpected error: {str(e)}")
-        config["installation_status"] = "failed"
-        save_config(config)
+        st = os.stat(path)
+        device_dir = os.path.realpath(f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}")
+    except OSError:
+        return {"type": "unknown", "device": None}
 
-# API routes
-@app.route('/api/system', methods=['GET'])
-def api_system_info():
-    system_info = get_system_info()
-    
-    # Add CPU temperature for Pi health dashboard
+    # Partitions have a "partition" file; the queue settings live on the parent disk
+    if os.path.exists(os.path.join(device_dir, "partition")):
+        device_dir = os.path.dirname(device_dir)
+    device = os.path.basename(device_dir)
+    if device.startswith("mmcblk"):
+        return {"type": "sd_card", "device": device}
     try:
-        # Try to get temperature from thermal_zone0
-        if os.path.exists('/sys/class/thermal/thermal_zone0/temp'):
-            with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-                temp = float(f.read().strip()) / 1000.0  # Convert from millidegrees to degrees
-                system_info['temperature_celsius'] = temp
-        
-        # For Raspberry Pi, alternatively try vcgencmd
-        elif os.path.exists('/usr/bin/vcgencmd'):
-            try:
-                temp_output = os.popen("vcgencmd measure_temp").readline()
-                system_info['temperature_celsius'] = float(temp_output.replace("temp=", "").replace("'C\n", ""))
-            except Exception as e:
-                print(f"Error getting temperature from vcgencmd: {e}")
-    except Exception as e:
-        print(f"Error getting CPU temperature: {e}")
-        # Temperature might already be available from get_system_info
-    
-    # Add CPU usage percentage
+        with open(os.path.join(device_dir, "queue", "rotational"), "r") as f:
+            rotational = f.read().strip() == "1"
+        return {"type": "hdd" if rotational else "ssd", "device": device}
+    except OSError:
+        return {"type": "unknown", "device": device}
+
+# Measure sequential write throughput of a directory in MB/s
+def measure_write_throughput(path, size_mb=32):
+    test_file = os.path.join(path, ".pi-pvr-write-test")
+    block = os.urandom(1024 * 1024)
+    started = time.monotonic()
     try:
-        system_info['cpu_usage_percent'] = psutil.cpu_percent(interval=0.5)
-    except Exception as e:
-        print(f"Error getting CPU usage: {e}")
-    
-    return jsonify(system_info)
+        with open(test_file, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        elapsed = time.monotonic() - started
+        return round(size_mb / elapsed, 1) if elapsed > 0 else None
+    except OSError as e:
+        print(f"Warning: Write throughput test failed: {e}")
+        return None
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
 
-@app.route('/api/drives', methods=['GET'])
+# Work out tuning values from core count, RAM and storage type
+def build_download_profile(config, system_info, measure=False):
+    settings = config.get("download_tuning", {})
+    hardware = system_info.get("hardware", {})
+    memory_mb = int(float(hardware.get("memory", {}).get("total_gb") or 1) * 1024)
+    cores = hardware.get("cpu", {}).get("cores") or os.cpu_count() or 1
+
+    storage = detect_storage_type(config.get("downloads_dir", DEFAULT_CONFIG["downloads_dir"]))
+    if settings.get("storage_type"):
+        storage = {"type": settings["storage_type"], "device": storage["device"], "source": "config"}
+    else:
+        storage["source"] = "detected"
+    if measure and os.path.isdir(config.get("downloads_dir", "")):
+        storage["write_mbps"] = measure_write_throughput(config["downloads_dir"])
+        # Anything slower than this behaves like an SD card whatever the device is
+        if storage["write_mbps"] is not None and storage["write_mbps"] < 20:
+            storage["type"] = "sd_card"
+            storage["source"] = "measured"
+
+    slow_storage = storage["type"] in ("sd_card", "hdd", "unknown")
+    peers_global = min(max(memory_mb // 10, 60), 500)
+    disk_cache_mb = min(max(memory_mb // 64, 4), 64)
+    if slow_storage:
+        # A bigger cache batches writes on slow or seek-bound media
+        disk_cache_mb = min(disk_cache_mb * 2, 128)
+    # Leave a core free for the media server; par2 on an SD card is I/O bound anyway
+    par_threads = 1 if storage["type"] == "sd_card" else max(1, min(cores - 1, 4))
+
+    profile = {
+        "peers_global": peers_global,
+        "peers_per_torrent": min(max(peers_global // 4, 20), 100),
+        "active_downloads": 2 if cores <= 2 else 3,
+        "disk_cache_mb": disk_cache_mb,
+        "article_cache_mb": min(max(memory_mb // 32, 16), 256),
+        "par_threads": par_threads,
+        "direct_unpack": cores >= 4 and storage["type"] != "sd_card",
+        # Full preallocation avoids fragmentation on spinning disks but means
+        # writing every file twice on flash
+        "preallocation": "full" if storage["type"] == "hdd" else "sparse"
+    }
+    profile.update(settings.get("profile", {}))
+    return {"hardware": {"memory_mb": memory_mb, "cpu_cores": cores}, "storage": storage, "profile": profile}
+
+# Map a tuning profile onto one client's settings, keyed "section/key" for INI files
+def build_download_client_settings(client, profile):
+    if client == "transmission":
+        return {
+            "peer-limit-global": profile["peers_global"],
+            "peer-limit-per-torrent": profile["peers_per_torrent"],
+            "cache-size-mb": profile["disk_cache_mb"],
+            "preallocation": 2 if profile["preallocation"] == "full" else 1,
+            "download-queue-size": profile["active_downloads"]
+        }
+    if client == "qbittorrent":
+        return {
+            "BitTorrent/Session\\MaxConnections": str(profile["peers_global"]),
+            "BitTorrent/Session\\MaxConnectionsPerTorrent": str(profile["peers_per_torrent"]),
+            "BitTorrent/Session\\DiskCacheSize": str(profile["disk_cache_mb"]),
+            "BitTorrent/Session\\Preallocation": "true" if profile["preallocation"] == "full" else "false",
+            "BitTorrent/Session\\MaxActiveDownloads": str(profile["active_downloads"])
+        }
+    if client == "nzbget":
+        return {
+            "ArticleCache": str(profile["article_cache_mb"]),
+            "WriteBuffer": str(profile["disk_cache_mb"] * 16),
+            "ParThreads": str(profile["par_threads"]),
+            "ParBuffer": str(min(profile["article_cache_mb"], 64)),
+            "DirectUnpack": "yes" if profile["direct_unpack"] else "no",
+            "PostStrategy": "balanced" if profile["par_threads"] > 1 else "sequential"
+        }
+    if client == "sabnzbd":
+        return {
+            "misc/cache_limit": f"{profile['article_cache_mb']}M",
+            "misc/direct_unpack": "1" if profile["direct_unpack"] else "0",
+            "misc/par_option": f"-t{profile['par_threads']}",
+            "misc/ionice": "-c2 -n7"
+        }
+    return {}
+
+# Read "key=value" lines from an INI-style file into {"section/key": value}
+def read_ini_values(lines):
+    values = {}
+    section = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            section = stripped[1:-1]
+        elif "=" in stripped and not stripped.startswith(("#", ";")):
+            key, value = stripped.split("=", 1)
+            full_key = f"{section}/{key.strip()}" if section else key.strip()
+            values[full_key] = value.strip()
+    return values
+
+# Set "section/key" values in INI-style lines, keeping everything else untouched
+def update_ini_lines(lines, updates, separator="="):
+    lines = list(lines)
+    for full_key, value in updates.items():
+        section, key = full_key.split("/", 1) if "/" in full_key else (None, full_key)
+        current_section = None
+        section_end = len(lines) if section is None else None
+        replaced = False
+        for index, line in enumerate(lines):
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                if current_section == section and section is not None:
+                    section_end = index
+                    break
+                current_section = stripped[1:-1]
+                if current_section == section:
+                    section_end = len(lines)
+                continue
+            if current_section == section and "=" in stripped and not stripped.startswith(("#", ";")):
+                if stripped.split("=", 1)[0].strip() == key:
+                    lines[index] = f"{key}{separator}{value}\n"
+                    replaced = True
+                    break
+        if replaced:
+            continue
+        if section_end is None:
+            # Section does not exist yet; append it at the end
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            if lines and lines[-1].strip():
+                lines.append("\n")
+            lines.append(f"[{section}]\n")
+            section_end = len(lines)
+        # Insert after the last non-blank line of the section
+        insert_at = section_end
+        while insert_at > 0 and not lines[insert_at - 1].strip():
+            insert_at -= 1
+        lines.insert(insert_at, f"{key}{separator}{value}\n")
+    return lines
+
+# Load the record of previously applied tuning values
+def load_download_tuning_state():
+    if os.path.exists(DOWNLOAD_TUNING_STATE_FILE):
+        with open(DOWNLOAD_TUNING_STATE_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+# Save the record of applied tuning values
+def save_download_tuning_state(state):
+    with open(DOWNLOAD_TUNING_STATE_FILE, "w") as f:
+        json.dump(state, f, indent=2)
+
+# Get the download clients selected in services.json that can be tuned
+def get_tunable_download_clients(services):
+    return [client for client in DOWNLOAD_CLIENT_SETTINGS if services["download_clients"].get(client)]
+
+# Apply tuned settings to one client's settings file without clobbering user changes
+def apply_download_client_settings(client, docker_dir, targets, applied, dry_run=False):
+    spec = DOWNLOAD_CLIENT_SETTINGS[client]
+    settings_file = os.path.join(docker_dir, spec["path"])
+    stock = DOWNLOAD_CLIENT_STOCK_DEFAULTS[client]
+    result = {"settings_file": settings_file, "changed": {}, "kept_user_values": {}}
+
+    exists = os.path.exists(settings_file)
+    if not exists and spec["seed"] is None:
+        result["status"] = "pending"
+        result["message"] = "Settings file is created on first start; tuning is applied after that"
+        return result
+
+    # Read current values
+    if spec["format"] == "json":
+        document = {}
+        if exists:
+            with open(settings_file, "r") as f:
+                document = json.load(f)
+        elif spec["seed"]:
+            document = dict(spec["seed"])
+        current = document
+    else:
+        lines = []
+        if exists:
+            with open(settings_file, "r") as f:
+                lines = f.readlines()
+        elif spec["seed"]:
+            seed = {f"{section}/{key}": value for section, keys in spec["seed"].items() for key, value in keys.items()}
+            lines = update_ini_lines([], seed, spec["separator"])
+        current = read_ini_values(lines)
+
+    # Three-way decision per key: missing, still ours, or still the stock default -> tune it
+    updates = {}
+    for key, target in targets.items():
+        value = current.get(key)
+        if value == target:
+            applied[key] = target
+            continue
+        ours = key in applied and value == applied[key]
+        if value is None or ours or (key not in applied and value == stock.get(key)):
+            updates[key] = target
+            result["changed"][key] = {"from": value, "to": target}
+        else:
+            result["kept_user_values"][key] = value
+
+    if (updates or not exists) and not dry_run:
+        os.makedirs(os.path.dirname(settings_file), exist_ok=True)
+        temp_file = settings_file + ".pi-pvr-tmp"
+        with open(temp_file, "w") as f:
+            if spec["format"] == "json":
+                document.update(updates)
+                json.dump(document, f, indent=4, sort_keys=True)
+            else:
+                f.writelines(update_ini_lines(lines, updates, spec["separator"]))
+        os.replace(temp_file, settings_file)
+        applied.update(updates)
+
+    if dry_run:
+        result["status"] = "would_apply" if updates or not exists else "unchanged"
+    else:
+        result["status"] = "applied" if updates or not exists else "unchanged"
+    return result
+
+# Tune every selected download client, restarting running ones that changed
+def apply_download_tuning(config, services, clients=None, restart=True, measure=False):
+    plan = build_download_profile(config, get_cached_system_info(), measure)
+    state = load_download_tuning_state()
+    containers = get_container_status() if restart else {}
+    results = {}
+
+    for client in clients or get_tunable_download_clients(services):
+        if client not in DOWNLOAD_CLIENT_SETTINGS:
+            results[client] = {"status": "error", "message": "Unknown download client", "restarted": False}
+            continue
+        targets = build_download_client_settings(client, plan["profile"])
+        applied = state.setdefault(client, {})
+
+        # Clients rewrite their settings on exit, so a running one that needs
+        # changes is stopped first and started again afterwards
+        running = containers.get(client, {}).get("status") == "running"
+        restarted = False
+        try:
+            if running:
+                preview = apply_download_client_settings(client, config["docker_dir"], targets, dict(applied), dry_run=True)
+                if preview["status"] == "would_apply":
+                    subprocess.run(["docker", "stop", client], capture_output=True, timeout=60)
+                    restarted = True
+            results[client] = apply_download_client_settings(client, config["docker_dir"], targets, applied)
+        except (OSError, ValueError) as e:
+            results[client] = {"status": "error", "message": str(e)}
+        finally:
+            if restarted:
+                subprocess.run(["docker", "start", client], capture_output=True, timeout=60)
+        results[client]["restarted"] = restarted
+
+    save_download_tuning_state(state)
+    return {"storage": plan["storage"], "profile": plan["profile"], "clients": results}
+
+# Preview the tuning that apply_download_tuning() would make
+def preview_download_tuning(config, services, measure=False):
+    plan = build_download_profile(config, get_cached_system_info(), measure)
+    state = load_download_tuning_state()
+    clients = {}
+    for client in get_tunable_download_clients(services):
+        targets = build_download_client_settings(client, plan["profile"])
+        clients[client] = apply_download_client_settings(
+            client, config["docker_dir"], targets, dict(state.get(client, {})), dry_run=True)
+        clients[client]["settings"] = targets
+    return {"storage": plan["storage"], "profile": plan["profile"], "clients": clients}
+
+# Wait for clients that create their settings file on first start, then tune them
+def apply_pending_download_tuning(config, services, pending, timeout=60):
+    deadline = time.time() + timeout
+    for client in pending:
+        settings_file = os.path.join(config["docker_dir"], DOWNLOAD_CLIENT_SETTINGS[client]["path"])
+        while not os.path.exists(settings_file) and time.time() < deadline:
+            time.sleep(2)
+    return apply_download_tuning(config, services, clients=pending, restart=True)
+
+# Background job scheduler settings
+SCHEDULER_SAMPLE_SECONDS = 5  # how often temperature, load and I/O wait are re-read
+SCHEDULER_STREAMS_SAMPLE_SECONDS = 30
+SCHEDULER_THROTTLE_RATIO = 1.0  # sleep this much per unit of work when throttled (1.0 = half speed)
+SCHEDULER_MAX_THROTTLE_SLEEP = 5
+SCHEDULER_HISTORY_SIZE = 20
+SCHEDULER_DEFAULTS = {
+    "enabled": True,
+    "temp_throttle_c": 70,
+    "temp_pause_c": 80,  # the Pi 4 firmware starts throttling at 80-85C
+    "load_throttle": 1.0,  # 1-minute load average per core
+    "load_pause": 2.0,
+    "iowait_throttle": 25,  # percent of CPU time waiting on I/O
+    "iowait_pause": 50,
+    "streams": "throttle",  # what active media streams do to jobs: throttle, pause or ignore
+    "windows": {},  # job kind -> ["HH:MM-HH:MM", ...]; "default" applies to kinds not listed
+    "media_server_api_key": ""
+}
+MEDIA_SERVER_SESSION_PORTS = {"jellyfin": 8096, "emby": 8096, "plex": 32400}
+
+# Raised inside a job's checkpoint when the job has been cancelled
+class SchedulerJobCancelled(Exception):
+    pass
+
+_scheduler_state = {"current": None, "conditions": None, "sampled": 0, "cpu_times": None,
+                    "streams": None, "streams_sampled": 0, "paused_on": set(), "decision": None}
+_scheduler_jobs = []
+_scheduler_cond = threading.Condition()
+_scheduler_thread = None
+_scheduler_local = threading.local()
+
+# Read the CPU temperature in Celsius, or None if the board does not report it
+def get_cpu_temperature():
+    try:
+        # Try to get temperature from thermal_zone0
+        if os.path.exists('/sys/class/thermal/thermal_zone0/temp'):
+            with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
+                return float(f.read().strip()) / 1000.0  # Convert from millidegrees to degrees
+        
+        # For Raspberry Pi, alternatively try vcgencmd
+        elif os.path.exists('/usr/bin/vcgencmd'):
+            try:
+                temp_output = os.popen("vcgencmd measure_temp").readline()
+                return float(temp_output.replace("temp=", "").replace("'C\n", ""))
+            except Exception as e:
+                print(f"Error getting temperature from vcgencmd: {e}")
+    except Exception as e:
+        print(f"Error getting CPU temperature: {e}")
+    return None
+
+# Read aggregate CPU times (total, iowait) from /proc/stat
+def read_cpu_times():
+    try:
+        with open("/proc/stat", "r") as f:
+            values = [int(v) for v in f.readline().split()[1:]]
+        return sum(values), values[4]
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Get scheduler settings with config.json overrides applied
+def get_scheduler_settings(config):
+    settings = dict(SCHEDULER_DEFAULTS)
+    settings.update(config.get("scheduler", {}))
+    return settings
+
+# Count active playback sessions on the deployed media server; None if it can't be asked
+def get_active_streams(settings, media_server):
+    if not settings["media_server_api_key"] or media_server not in MEDIA_SERVER_SESSION_PORTS:
+        return None
+    import requests
+
+    url = f"http://127.0.0.1:{MEDIA_SERVER_SESSION_PORTS[media_server]}"
+    try:
+        if media_server == "plex":
+            response = requests.get(f"{url}/status/sessions", timeout=2, headers={
+                "Accept": "application/json", "X-Plex-Token": settings["media_server_api_key"]})
+            response.raise_for_status()
+            return int(response.json()["MediaContainer"].get("size", 0))
+        response = requests.get(f"{url}/Sessions", params={"activeWithinSeconds": 120}, timeout=2,
+                                headers={"X-Emby-Token": settings["media_server_api_key"]})
+        response.raise_for_status()
+        return sum(1 for session in response.json() if session.get("NowPlayingItem"))
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"Warning: Failed to get active streams from {media_server}: {e}")
+        return None
+
+# Sample temperature, load, I/O wait and active streams, at most every few seconds
+def get_scheduler_conditions(settings, media_server=None):
+    now = time.monotonic()
+    with _scheduler_cond:
+        if _scheduler_state["conditions"] and now - _scheduler_state["sampled"] < SCHEDULER_SAMPLE_SECONDS:
+            return _scheduler_state["conditions"]
+    
+    conditions = {"temperature_c": get_cpu_temperature(), "load_per_core": None, "iowait_percent": None}
+    try:
+        conditions["load_per_core"] = round(os.getloadavg()[0] / (os.cpu_count() or 1), 2)
+    except OSError:
+        pass
+    # I/O wait is a share of CPU time, so it needs two samples
+    cpu_times = read_cpu_times()
+    previous = _scheduler_state["cpu_times"]
+    if cpu_times and previous and cpu_times[0] > previous[0]:
+        conditions["iowait_percent"] = round((cpu_times[1] - previous[1]) * 100 / (cpu_times[0] - previous[0]), 1)
+    
+    streams = _scheduler_state["streams"]
+    if settings["streams"] != "ignore" and now - _scheduler_state["streams_sampled"] >= SCHEDULER_STREAMS_SAMPLE_SECONDS:
+        streams = get_active_streams(settings, media_server)
+        _scheduler_state["streams_sampled"] = now
+    conditions["active_streams"] = streams
+    
+    with _scheduler_cond:
+        _scheduler_state.update(conditions=conditions, sampled=now, cpu_times=cpu_times, streams=streams)
+    return conditions
+
+# Check whether the current time is inside any of the "HH:MM-HH:MM" windows (none means always)
+def in_time_window(windows, now=None):
+    if not windows:
+        return True
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for window in windows:
+        start, end = [int(part[:2]) * 60 + int(part[3:5]) for part in window.split("-")]
+        # Windows may wrap past midnight, e.g. 23:00-06:00
+        if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+            return True
+    return False
+
+# Get the time windows that apply to a job kind
+def get_job_windows(settings, kind):
+    windows = settings["windows"]
+    return windows.get(kind, windows.get("default", []))
+
+# Decide whether jobs of a kind may run now: run, throttle or pause, with the reasons;
+# record=False leaves the pause hysteresis untouched (for read-only callers)
+def get_scheduler_decision(kind, settings=None, conditions=None, record=True):
+    if settings is None:
+        settings = get_scheduler_settings(load_config())
+    if not settings["enabled"]:
+        return {"action": "run", "reasons": []}
+    if conditions is None:
+        conditions = get_scheduler_conditions(settings, get_selected_media_server(load_services()))
+    
+    pause, throttle = [], []
+    if not in_time_window(get_job_windows(settings, kind)):
+        pause.append("outside time window")
+    metrics = [
+        ("temperature", conditions.get("temperature_c"), settings["temp_throttle_c"], settings["temp_pause_c"]),
+        ("load", conditions.get("load_per_core"), settings["load_throttle"], settings["load_pause"]),
+        ("iowait", conditions.get("iowait_percent"), settings["iowait_throttle"], settings["iowait_pause"])
+    ]
+    with _scheduler_cond:
+        paused_on = _scheduler_state["paused_on"] if record else set(_scheduler_state["paused_on"])
+        for name, value, throttle_at, pause_at in metrics:
+            if value is None:
+                continue
+            if value >= pause_at:
+                pause.append(f"{name} {value} >= {pause_at}")
+                paused_on.add(name)
+            elif value >= throttle_at:
+                # Once paused on a metric, stay paused until it drops below the throttle level
+                (pause if name in paused_on else throttle).append(f"{name} {value} >= {throttle_at}")
+            else:
+                paused_on.discard(name)
+    if conditions.get("active_streams") and settings["streams"] in ("throttle", "pause"):
+        (pause if settings["streams"] == "pause" else throttle).append(f"{conditions['active_streams']} active streams")
+    
+    action = "pause" if pause else "throttle" if throttle else "run"
+    decision = {"action": action, "reasons": pause + throttle}
+    if record:
+        with _scheduler_cond:
+            _scheduler_state["decision"] = decision
+    return decision
+
+# Get the decision for a running job, re-evaluated at most once a second
+def _get_job_decision(job):
+    now = time.monotonic()
+    if job["_decision"] is None or now - job["_decided"] >= 1:
+        conditions = get_scheduler_conditions(job["_settings"], job["_media_server"])
+        job["_decision"] = get_scheduler_decision(job["kind"], job["_settings"], conditions)
+        job["_decided"] = now
+    return job["_decision"]
+
+# Get the scheduler job the calling thread is working for, if any
+def get_current_job():
+    return getattr(_scheduler_local, "current", None)
+
+# Wrap func so a pool worker running it works for the calling thread's job
+def bind_scheduler_job(func):
+    job = get_current_job()
+    
+    def run(*args, **kwargs):
+        _scheduler_local.current = job
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _scheduler_local.current = None
+    return run
+
+# Make checkpoints on this thread do nothing for the block, for work that must not sit
+# paused part way (e.g. while a container is stopped)
+@contextmanager
+def scheduler_uninterruptible():
+    depth = getattr(_scheduler_local, "uninterruptible", 0)
+    _scheduler_local.uninterruptible = depth + 1
+    try:
+        yield
+    finally:
+        _scheduler_local.uninterruptible = depth
+
+# Called by heavy jobs between units of work: blocks while paused, slows down while throttled.
+# Does nothing on threads that are not working for a job, such as request handlers.
+def scheduler_checkpoint():
+    job = get_current_job()
+    if job is None or getattr(_scheduler_local, "uninterruptible", 0):
+        return
+    
+    waited = 0.0
+    while True:
+        if job["cancel"].is_set():
+            raise SchedulerJobCancelled(f"Job {job['id']} was cancelled")
+        decision = _get_job_decision(job)
+        job["reasons"] = decision["reasons"]
+        if decision["action"] != "pause":
+            break
+        job["state"] = "paused"
+        started = time.monotonic()
+        job["cancel"].wait(SCHEDULER_SAMPLE_SECONDS)
+        waited += time.monotonic() - started
+    
+    sleep = 0.0
+    now = time.monotonic()
+    if decision["action"] == "throttle":
+        # Sleep in proportion to the work done since this thread's last checkpoint
+        last = getattr(_scheduler_local, "last", None)
+        if last is not None and getattr(_scheduler_local, "job", None) == job["id"]:
+            sleep = min((now - last) * SCHEDULER_THROTTLE_RATIO, SCHEDULER_MAX_THROTTLE_SLEEP)
+        job["state"] = "throttled"
+        time.sleep(sleep)
+    else:
+        job["state"] = "running"
+    
+    with _scheduler_cond:
+        job["paused_seconds"] = round(job["paused_seconds"] + waited, 2)
+        job["throttled_seconds"] = round(job["throttled_seconds"] + sleep, 2)
+    _scheduler_local.last = time.monotonic()
+    _scheduler_local.job = job["id"]
+
+# Queue a heavy job; a job with the same name that is already queued or running is returned instead
+def submit_job(name, kind, func, *args, **kwargs):
+    with _scheduler_cond:
+        for job in _scheduler_jobs:
+            if job["name"] == name and job["state"] not in ("done", "failed", "cancelled"):
+                return job
+        job = {
+            "id": f"{int(time.time() * 1000):x}-{len(_scheduler_jobs)}",
+            "name": name,
+            "kind": kind,
+            "state": "queued",
+            "reasons": [],
+            "submitted": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "started": None,
+            "finished": None,
+            "paused_seconds": 0.0,
+            "throttled_seconds": 0.0,
+            "result": None,
+            "error": None,
+            "cancel": threading.Event(),
+            "call": (func, args, kwargs),
+            "_settings": None,
+            "_media_server": None,
+            "_decision": None,
+            "_decided": 0
+        }
+        _scheduler_jobs.append(job)
+        # Keep every unfinished job, plus the most recent finished ones
+        finished = [j for j in _scheduler_jobs if j["state"] in ("done", "failed", "cancelled")]
+        for old in finished[:-SCHEDULER_HISTORY_SIZE]:
+            _scheduler_jobs.remove(old)
+        _scheduler_cond.notify_all()
+    ensure_scheduler()
+    return job
+
+# Run queued jobs one at a time, each when its window is open and conditions allow
+def _scheduler_loop():
+    while True:
+        with _scheduler_cond:
+            settings = get_scheduler_settings(load_config())
+            job = None
+            for queued in _scheduler_jobs:
+                if queued["state"] not in ("queued", "waiting_window"):
+                    continue
+                if queued["cancel"].is_set():
+                    queued["state"] = "cancelled"
+                elif settings["enabled"] and not in_time_window(get_job_windows(settings, queued["kind"])):
+                    queued["state"] = "waiting_window"
+                elif job is None:
+                    job = queued
+            if job is None:
+                _scheduler_cond.wait(SCHEDULER_SAMPLE_SECONDS)
+                continue
+            job["state"] = "running"
+            job["started"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            job["_settings"] = settings
+            job["_media_server"] = get_selected_media_server(load_services())
+            _scheduler_state["current"] = job
+        
+        func, args, kwargs = job["call"]
+        _scheduler_local.current = job
+        try:
+            # Don't start while conditions call for a pause
+            scheduler_checkpoint()
+            job["result"] = func(*args, **kwargs)
+            job["state"] = "done"
+        except SchedulerJobCancelled:
+            job["state"] = "cancelled"
+        except Exception as e:
+            print(f"Warning: Job {job['name']} failed: {e}")
+            job["error"] = str(e)
+            job["state"] = "failed"
+        finally:
+            with _scheduler_cond:
+                job["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                _scheduler_state["current"] = None
+            _scheduler_local.current = None
+
+# Start the scheduler thread if it is not running
+def ensure_scheduler():
+    global _scheduler_thread
+    with _scheduler_cond:
+        if _scheduler_thread is None or not _scheduler_thread.is_alive():
+            _scheduler_thread = threading.Thread(target=_scheduler_loop, daemon=True)
+            _scheduler_thread.start()
+
+# Get a job as returned by the API
+def describe_job(job):
+    return {key: value for key, value in job.items() if key not in ("cancel", "call") and not key.startswith("_")}
+
+# Cancel a queued job, or ask a running one to stop at its next checkpoint
+def cancel_job(job_id):
+    with _scheduler_cond:
+        for job in _scheduler_jobs:
+            if job["id"] == job_id:
+                job["cancel"].set()
+                if job["state"] in ("queued", "waiting_window"):
+                    job["state"] = "cancelled"
+                _scheduler_cond.notify_all()
+                return job
+    return None
+
+# Container log streaming settings
+LOG_TAIL_DEFAULT = 100
+LOG_TAIL_MAX = 10000
+LOG_STREAM_BUFFER_LINES = 1000  # per viewer; oldest lines are dropped beyond this
+LOG_LINE_MAX_BYTES = 16384
+LOG_KEEPALIVE_SECONDS = 15
+
+# One shared `docker logs --follow` reader per container, fanned out to all viewers
+_log_streams = {}
+_log_streams_lock = threading.Lock()
+
+# Build the docker logs command for a container
+def build_docker_logs_command(name, tail=None, since=None, follow=False):
+    cmd = ["docker", "logs", "--timestamps"]
+    if follow:
+        cmd.append("--follow")
+    if tail is not None:
+        cmd += ["--tail", str(tail)]
+    if since:
+        cmd += ["--since", since]
+    cmd.append(name)
+    return cmd
+
+# Read lines from a docker logs pipe without ever holding more than one capped line
+def _read_log_lines(pipe):
+    truncated = False
+    while True:
+        raw = pipe.readline(LOG_LINE_MAX_BYTES)
+        if not raw:
+            return
+        complete = raw.endswith(b"\n")
+        # The rest of an over-long line is skipped
+        if not truncated:
+            line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            yield line if complete else line + " [truncated]"
+        truncated = not complete
+
+# Queue a line for one viewer, dropping its oldest line if the viewer is falling behind
+def _offer_log_line(subscriber, line):
+    while True:
+        try:
+            subscriber["queue"].put_nowait(line)
+            return
+        except queue.Full:
+            try:
+                subscriber["queue"].get_nowait()
+                subscriber["dropped"] += 1
+            except queue.Empty:
+                pass
+
+# Copy lines from the shared docker logs process to every viewer
+def _pump_container_logs(name, stream):
+    for line in _read_log_lines(stream["process"].stdout):
+        with _log_streams_lock:
+            subscribers = list(stream["subscribers"])
+        for subscriber in subscribers:
+            _offer_log_line(subscriber, line)
+    stream["process"].wait()
+    
+    with _log_streams_lock:
+        if _log_streams.get(name) is stream:
+            del _log_streams[name]
+        subscribers = list(stream["subscribers"])
+    # Tell remaining viewers the log has ended (container removed or stopped)
+    for subscriber in subscribers:
+        _offer_log_line(subscriber, None)
+
+# Attach a viewer to a container's shared log reader, starting it if needed
+def subscribe_container_logs(name):
+    subscriber = {"queue": queue.Queue(maxsize=LOG_STREAM_BUFFER_LINES), "dropped": 0}
+    with _log_streams_lock:
+        stream = _log_streams.get(name)
+        if stream is None:
+            process = subprocess.Popen(
+                build_docker_logs_command(name, tail=0, follow=True),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            )
+            stream = {"process": process, "subscribers": []}
+            _log_streams[name] = stream
+            threading.Thread(target=_pump_container_logs, args=(name, stream), daemon=True).start()
+        stream["subscribers"].append(subscriber)
+    return subscriber
+
+# Detach a viewer, stopping the shared reader once nobody is watching
+def unsubscribe_container_logs(name, subscriber):
+    with _log_streams_lock:
+        stream = _log_streams.get(name)
+        if stream is None or subscriber not in stream["subscribers"]:
+            return
+        stream["subscribers"].remove(subscriber)
+        if stream["subscribers"]:
+            return
+        del _log_streams[name]
+    stream["process"].terminate()
+
+# Format one log line for the response
+def format_log_line(line, sse):
+    if sse:
+        return f"data: {line}\n\n"
+    return line + "\n"
+
+# Generate a container's log lines: the requested backlog, then live lines in follow mode
+def stream_container_logs(name, tail, since=None, follow=False, sse=False):
+    # Subscribe before reading the backlog so no line is lost in between
+    subscriber = subscribe_container_logs(name) if follow else None
+    try:
+        last_timestamp = ""
+        backlog = subprocess.Popen(
+            build_docker_logs_command(name, tail=tail, since=since),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        try:
+            for line in _read_log_lines(backlog.stdout):
+                last_timestamp = line.split(" ", 1)[0]
+                yield format_log_line(line, sse)
+        finally:
+            backlog.stdout.close()
+            backlog.kill()
+            backlog.wait()
+        if not follow:
+            return
+        
+        dropped = 0
+        while True:
+            try:
+                line = subscriber["queue"].get(timeout=LOG_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                # A write to a viewer that has gone away fails, which ends this generator and
+                # its subscription; plain-text viewers get an empty line
+                yield ": keepalive\n\n" if sse else "\n"
+                continue
+            if subscriber["dropped"] != dropped:
+                missed = subscriber["dropped"] - dropped
+                dropped = subscriber["dropped"]
+                yield f"event: dropped\ndata: {missed}\n\n" if sse else f"[{missed} lines dropped]\n"
+            if line is None:
+                if sse:
+                    yield "event: end\ndata: \n\n"
+                return
+            # Docker's timestamps are fixed-width, so lines already sent in the backlog compare lower
+            if line.split(" ", 1)[0] <= last_timestamp:
+                continue
+            yield format_log_line(line, sse)
+    finally:
+        if subscriber is not None:
+            unsubscribe_container_logs(name, subscriber)
+
+# Fleet fan-out settings
+FLEET_TIMEOUT = 5  # default seconds per node request
+FLEET_MAX_WORKERS = 8
+FLEET_CONTAINER_ACTIONS = ["start", "stop", "restart"]
+LOCAL_NODE_NAME = "local"
+
+# One pooled HTTP session shared by all fan-outs so connections to peers are reused
+_fleet_session = None
+_fleet_session_lock = threading.Lock()
+
+# Create an HTTP session whose connection pool fits the given number of parallel requests
+def create_http_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Get the shared HTTP session for talking to peer nodes
+def get_fleet_session():
+    global _fleet_session
+    with _fleet_session_lock:
+        if _fleet_session is None:
+            _fleet_session = create_http_session(FLEET_MAX_WORKERS)
+        return _fleet_session
+
+# Make one request to a peer node, always returning a result rather than raising
+def fleet_node_request(node, method, path, body=None):
+    import requests
+
+    url = node["url"].rstrip("/") + path
+    started = time.monotonic()
+    result = {"node": node["name"], "url": node["url"], "ok": False}
+    try:
+        response = get_fleet_session().request(method, url, json=body, timeout=node.get("timeout", FLEET_TIMEOUT))
+        response.raise_for_status()
+        result["data"] = response.json()
+        # Some endpoints report failures as {"status": "error"} with a 200
+        if isinstance(result["data"], dict) and result["data"].get("status") == "error":
+            result["error"] = result["data"].get("message", "Node reported an error")
+        else:
+            result["ok"] = True
+    except requests.exceptions.Timeout:
+        result["error"] = f"Timed out after {node.get('timeout', FLEET_TIMEOUT)}s"
+    except (requests.exceptions.RequestException, ValueError) as e:
+        result["error"] = str(e)
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+# Send the same request to many nodes concurrently; failed nodes are reported, not fatal
+def fleet_fan_out(nodes, method, path, body=None, local_handler=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    results = []
+    futures = []
+    if nodes:
+        with ThreadPoolExecutor(max_workers=min(len(nodes), FLEET_MAX_WORKERS)) as executor:
+            futures = [executor.submit(fleet_node_request, node, method, path, body) for node in nodes]
+            # This node answers in-process while the peers are being queried
+            if local_handler:
+                results.append(_run_local_fleet_handler(local_handler))
+            results.extend(future.result() for future in futures)
+    elif local_handler:
+        results.append(_run_local_fleet_handler(local_handler))
+
+    return {
+        "nodes": results,
+        "summary": {
+            "total": len(results),
+            "ok": sum(1 for r in results if r["ok"]),
+            "failed": [r["node"] for r in results if not r["ok"]]
+        }
+    }
+
+# Run this node's part of a fan-out in-process
+def _run_local_fleet_handler(handler):
+    started = time.monotonic()
+    result = {"node": LOCAL_NODE_NAME, "url": None, "ok": False}
+    try:
+        result["data"] = handler()
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+# Get enabled peer nodes, optionally limited to the given names
+def get_fleet_nodes(names=None):
+    nodes = [node for node in load_fleet().get("nodes", []) if node.get("enabled", True)]
+    if names:
+        nodes = [node for node in nodes if node["name"] in names]
+    return nodes
+
+# Combine per-node /api/status results into one container list
+def aggregate_fleet_status(fan_out):
+    containers = []
+    for result in fan_out["nodes"]:
+        if not result["ok"]:
+            continue
+        for name, container in result["data"].get("containers", {}).items():
+            if name == "error":
+                continue
+            containers.append({"node": result["node"], "name": name, **container})
+    fan_out["containers"] = containers
+    fan_out["summary"]["running"] = sum(1 for c in containers if c["status"] == "running")
+    fan_out["summary"]["stopped"] = sum(1 for c in containers if c["status"] != "running")
+    return fan_out
+
+# Image update check settings
+IMAGE_UPDATE_CACHE_TTL = 6 * 3600  # seconds a remote digest is trusted before asking again
+IMAGE_CHECK_MAX_WORKERS = 4
+IMAGE_CHECK_TIMEOUT = 10
+DEFAULT_REGISTRY = "registry-1.docker.io"
+# Registries on this machine are spoken to over plain HTTP, as Docker itself does
+INSECURE_REGISTRY_HOSTS = ["localhost", "127.0.0.1"]
+# Ask for the multi-arch index first, which is what `docker pull <tag>` records locally
+MANIFEST_ACCEPT = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json"
+])
+
+_registry_session = None
+_registry_tokens = {}
+_registry_lock = threading.Lock()
+_registry_token_lock = threading.Lock()
+
+# Get the shared HTTP session for registry requests
+def get_registry_session():
+    global _registry_session
+    with _registry_lock:
+        if _registry_session is None:
+            _registry_session = create_http_session(IMAGE_CHECK_MAX_WORKERS)
+        return _registry_session
+
+# Find the generated docker-compose.yml
+def find_compose_file():
+    docker_compose_file = os.path.join(BASE_DIR, "docker-compose.yml")
+    if not os.path.exists(docker_compose_file):
+        docker_compose_file = os.path.join(DOCKER_COMPOSE_DIR, "docker-compose.yml")
+    return docker_compose_file
+
+# Map each service in a generated (fully resolved) compose file to its image
+def get_compose_images(compose_file=None):
+    compose_file = compose_file or find_compose_file()
+    images = {}
+    if not os.path.exists(compose_file):
+        return images
+    
+    in_services = False
+    service = None
+    with open(compose_file, "r") as f:
+        for line in f:
+            if re.match(r'^\S', line):
+                in_services = line.startswith("services:")
+                service = None
+                continue
+            if not in_services:
+                continue
+            match = re.match(r'^  ([\w.-]+):\s*$', line)
+            if match:
+                service = match.group(1)
+                continue
+            match = re.match(r'^    image:\s*[\'"]?([^\'"\s]+)', line)
+            if match and service:
+                images[service] = match.group(1)
+    return images
+
+# Split an image reference into registry, repository, tag and pinned digest
+def parse_image_reference(image):
+    name, digest = image, None
+    if "@" in name:
+        name, digest = name.split("@", 1)
+    tag = "latest"
+    if ":" in name.rsplit("/", 1)[-1]:
+        name, tag = name.rsplit(":", 1)
+    
+    # The first path component is a registry only if it looks like a host name
+    parts = name.split("/", 1)
+    if len(parts) == 2 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+        registry, repository = parts
+    else:
+        registry, repository = DEFAULT_REGISTRY, name
+    if registry in ("docker.io", "index.docker.io"):
+        registry = DEFAULT_REGISTRY
+    if registry == DEFAULT_REGISTRY and "/" not in repository:
+        repository = f"library/{repository}"
+    return {"registry": registry, "repository": repository, "tag": tag, "digest": digest}
+
+# Get the base URL of a registry's v2 API
+def get_registry_url(registry):
+    host = registry.rsplit(":", 1)[0] if registry.count(":") == 1 else registry
+    scheme = "http" if host in INSECURE_REGISTRY_HOSTS else "https"
+    return f"{scheme}://{registry}/v2"
+
+# Get an anonymous bearer token for a registry auth challenge, reusing it until it expires
+def get_registry_token(challenge):
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop("realm", None)
+    if not realm:
+        raise ValueError(f"Unsupported registry auth challenge: {challenge}")
+    key = (realm, params.get("service"), params.get("scope"))
+    # Parallel checks hitting the same challenge wait for one token fetch instead of each making one
+    with _registry_token_lock:
+        token, expires = _registry_tokens.get(key, (None, 0))
+        if token and expires > time.monotonic():
+            return token
+        
+        response = get_registry_session().get(realm, params=params, timeout=IMAGE_CHECK_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        token = data.get("token") or data.get("access_token")
+        # Renew a little early so a token never expires between the check and its use
+        _registry_tokens[key] = (token, time.monotonic() + max(int(data.get("expires_in", 60)) - 10, 0))
+        return token
+
+# Get the current manifest digest of an image tag with a HEAD request (no layers are pulled)
+def fetch_remote_digest(image, cached=None):
+    ref = parse_image_reference(image)
+    url = f"{get_registry_url(ref['registry'])}/{ref['repository']}/manifests/{ref['tag']}"
+    headers = {"Accept": MANIFEST_ACCEPT}
+    # Conditional request: the registry answers 304 if the tag still points at the same manifest
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    
+    session = get_registry_session()
+    response = session.head(url, headers=headers, timeout=IMAGE_CHECK_TIMEOUT)
+    challenge = response.headers.get("WWW-Authenticate", "")
+    if response.status_code == 401 and challenge.lower().startswith("bearer"):
+        headers["Authorization"] = f"Bearer {get_registry_token(challenge)}"
+        response = session.head(url, headers=headers, timeout=IMAGE_CHECK_TIMEOUT)
+    
+    if response.status_code == 304 and cached:
+        return {"digest": cached["digest"], "etag": cached["etag"], "not_modified": True}
+    response.raise_for_status()
+    digest = response.headers.get("Docker-Content-Digest")
+    if not digest:
+        raise ValueError(f"Registry returned no digest for {image}")
+    return {"digest": digest, "etag": response.headers.get("ETag"), "not_modified": False}
+
+# Inspect locally present images: ID, architecture, repository digests and tags; missing images are left out
+def inspect_local_images(images):
+    if not images:
+        return {}
+    try:
+        # Missing images make docker exit non-zero but the others are still printed
+        result = subprocess.run(["docker", "image", "inspect", *images], capture_output=True, text=True, timeout=30)
+        inspected = json.loads(result.stdout or "[]")
+    except (subprocess.TimeoutExpired, FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Warning: Failed to inspect local images: {e}")
+        return {}
+    
+    by_tag = {}
+    for image in inspected:
+        info = {
+            "id": image["Id"],
+            "architecture": image.get("Architecture"),
+            "repo_digests": [digest.split("@", 1)[1] for digest in image.get("RepoDigests") or []],
+            "tags": image.get("RepoTags") or []
+        }
+        for tag in info["tags"]:
+            by_tag[tag] = info
+    found = {}
+    for image in images:
+        info = by_tag.get(image, by_tag.get(f"{image}:latest"))
+        if info:
+            found[image] = info
+    return found
+
+# Get the repository digests of locally pulled images
+def get_local_image_digests(images):
+    local = inspect_local_images(images)
+    return {image: local[image]["repo_digests"] if image in local else [] for image in images}
+
+# Load cached remote digests
+def load_image_update_cache():
+    if os.path.exists(IMAGE_UPDATES_FILE):
+        try:
+            with open(IMAGE_UPDATES_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Failed to read image update cache: {e}")
+    return {"images": {}}
+
+# Save cached remote digests
+def save_image_update_cache(cache):
+    with open(IMAGE_UPDATES_FILE, "w") as f:
+        json.dump(cache, f, indent=2)
+
+# Check which services' images have a newer digest in their registry
+def check_image_updates(images_by_service, force=False):
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = load_image_update_cache()
+    now = time.time()
+    images = sorted(set(images_by_service.values()))
+    remote = {}
+    to_check = []
+    for image in images:
+        # Images pinned by digest never change
+        if parse_image_reference(image)["digest"]:
+            continue
+        entry = cache["images"].get(image)
+        if entry and not force and now - entry["checked"] < IMAGE_UPDATE_CACHE_TTL:
+            remote[image] = dict(entry, cached=True)
+        else:
+            to_check.append(image)
+    
+    if to_check:
+        with ThreadPoolExecutor(max_workers=min(len(to_check), IMAGE_CHECK_MAX_WORKERS)) as executor:
+            futures = {image: executor.submit(fetch_remote_digest, image, cache["images"].get(image)) for image in to_check}
+            for image, future in futures.items():
+                try:
+                    result = future.result()
+                    entry = {"digest": result["digest"], "etag": result["etag"], "checked": now}
+                    cache["images"][image] = entry
+                    remote[image] = dict(entry, cached=result["not_modified"])
+                except Exception as e:
+                    remote[image] = {"error": str(e)}
+        try:
+            save_image_update_cache(cache)
+        except OSError as e:
+            print(f"Warning: Failed to save image update cache: {e}")
+    
+    local = get_local_image_digests(images)
+    services = {}
+    for service, image in sorted(images_by_service.items()):
+        ref = parse_image_reference(image)
+        entry = {"image": image, "local_digests": local.get(image, []), "update_available": False}
+        if ref["digest"]:
+            entry["status"] = "pinned"
+        elif "error" in remote[image]:
+            entry["status"] = "error"
+            entry["error"] = remote[image]["error"]
+        else:
+            entry["remote_digest"] = remote[image]["digest"]
+            entry["checked"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(remote[image]["checked"]))
+            entry["cached"] = remote[image]["cached"]
+            if not entry["local_digests"]:
+                entry["status"] = "not_pulled"
+            elif entry["remote_digest"] in entry["local_digests"]:
+                entry["status"] = "up_to_date"
+            else:
+                entry["status"] = "update_available"
+                entry["update_available"] = True
+        services[service] = entry
+    
+    return {
+        "services": services,
+        "summary": {
+            "images_checked": len(to_check),
+            "images_cached": len(images) - len(to_check),
+            "updates_available": sorted(s for s, e in services.items() if e["update_available"]),
+            "errors": sorted(s for s, e in services.items() if e["status"] == "error")
+        }
+    }
+
+# Pull and recreate only the given services, or every service with an update available
+def apply_image_updates(service_names=None):
+    compose_file = find_compose_file()
+    images = get_compose_images(compose_file)
+    if not images:
+        raise ValueError(f"No services found in {compose_file}")
+    
+    if service_names is None:
+        targets = check_image_updates(images)["summary"]["updates_available"]
+    else:
+        unknown = [name for name in service_names if name not in images]
+        if unknown:
+            raise ValueError(f"Unknown services: {', '.join(unknown)}")
+        targets = list(service_names)
+    if not targets:
+        return {"status": "success", "updated": []}
+    
+    # A pull can't be paused part way, so wait for good conditions before starting it
+    scheduler_checkpoint()
+    subprocess.run(["docker", "compose", "-f", compose_file, "pull", *targets], check=True, capture_output=True, timeout=1800)
+    # --no-deps keeps the VPN and other shared containers running
+    subprocess.run(["docker", "compose", "-f", compose_file, "up", "-d", "--no-deps", *targets], check=True, capture_output=True, timeout=300)
+    return {"status": "success", "updated": targets}
+
+# Image bundle settings
+IMAGE_BUNDLE_INDEX = "bundle.json"
+IMAGE_BUNDLE_CHUNK_SIZE = 1024 * 1024
+IMAGE_BUNDLE_LOAD_TIMEOUT = 1800
+IMAGE_BUNDLE_DEFAULTS = {
+    "path": "",  # a USB disk or network share lets other nodes and reinstalls use the bundle
+    "export_after_install": True
+}
+
+_image_bundle_lock = threading.Lock()
+_image_bundle_reports = {"export": None, "import": None}
+
+# Get image bundle settings from config.json over the defaults
+def get_image_bundle_settings(config):
+    settings = dict(IMAGE_BUNDLE_DEFAULTS)
+    settings.update(config.get("image_bundle", {}))
+    return settings
+
+# Check whether a bundle has been exported to a path
+def has_image_bundle(path):
+    return bool(path) and os.path.exists(os.path.join(path, IMAGE_BUNDLE_INDEX))
+
+# Load a bundle's index of images and blobs
+def load_image_bundle(path):
+    index_path = os.path.join(path, IMAGE_BUNDLE_INDEX)
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Failed to read image bundle index: {e}")
+    return {"images": {}, "blobs": {}}
+
+# Save a bundle's index, replacing the old one in one step so another node never reads half of it
+def save_image_bundle(path, bundle):
+    index_path = os.path.join(path, IMAGE_BUNDLE_INDEX)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(bundle, f, indent=2)
+    os.replace(index_path + ".tmp", index_path)
+
+# Get the file holding a blob
+def get_image_bundle_blob_path(path, digest):
+    return os.path.join(path, "blobs", "sha256", digest.split(":", 1)[1])
+
+# Sum a bundle's stored size and the size the same images would take as separate archives
+def summarize_image_bundle(bundle):
+    blobs = bundle.get("blobs", {})
+    logical = 0
+    for entry in bundle.get("images", {}).values():
+        logical += sum(blobs.get(digest, 0) for digest in {m["digest"] for m in entry["members"] if m.get("digest")})
+    return {
+        "images": len(bundle.get("images", {})),
+        "blobs": len(blobs),
+        "size_bytes": sum(blobs.values()),
+        "logical_bytes": logical
+    }
+
+# Get the architecture the Docker engine runs images for (e.g. arm64)
+def get_docker_architecture():
+    try:
+        result = subprocess.run(["docker", "version", "--format", "{{.Server.Arch}}"],
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return None
+
+# Copy one file into the bundle's blob store under its sha256; returns the digest and bytes written
+def _store_image_bundle_blob(path, fileobj):
+    import hashlib
+    import tempfile
+
+    blob_dir = os.path.join(path, "blobs", "sha256")
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=blob_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: fileobj.read(IMAGE_BUNDLE_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        blob = f"sha256:{digest.hexdigest()}"
+        blob_path = get_image_bundle_blob_path(path, blob)
+        # A layer shared with an image already in the bundle is kept once
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+            return blob, size, 0
+        os.replace(tmp_path, blob_path)
+        return blob, size, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# Stream `docker save` for one image into the bundle, recording its archive layout
+def _save_image_to_bundle(path, image):
+    import tarfile
+
+    members = []
+    blobs = {}
+    written = 0
+    proc = subprocess.Popen(["docker", "save", image], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            for member in tar:
+                entry = {"name": member.name, "mode": member.mode, "mtime": member.mtime}
+                if member.isdir():
+                    entry["kind"] = "dir"
+                elif member.issym() or member.islnk():
+                    entry["kind"] = "symlink" if member.issym() else "link"
+                    entry["linkname"] = member.linkname
+                elif member.isfile():
+                    entry["kind"] = "file"
+                    # Newer engines save OCI layouts whose blob names are already their digest
+                    match = re.match(r'^blobs/sha256/([0-9a-f]{64})$', member.name)
+                    if match and os.path.exists(get_image_bundle_blob_path(path, f"sha256:{match.group(1)}")):
+                        entry["digest"] = f"sha256:{match.group(1)}"
+                        blobs[entry["digest"]] = member.size
+                    else:
+                        entry["digest"], size, new_bytes = _store_image_bundle_blob(path, tar.extractfile(member))
+                        blobs[entry["digest"]] = size
+                        written += new_bytes
+                else:
+                    continue
+                members.append(entry)
+        # Drain the end-of-archive padding so docker can exit
+        proc.stdout.read()
+        stderr = proc.stderr.read().decode(errors="replace")
+        if proc.wait() != 0:
+            raise RuntimeError(f"docker save {image} failed: {stderr.strip()}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    return {"members": members}, blobs, written
+
+# Export the images referenced by the compose file into the bundle, sharing layers between images
+def export_image_bundle(config, compose_file=None):
+    path = get_image_bundle_settings(config)["path"]
+    if not path:
+        raise ValueError("No image bundle path configured (set image_bundle.path in config.json)")
+    images = sorted(set(get_compose_images(compose_file).values()))
+    if not images:
+        raise ValueError(f"No services found in {compose_file or find_compose_file()}")
+    os.makedirs(os.path.join(path, "blobs", "sha256"), exist_ok=True)
+    
+    started = time.monotonic()
+    report = {"exported": [], "unchanged": [], "not_present": [], "bytes_written": 0}
+    with _image_bundle_lock:
+        bundle = load_image_bundle(path)
+        local = inspect_local_images(images)
+        for image in images:
+            info = local.get(image)
+            if info is None:
+                # Keep what an earlier export stored; it is still the best copy there is
+                report["not_present"].append(image)
+                continue
+            if bundle["images"].get(image, {}).get("id") == info["id"]:
+                report["unchanged"].append(image)
+                continue
+            # Between images, so a pause never holds a docker save open
+            scheduler_checkpoint()
+            entry, blobs, written = _save_image_to_bundle(path, image)
+            entry.update(id=info["id"], architecture=info["architecture"])
+            entry["exported"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            bundle["images"][image] = entry
+            bundle["blobs"].update(blobs)
+            report["exported"].append(image)
+            report["bytes_written"] += written
+        
+        # The bundle holds exactly the compose file's images; drop the rest and blobs nothing uses
+        bundle["images"] = {image: entry for image, entry in bundle["images"].items() if image in images}
+        referenced = {m["digest"] for entry in bundle["images"].values() for m in entry["members"] if m.get("digest")}
+        bundle["blobs"] = {digest: size for digest, size in bundle["blobs"].items() if digest in referenced}
+        blob_dir = os.path.join(path, "blobs", "sha256")
+        for name in os.listdir(blob_dir):
+            if f"sha256:{name}" not in referenced:
+                os.remove(os.path.join(blob_dir, name))
+        bundle["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        save_image_bundle(path, bundle)
+    
+    report.update(summarize_image_bundle(bundle))
+    report["seconds"] = round(time.monotonic() - started, 1)
+    _image_bundle_reports["export"] = report
+    return report
+
+# Rebuild one image's `docker save` archive from the bundle and pipe it into `docker load`
+def _load_image_from_bundle(path, entry):
+    import tarfile
+
+    for member in entry["members"]:
+        if member.get("digest") and not os.path.exists(get_image_bundle_blob_path(path, member["digest"])):
+            raise FileNotFoundError(f"Bundle is missing blob {member['digest']}")
+    
+    proc = subprocess.Popen(["docker", "load", "-q"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                for member in entry["members"]:
+                    info = tarfile.TarInfo(member["name"])
+                    info.mode = member["mode"]
+                    info.mtime = member["mtime"]
+                    if member["kind"] == "dir":
+                        info.type = tarfile.DIRTYPE
+                        tar.addfile(info)
+                    elif member["kind"] in ("symlink", "link"):
+                        info.type = tarfile.SYMTYPE if member["kind"] == "symlink" else tarfile.LNKTYPE
+                        info.linkname = member["linkname"]
+                        tar.addfile(info)
+                    else:
+                        blob_path = get_image_bundle_blob_path(path, member["digest"])
+                        info.size = os.path.getsize(blob_path)
+                        with open(blob_path, "rb") as f:
+                            tar.addfile(info, f)
+            proc.stdin.close()
+        except BrokenPipeError:
+            # docker stopped reading; its output says why
+            pass
+        output = proc.stdout.read().decode(errors="replace")
+        if proc.wait(timeout=IMAGE_BUNDLE_LOAD_TIMEOUT) != 0:
+            raise RuntimeError(f"docker load failed: {output.strip()}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+# Load the compose file's images that are not present locally from the bundle
+def import_image_bundle(config, compose_file=None):
+    path = get_image_bundle_settings(config)["path"]
+    if not has_image_bundle(path):
+        raise ValueError(f"No image bundle found at {path or '(image_bundle.path not set)'}")
+    images_by_service = get_compose_images(compose_file)
+    images = sorted(set(images_by_service.values()))
+    
+    started = time.monotonic()
+    bundle = load_image_bundle(path)
+    local = inspect_local_images(images)
+    architecture = get_docker_architecture()
+    report = {"loaded": [], "present": [], "missing": [], "failed": {}}
+    for image in images:
+        entry = bundle["images"].get(image)
+        if image in local:
+            report["present"].append(image)
+        elif entry is None:
+            report["missing"].append(image)
+        elif architecture and entry.get("architecture") and entry["architecture"] != architecture:
+            report["missing"].append(image)
+            report["failed"][image] = f"Bundle has {entry['architecture']} image, engine runs {architecture}"
+        else:
+            try:
+                _load_image_from_bundle(path, entry)
+                report["loaded"].append(image)
+            except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+                report["missing"].append(image)
+                report["failed"][image] = str(e)
+    
+    # Layers shared with images that were already present would not have been downloaded anyway
+    def blob_set(image_list):
+        return {m["digest"] for image in image_list for m in bundle["images"].get(image, {}).get("members", []) if m.get("digest")}
+    saved = blob_set(report["loaded"]) - blob_set(report["present"])
+    report["download_bytes_saved"] = sum(bundle["blobs"].get(digest, 0) for digest in saved)
+    report["missing_services"] = sorted(service for service, image in images_by_service.items() if image in report["missing"])
+    report["bundle_bytes"] = summarize_image_bundle(bundle)["size_bytes"]
+    report["seconds"] = round(time.monotonic() - started, 1)
+    _image_bundle_reports["import"] = report
+    return report
+
+# Summarize a bundle import for the installation log
+def format_image_bundle_import(report):
+    lines = [
+        f"Image bundle ({report['bundle_bytes'] / 1e6:.0f} MB): loaded {len(report['loaded'])} images in {report['seconds']}s, "
+        f"{len(report['present'])} already present, {len(report['missing'])} to pull from the registry",
+        f"Download saved: about {report['download_bytes_saved'] / 1e6:.0f} MB (uncompressed layer size)"
+    ]
+    lines += [f"  {image}: {error}" for image, error in report["failed"].items()]
+    return "\n".join(lines)
+
+# Backup settings
+BACKUP_MANIFEST = "manifest.json"
+BACKUP_METADATA_MEMBER = ".pi-pvr-backup.json"
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_COMPRESS_LEVEL = 3  # higher gzip levels cost a Pi far more CPU than they save
+BACKUP_MAX_INCREMENTALS = 6  # after this many incrementals the next backup is a full one
+
+# Wraps a source file for tarfile: hashes what is read, and pads with zeros if the
+# file shrinks mid-read so the archive stays valid
+class _HashingReader:
+    def __init__(self, f, size):
+        import hashlib
+
+        self.f = f
+        self.remaining = size
+        self.hash = hashlib.sha256()
+        self.short = False
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        if len(data) < size:
+            self.short = True
+            data += b"\0" * (size - len(data))
+        self.remaining -= len(data)
+        self.hash.update(data)
+        return data
+
+# Counts bytes written to the destination, for throughput and size reporting
+class _CountingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.count += len(data)
+        return len(data)
+
+    def flush(self):
+        self.f.flush()
+
+# Get backup settings from config.json
+def get_backup_settings(config):
+    settings = config.get("backup", {})
+    return {
+        "destination": settings.get("destination", ""),
+        "compress_level": settings.get("compress_level", BACKUP_COMPRESS_LEVEL),
+        "max_incrementals": settings.get("max_incrementals", BACKUP_MAX_INCREMENTALS),
+        "allow_same_disk": settings.get("allow_same_disk", False)
+    }
+
+# Get a service's config directory under docker_dir
+def get_backup_source(config, service):
+    if not re.match(r'^[a-zA-Z0-9][a-zA-Z0-9_.-]*$', service):
+        raise ValueError(f"Invalid service name: {service}")
+    return os.path.join(config["docker_dir"], service)
+
+# Get (and create) the directory holding a service's backups
+def get_backup_dir(config, service):
+    settings = get_backup_settings(config)
+    if not settings["destination"]:
+        raise ValueError("No backup destination configured (set backup.destination in config.json)")
+    backup_dir = os.path.join(settings["destination"], service)
+    os.makedirs(backup_dir, exist_ok=True)
+    
+    # A backup on the disk it protects is lost with it, and reading and writing one disk halves throughput
+    if not settings["allow_same_disk"] and os.path.isdir(config["docker_dir"]) and \
+            os.stat(backup_dir).st_dev == os.stat(config["docker_dir"]).st_dev:
+        raise ValueError(f"Backup destination {settings['destination']} is on the same disk as {config['docker_dir']}")
+    return backup_dir
+
+# Load a service's backup manifest: the file index of the last backup and the backup chain
+def load_backup_manifest(backup_dir):
+    path = os.path.join(backup_dir, BACKUP_MANIFEST)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {"files": {}, "backups": []}
+
+# Save a service's backup manifest atomically
+def save_backup_manifest(backup_dir, manifest):
+    path = os.path.join(backup_dir, BACKUP_MANIFEST)
+    with open(path + ".partial", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".partial", path)
+
+# Hash a file without reading it into memory, optionally rate-limited; returns None if stopped
+def hash_file(path, max_bytes_per_second=None, stop=None):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b""):
+            if stop is not None and stop.is_set():
+                return None
+            scheduler_checkpoint()
+            pace_reads(_dedupe_pacer, len(chunk), max_bytes_per_second)
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Write a tar.gz of a service directory to fileobj as it is read; only files that differ
+# from previous_files are archived when it is given
+def write_backup_archive(source, fileobj, previous_files=None, compress_level=BACKUP_COMPRESS_LEVEL, metadata=None):
+    import io
+    import gzip
+    import tarfile
+
+    writer = _CountingWriter(fileobj)
+    files = {}
+    seen = set()
+    stats = {"files": 0, "archived": 0, "unchanged": 0, "archived_bytes": 0, "changed_during_backup": []}
+    
+    with gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=compress_level, mtime=0) as gz:
+        with tarfile.open(fileobj=gz, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for root, dirs, names in os.walk(source):
+                dirs.sort()
+                for name in dirs + sorted(names):
+                    scheduler_checkpoint()
+                    path = os.path.join(root, name)
+                    rel = os.path.relpath(path, source)
+                    try:
+                        st = os.lstat(path)
+                    except FileNotFoundError:
+                        continue
+                    
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        # Directory entries are tiny and keep empty directories on restore
+                        tar.add(path, arcname=rel, recursive=False)
+                        continue
+                    if os.path.islink(path):
+                        seen.add(rel)
+                        files[rel] = {"link": os.readlink(path)}
+                        if (previous_files or {}).get(rel) != files[rel]:
+                            tar.add(path, arcname=rel, recursive=False)
+                        continue
+                    if not os.path.isfile(path):
+                        continue
+                    
+                    seen.add(rel)
+                    stats["files"] += 1
+                    previous = (previous_files or {}).get(rel)
+                    if previous and previous.get("size") == st.st_size:
+                        if previous["mtime_ns"] == st.st_mtime_ns:
+                            files[rel] = previous
+                            stats["unchanged"] += 1
+                            continue
+                        # Touched but possibly unmodified: compare content before archiving it again
+                        if hash_file(path) == previous["sha256"]:
+                            files[rel] = dict(previous, mtime_ns=st.st_mtime_ns)
+                            stats["unchanged"] += 1
+                            continue
+                    
+                    tarinfo = tar.gettarinfo(path, arcname=rel)
+                    # A second hardlink comes back as a link member, which carries no data; its
+                    # target may not even be in this incremental, so store every file in full
+                    tarinfo.type = tarfile.REGTYPE
+                    tarinfo.linkname = ""
+                    tarinfo.size = st.st_size
+                    with open(path, "rb") as f:
+                        reader = _HashingReader(f, st.st_size)
+                        tar.addfile(tarinfo, reader)
+                    stats["archived"] += 1
+                    stats["archived_bytes"] += st.st_size
+                    
+                    # A file written to while it was read is left out of the index so the next backup retries it
+                    after = os.lstat(path)
+                    if reader.short or after.st_size != st.st_size or after.st_mtime_ns != st.st_mtime_ns:
+                        stats["changed_during_backup"].append(rel)
+                    else:
+                        files[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": reader.hash.hexdigest()}
+            
+            # Deletions since the previous backup travel inside the archive so restores can replay them
+            stats["deleted"] = sorted(set(previous_files or {}) - seen)
+            data = json.dumps(dict(metadata or {}, deleted=stats["deleted"])).encode("utf-8")
+            tarinfo = tarfile.TarInfo(BACKUP_METADATA_MEMBER)
+            tarinfo.size = len(data)
+            tarinfo.mtime = int(time.time())
+            tar.addfile(tarinfo, io.BytesIO(data))
+    
+    stats["source_bytes"] = sum(entry.get("size", 0) for entry in files.values())
+    stats["compressed_bytes"] = writer.count
+    return files, stats
+
+# Stop a running container for the duration of the block, then start it again
+@contextmanager
+def quiesced_service(container, enabled=True):
+    running = False
+    if enabled:
+        result = subprocess.run(["docker", "inspect", "-f", "{{.State.Running}}", container],
+                                capture_output=True, text=True, timeout=30)
+        running = result.returncode == 0 and result.stdout.strip() == "true"
+    if running:
+        subprocess.run(["docker", "stop", container], check=True, capture_output=True, timeout=120)
+    try:
+        if running:
+            # A pause now would keep the service down until conditions clear
+            with scheduler_uninterruptible():
+                yield running
+        else:
+            yield running
+    finally:
+        if running:
+            subprocess.run(["docker", "start", container], check=True, capture_output=True, timeout=120)
+
+# Back up one service's config directory to the backup destination
+def run_backup(config, service, full=False, quiesce=False):
+    source = get_backup_source(config, service)
+    if not os.path.isdir(source):
+        raise ValueError(f"No config directory for {service} at {source}")
+    settings = get_backup_settings(config)
+    backup_dir = get_backup_dir(config, service)
+    manifest = load_backup_manifest(backup_dir)
+    
+    # Incremental unless asked otherwise, there is nothing to build on, or the chain is long enough
+    types = [backup["type"] for backup in manifest["backups"]]
+    since_full = len(types) - 1 - types[::-1].index("full") if "full" in types else None
+    incremental = not full and since_full is not None and since_full < settings["max_incrementals"]
+    backup_type = "incremental" if incremental else "full"
+    
+    archive = f"{time.strftime('%Y%m%d-%H%M%S')}-{backup_type}.tar.gz"
+    archive_path = os.path.join(backup_dir, archive)
+    metadata = {"service": service, "type": backup_type,
+                "base": manifest["backups"][-1]["archive"] if incremental else None}
+    
+    started = time.monotonic()
+    # Wait out any pause before the service is stopped; checkpoints do nothing while it is down
+    scheduler_checkpoint()
+    try:
+        with quiesced_service(service, quiesce) as stopped:
+            with open(archive_path + ".partial", "wb") as f:
+                files, stats = write_backup_archive(
+                    source, f, manifest["files"] if incremental else None, settings["compress_level"], metadata)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(archive_path + ".partial", archive_path)
+    except BaseException:
+        if os.path.exists(archive_path + ".partial"):
+            os.remove(archive_path + ".partial")
+        raise
+    seconds = time.monotonic() - started
+    
+    manifest["files"] = files
+    manifest["backups"].append({
+        "archive": archive,
+        "type": backup_type,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "compressed_bytes": stats["compressed_bytes"],
+        "archived_files": stats["archived"]
+    })
+    save_backup_manifest(backup_dir, manifest)
+    
+    return {
+        "service": service,
+        "archive": archive,
+        "type": backup_type,
+        "quiesced": stopped,
+        "seconds": round(seconds, 2),
+        "files": stats["files"],
+        "archived_files": stats["archived"],
+        "unchanged_files": stats["unchanged"],
+        "deleted_files": len(stats["deleted"]),
+        "changed_during_backup": stats["changed_during_backup"],
+        "source_bytes": stats["source_bytes"],
+        "archived_bytes": stats["archived_bytes"],
+        "compressed_bytes": stats["compressed_bytes"],
+        "throughput_mb_s": round(stats["archived_bytes"] / (1024 * 1024) / seconds, 2) if seconds > 0 else None,
+        # How much smaller this backup is than a full one of the same data
+        "saved_vs_full_percent": round((1 - stats["archived_bytes"] / stats["source_bytes"]) * 100, 1) if stats["source_bytes"] else 0
+    }
+
+# Stream a full backup of a service as tar.gz chunks; nothing is staged in memory or on disk
+def stream_backup(config, service):
+    source = get_backup_source(config, service)
+    if not os.path.isdir(source):
+        raise ValueError(f"No config directory for {service} at {source}")
+    compress_level = get_backup_settings(config)["compress_level"]
+    
+    # The archive is written into a pipe by a worker thread; the pipe's buffer provides backpressure
+    read_fd, write_fd = os.pipe()
+    
+    def produce():
+        try:
+            with os.fdopen(write_fd, "wb") as out:
+                write_backup_archive(source, out, None, compress_level, {"service": service, "type": "full"})
+        except BrokenPipeError:
+            pass  # client went away
+        except Exception as e:
+            print(f"Warning: Streaming backup of {service} failed: {e}")
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    def chunks():
+        with os.fdopen(read_fd, "rb") as pipe:
+            for chunk in iter(lambda: pipe.read1(BACKUP_CHUNK_SIZE), b""):
+                yield chunk
+    return chunks()
+
+# Extract one backup archive into a directory, then apply the deletions it records
+def extract_backup_archive(archive_path, target):
+    import shutil
+    import tarfile
+
+    deleted = []
+    extract_args = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    with tarfile.open(archive_path, mode="r|gz") as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name.startswith("..") or os.path.isabs(name):
+                raise ValueError(f"Unsafe path in backup archive: {member.name}")
+            if name == BACKUP_METADATA_MEMBER:
+                deleted = json.load(tar.extractfile(member)).get("deleted", [])
+                continue
+            tar.extract(member, target, **extract_args)
+    
+    for rel in deleted:
+        path = os.path.join(target, os.path.normpath(rel))
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+# Restore a service's config directory from its backup chain (latest backup by default)
+def restore_backup(config, service, archive=None, quiesce=True):
+    import shutil
+
+    target = get_backup_source(config, service)
+    backup_dir = get_backup_dir(config, service)
+    backups = load_backup_manifest(backup_dir)["backups"]
+    names = [backup["archive"] for backup in backups]
+    if not names:
+        raise ValueError(f"No backups of {service}")
+    archive = archive or names[-1]
+    if archive not in names:
+        raise ValueError(f"Unknown backup: {archive}")
+    
+    # Replay the last full backup at or before the chosen one, then its incrementals
+    index = names.index(archive)
+    start = max(i for i in range(index + 1) if backups[i]["type"] == "full")
+    chain = names[start:index + 1]
+    
+    # Extract next to the live directory while the service keeps running, then swap
+    staging = os.path.join(config["docker_dir"], f".{service}.restore")
+    previous = os.path.join(config["docker_dir"], f".{service}.old")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    started = time.monotonic()
+    try:
+        for name in chain:
+            extract_backup_archive(os.path.join(backup_dir, name), staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    with quiesced_service(service, quiesce) as stopped:
+        if os.path.exists(target):
+            os.rename(target, previous)
+        os.rename(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+    
+    return {
+        "service": service,
+        "restored": archive,
+        "chain": chain,
+        "quiesced": stopped,
+        "seconds": round(time.monotonic() - started, 2)
+    }
+
+# List backups for every service that has any
+def list_backups(config):
+    destination = get_backup_settings(config)["destination"]
+    result = {}
+    if not destination or not os.path.isdir(destination):
+        return result
+    for service in sorted(os.listdir(destination)):
+        manifest_path = os.path.join(destination, service, BACKUP_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                result[service] = json.load(f)["backups"]
+    return result
+
+# Media library scanner settings
+MEDIA_SCAN_WORKERS = 4
+MEDIA_LARGE_FILE_BYTES = 100 * 1024 * 1024  # files at least this big are indexed individually
+MEDIA_SCAN_BATCH = 500  # directory rows written per transaction
+MEDIA_CATEGORIES = ["tv", "movies", "music", "books"]
+
+_media_scan_state = {"running": False, "last": None}
+_media_scan_lock = threading.Lock()
+
+# Open the media index, creating its tables on first use
+def open_media_index(path=None):
+    import sqlite3
+
+    conn = sqlite3.connect(path or MEDIA_INDEX_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # WAL lets the API read the index while a scan is writing to it
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            root TEXT NOT NULL,
+            mtime_ns INTEGER,
+            size INTEGER NOT NULL DEFAULT 0,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            total_size INTEGER NOT NULL DEFAULT 0,
+            total_files INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent, total_size);
+        CREATE INDEX IF NOT EXISTS directories_root ON directories (root);
+        CREATE TABLE IF NOT EXISTS large_files (
+            path TEXT PRIMARY KEY,
+            directory TEXT NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS large_files_directory ON large_files (directory);
+        CREATE INDEX IF NOT EXISTS large_files_size ON large_files (size);
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            partial TEXT,
+            full TEXT
+        );
+        CREATE TABLE IF NOT EXISTS scans (
+            root TEXT PRIMARY KEY,
+            finished TEXT,
+            seconds REAL,
+            directories INTEGER,
+            rescanned INTEGER,
+            errors INTEGER
+        );
+    """)
+    return conn
+
+# List one directory, or reuse the index entry if its mtime shows no entries were added, removed or renamed
+def scan_media_directory(path, known_mtime_ns=None, known_subdirs=None, full=False):
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        return {"path": path, "error": str(e), "subdirs": []}
+    if not full and known_mtime_ns == st.st_mtime_ns:
+        return {"path": path, "changed": False, "subdirs": known_subdirs or []}
+    
+    result = {"path": path, "changed": True, "mtime_ns": st.st_mtime_ns, "size": 0, "file_count": 0,
+              "large_files": [], "subdirs": []}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        result["subdirs"].append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        size = entry.stat(follow_symlinks=False).st_size
+                        result["size"] += size
+                        result["file_count"] += 1
+                        if size >= MEDIA_LARGE_FILE_BYTES:
+                            result["large_files"].append((entry.path, path, size))
+                except OSError:
+                    continue
+    except OSError as e:
+        return {"path": path, "error": str(e), "subdirs": []}
+    return result
+
+# Write a batch of rescanned directories to the index
+def _store_media_directories(conn, root, results):
+    with conn:
+        conn.executemany(
+            "INSERT INTO directories (path, parent, root, mtime_ns, size, file_count) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, file_count = excluded.file_count",
+            [(r["path"], None if r["path"] == root else os.path.dirname(r["path"]), root, r["mtime_ns"], r["size"], r["file_count"])
+             for r in results]
+        )
+        conn.executemany("DELETE FROM large_files WHERE directory = ?", [(r["path"],) for r in results])
+        conn.executemany("INSERT OR REPLACE INTO large_files (path, directory, size) VALUES (?, ?, ?)",
+                         [entry for r in results for entry in r["large_files"]])
+
+# Recompute subtree totals for every directory under a root
+def _update_media_totals(conn, root):
+    rows = conn.execute("SELECT path, parent, size, file_count FROM directories WHERE root = ?", (root,)).fetchall()
+    totals = {row["path"]: [row["size"], row["file_count"]] for row in rows}
+    # Deepest directories first, so each one is complete before it is added to its parent
+    for row in sorted(rows, key=lambda r: r["path"].count(os.sep), reverse=True):
+        if row["parent"] in totals:
+            totals[row["parent"]][0] += totals[row["path"]][0]
+            totals[row["parent"]][1] += totals[row["path"]][1]
+    with conn:
+        conn.executemany("UPDATE directories SET total_size = ?, total_files = ? WHERE path = ?",
+                         [(size, files, path) for path, (size, files) in totals.items()])
+
+# Walk one tree with a pool of scandir workers, only listing directories that changed
+def scan_media_tree(conn, root, workers=MEDIA_SCAN_WORKERS, full=False):
+    from concurrent.futures import ThreadPoolExecutor
+
+    root = os.path.abspath(root)
+    started = time.monotonic()
+    known = {}
+    children = {}
+    for row in conn.execute("SELECT path, parent, mtime_ns FROM directories WHERE root = ?", (root,)):
+        known[row["path"]] = row["mtime_ns"]
+        children.setdefault(row["parent"], []).append(row["path"])
+    
+    visited = set()
+    changed = []
+    stats = {"root": root, "directories": 0, "rescanned": 0, "unchanged": 0, "errors": 0}
+    # Workers hand results back through a queue; this thread alone writes to SQLite and queues subdirectories
+    results = queue.Queue()
+    
+    def scan(path):
+        try:
+            results.put(scan_media_directory(path, known.get(path), children.get(path), full))
+        except Exception as e:
+            results.put({"path": path, "error": str(e), "subdirs": []})
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        executor.submit(scan, root)
+        outstanding = 1
+        while outstanding:
+            result = results.get()
+            outstanding -= 1
+            # Pausing here stops new directories being queued; workers finish the ones they have
+            scheduler_checkpoint()
+            visited.add(result["path"])
+            stats["directories"] += 1
+            if "error" in result:
+                # Keep what the index knows rather than dropping a directory on a transient error
+                stats["errors"] += 1
+                visited.update(p for p in known if p.startswith(result["path"] + os.sep))
+            elif result["changed"]:
+                stats["rescanned"] += 1
+                changed.append(result)
+            else:
+                stats["unchanged"] += 1
+            for subdir in result["subdirs"]:
+                executor.submit(scan, subdir)
+                outstanding += 1
+            if len(changed) >= MEDIA_SCAN_BATCH:
+                _store_media_directories(conn, root, changed)
+                changed = []
+    if changed:
+        _store_media_directories(conn, root, changed)
+    
+    # Directories that were not reached any more have been deleted or moved
+    removed = [(path,) for path in known if path not in visited]
+    with conn:
+        conn.executemany("DELETE FROM directories WHERE path = ?", removed)
+        conn.executemany("DELETE FROM large_files WHERE directory = ?", removed)
+    stats["removed"] = len(removed)
+    if stats["rescanned"] or removed:
+        _update_media_totals(conn, root)
+    
+    stats["seconds"] = round(time.monotonic() - started, 2)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO scans (root, finished, seconds, directories, rescanned, errors) VALUES (?, ?, ?, ?, ?, ?)",
+                     (root, time.strftime("%Y-%m-%d %H:%M:%S"), stats["seconds"], stats["directories"], stats["rescanned"], stats["errors"]))
+    return stats
+
+# Get the media and downloads directories to scan
+def get_media_scan_roots(config):
+    return [os.path.abspath(path) for path in (config["media_dir"], config["downloads_dir"]) if os.path.isdir(path)]
+
+# Scan media_dir and downloads_dir into the index
+def run_media_scan(config, full=False):
+    with _media_scan_lock:
+        if _media_scan_state["running"]:
+            return None
+        _media_scan_state["running"] = True
+    try:
+        conn = open_media_index()
+        try:
+            results = [scan_media_tree(conn, root, full=full) for root in get_media_scan_roots(config)]
+        finally:
+            conn.close()
+        with _media_scan_lock:
+            _media_scan_state["last"] = {"finished": time.strftime("%Y-%m-%d %H:%M:%S"), "roots": results}
+        return results
+    except Exception as e:
+        print(f"Warning: Media scan failed: {e}")
+        with _media_scan_lock:
+            _media_scan_state["last"] = {"finished": time.strftime("%Y-%m-%d %H:%M:%S"), "error": str(e)}
+        raise
+    finally:
+        with _media_scan_lock:
+            _media_scan_state["running"] = False
+
+# Get one indexed directory's subtree totals
+def _get_media_totals(conn, path):
+    row = conn.execute("SELECT total_size, total_files FROM directories WHERE path = ?", (path,)).fetchone()
+    return {"path": path, "size": row["total_size"], "files": row["total_files"]} if row else None
+
+# Get the disk usage breakdown by category from the index
+def get_media_usage(config):
+    if not os.path.exists(MEDIA_INDEX_FILE):
+        return {"indexed": False, "categories": {}}
+    media_dir = os.path.abspath(config["media_dir"])
+    conn = open_media_index()
+    try:
+        categories = {name: _get_media_totals(conn, os.path.join(media_dir, name)) for name in MEDIA_CATEGORIES}
+        media = _get_media_totals(conn, media_dir)
+        if media:
+            # Anything under media_dir outside the known categories
+            categorized = [c for c in categories.values() if c]
+            categories["other"] = {
+                "path": media_dir,
+                "size": media["size"] - sum(c["size"] for c in categorized),
+                "files": media["files"] - sum(c["files"] for c in categorized)
+            }
+        categories["downloads"] = _get_media_totals(conn, os.path.abspath(config["downloads_dir"]))
+        scans = [dict(row) for row in conn.execute("SELECT * FROM scans")]
+    finally:
+        conn.close()
+    return {"indexed": True, "categories": categories, "scans": scans}
+
+# Get the biggest items (top-level folders or individual files) in a category, or across all of them
+def get_largest_media_items(config, category=None, kind="directories", limit=20):
+    media_dir = os.path.abspath(config["media_dir"])
+    paths = {name: os.path.join(media_dir, name) for name in MEDIA_CATEGORIES}
+    paths["downloads"] = os.path.abspath(config["downloads_dir"])
+    if category and category not in paths:
+        raise ValueError(f"Unknown category: {category}")
+    roots = [paths[category]] if category else list(paths.values())
+    if not os.path.exists(MEDIA_INDEX_FILE):
+        return []
+    
+    placeholders = ", ".join("?" for _ in roots)
+    conn = open_media_index()
+    try:
+        if kind == "files":
+            # Prefix range ('/' is followed by '0') so the lookup can use the index
+            ranges = " OR ".join("(path >= ? AND path < ?)" for _ in roots)
+            params = [bound for root in roots for bound in (root + os.sep, root + chr(ord(os.sep) + 1))]
+            rows = conn.execute(f"SELECT path, size FROM large_files WHERE {ranges} ORDER BY size DESC LIMIT ?",
+                                params + [limit]).fetchall()
+            return [{"path": row["path"], "size": row["size"]} for row in rows]
+        # A show, movie, artist or book folder is a direct child of its category directory
+        rows = conn.execute(
+            f"SELECT path, total_size, total_files FROM directories WHERE parent IN ({placeholders}) ORDER BY total_size DESC LIMIT ?",
+            roots + [limit]
+        ).fetchall()
+        return [{"path": row["path"], "size": row["total_size"], "files": row["total_files"]} for row in rows]
+    finally:
+        conn.close()
+
+# Duplicate finder settings
+DEDUPE_MIN_BYTES = 1024 * 1024  # smaller files are not worth a hardlink
+DEDUPE_PARTIAL_BYTES = 64 * 1024  # read from each end of a file for the partial hash
+DEDUPE_WORKERS = 2
+DEDUPE_MAX_READ_MB_S = 25  # total hashing read rate, leaving disk bandwidth for streaming
+DEDUPE_ORPHAN_DAYS = 14
+DEDUPE_REPORT_LIMIT = 200  # groups and orphans listed in the report (totals cover all of them)
+DEDUPE_LINK_SUFFIX = ".pi-pvr-link"
+
+_dedupe_state = {"running": False, "phase": None, "progress": {}, "stop": threading.Event()}
+_dedupe_lock = threading.Lock()
+# Shared read pacing for all hashing workers
+_dedupe_pacer = {"next": 0.0, "lock": threading.Lock()}
+
+# Sleep as needed so reads across all workers stay under the given rate
+def pace_reads(pacer, nbytes, bytes_per_second):
+    if not bytes_per_second:
+        return
+    with pacer["lock"]:
+        now = time.monotonic()
+        start = max(now, pacer["next"])
+        pacer["next"] = start + nbytes / bytes_per_second
+    if start > now:
+        time.sleep(start - now)
+
+# Hash the first and last blocks of a file; most different files of equal size differ there
+def hash_file_partial(path, size):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read(DEDUPE_PARTIAL_BYTES))
+        if size > DEDUPE_PARTIAL_BYTES:
+            f.seek(max(size - DEDUPE_PARTIAL_BYTES, DEDUPE_PARTIAL_BYTES))
+            digest.update(f.read(DEDUPE_PARTIAL_BYTES))
+    return digest.hexdigest()
+
+# Get duplicate finder settings from config.json
+def get_dedupe_settings(config):
+    settings = config.get("dedupe", {})
+    return {
+        "min_bytes": settings.get("min_bytes", DEDUPE_MIN_BYTES),
+        "max_read_mb_s": settings.get("max_read_mb_s", DEDUPE_MAX_READ_MB_S),
+        "workers": settings.get("workers", DEDUPE_WORKERS),
+        "orphan_days": settings.get("orphan_days", DEDUPE_ORPHAN_DAYS)
+    }
+
+# List regular files of at least min_bytes under a root
+def collect_dedupe_files(root, label, min_bytes, stop):
+    files = []
+    for dirpath, dirs, names in os.walk(root):
+        if stop.is_set():
+            break
+        scheduler_checkpoint()
+        dirs.sort()
+        for name in names:
+            path = os.path.join(dirpath, name)
+            if name.endswith(DEDUPE_LINK_SUFFIX):
+                continue
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path) and not os.path.islink(path) and st.st_size >= min_bytes:
+                files.append({"path": path, "root": label, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                              "dev": st.st_dev, "inode": st.st_ino})
+    return files
+
+# Group files by inode; paths that are already hardlinks of each other count once
+def group_by_inode(files):
+    inodes = {}
+    for f in files:
+        inodes.setdefault((f["dev"], f["inode"]), []).append(f)
+    return inodes
+
+# Keep only groups that hold more than one distinct inode
+def _multi_inode_groups(groups):
+    return {key: members for key, members in groups.items() if len(members) > 1}
+
+# Hash one inode, reusing the cached hash if the file is unchanged since it was hashed
+def _hash_dedupe_inode(kind, paths, size, mtime_ns, cache, settings, stop):
+    scheduler_checkpoint()
+    cached = cache.get(paths[0])
+    if cached and cached["size"] == size and cached["mtime_ns"] == mtime_ns and cached[kind]:
+        return cached[kind], False
+    if kind == "partial":
+        return hash_file_partial(paths[0], size), True
+    return hash_file(paths[0], settings["max_read_mb_s"] * 1024 * 1024, stop), True
+
+# Hash every inode in the candidate groups in parallel and regroup by (size, hash)
+def _regroup_by_hash(kind, groups, cache, conn, settings, stop):
+    from concurrent.futures import ThreadPoolExecutor
+
+    inodes = [(key, members) for members in groups.values() for key, members in members.items()]
+    regrouped = {}
+    hashed = []
+    with ThreadPoolExecutor(max_workers=settings["workers"]) as executor:
+        hash_inode = bind_scheduler_job(_hash_dedupe_inode)
+        futures = [(key, members, executor.submit(
+            hash_inode, kind, [m["path"] for m in members], members[0]["size"], members[0]["mtime_ns"], cache, settings, stop
+        )) for key, members in inodes]
+        for key, members, future in futures:
+            try:
+                digest, fresh = future.result()
+            except OSError:
+                continue  # deleted or unreadable since it was listed
+            if digest is None:
+                continue  # stopped
+            first = members[0]
+            if fresh:
+                entry = cache.setdefault(first["path"], {"size": first["size"], "mtime_ns": first["mtime_ns"], "partial": None, "full": None})
+                if entry["size"] != first["size"] or entry["mtime_ns"] != first["mtime_ns"]:
+                    entry.update(size=first["size"], mtime_ns=first["mtime_ns"], partial=None, full=None)
+                entry[kind] = digest
+                hashed.append(first["path"])
+                with _dedupe_lock:
+                    _dedupe_state["progress"]["bytes_hashed"] += first["size"] if kind == "full" else 2 * DEDUPE_PARTIAL_BYTES
+            regrouped.setdefault((first["size"], digest), {})[key] = members
+            
+            # Commit as we go so a stopped or interrupted run resumes from here
+            if len(hashed) >= 100:
+                _save_dedupe_hashes(conn, cache, hashed)
+                hashed = []
+    _save_dedupe_hashes(conn, cache, hashed)
+    return _multi_inode_groups(regrouped)
+
+# Persist computed hashes to the index
+def _save_dedupe_hashes(conn, cache, paths):
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?)",
+            [(path, cache[path]["size"], cache[path]["mtime_ns"], cache[path]["partial"], cache[path]["full"]) for path in paths]
+        )
+
+# Build the report: duplicate groups, existing hardlinks, reclaimable space and orphaned downloads
+def build_dedupe_report(files, duplicates, settings):
+    groups = []
+    covered = set()
+    for (size, digest), inodes in duplicates.items():
+        copies = [{"dev": dev, "inode": inode, "mtime_ns": members[0]["mtime_ns"],
+                   "roots": sorted({m["root"] for m in members}), "paths": sorted(m["path"] for m in members)}
+                  for (dev, inode), members in inodes.items()]
+        # Keep the library copy; downloads are what gets replaced
+        copies.sort(key=lambda c: ("media" not in c["roots"], c["paths"][0]))
+        keeper = copies[0]
+        linkable = [c for c in copies[1:] if c["dev"] == keeper["dev"]]
+        if any("media" in c["roots"] for c in copies):
+            covered.update((c["dev"], c["inode"]) for c in copies)
+        groups.append({
+            "id": digest[:16],
+            "size": size,
+            "sha256": digest,
+            "copies": copies,
+            "reclaimable_bytes": size * (len(copies) - 1),
+            "hardlinkable_bytes": size * len(linkable)
+        })
+    groups.sort(key=lambda g: g["reclaimable_bytes"], reverse=True)
+    
+    inodes = group_by_inode(files)
+    already_linked = [members for members in inodes.values() if len(members) > 1]
+    media_inodes = {key for key, members in inodes.items() if any(m["root"] == "media" for m in members)}
+    cutoff = time.time() - settings["orphan_days"] * 86400
+    # A completed download with no copy or link in the library is probably left over
+    orphans = [{"path": members[0]["path"], "size": members[0]["size"],
+                "age_days": round((time.time() - members[0]["mtime_ns"] / 1e9) / 86400, 1)}
+               for key, members in inodes.items()
+               if key not in media_inodes and key not in covered and members[0]["root"] == "downloads"
+               and members[0]["mtime_ns"] / 1e9 < cutoff]
+    orphans.sort(key=lambda o: o["size"], reverse=True)
+    
+    return {
+        "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "files_scanned": len(files),
+        "duplicate_groups": len(groups),
+        "reclaimable_bytes": sum(g["reclaimable_bytes"] for g in groups),
+        "hardlinkable_bytes": sum(g["hardlinkable_bytes"] for g in groups),
+        "already_linked": {
+            "files": sum(len(members) for members in already_linked),
+            "bytes_saved": sum(members[0]["size"] * (len(members) - 1) for members in already_linked)
+        },
+        "orphan_files": len(orphans),
+        "orphan_bytes": sum(o["size"] for o in orphans),
+        "groups": groups[:DEDUPE_REPORT_LIMIT],
+        "orphans": orphans[:DEDUPE_REPORT_LIMIT]
+    }
+
+# Find duplicate files across media_dir and downloads_dir: by size, then partial hash, then full hash
+def run_dedupe_analysis(config):
+    with _dedupe_lock:
+        if _dedupe_state["running"]:
+            return None
+        _dedupe_state.update(running=True, phase="listing", progress={"bytes_hashed": 0}, error=None)
+        _dedupe_state["stop"].clear()
+    settings = get_dedupe_settings(config)
+    stop = _dedupe_state["stop"]
+    started = time.monotonic()
+    
+    def set_phase(phase, **progress):
+        with _dedupe_lock:
+            _dedupe_state["phase"] = phase
+            _dedupe_state["progress"].update(progress)
+    
+    try:
+        files = []
+        for label, root in (("media", config["media_dir"]), ("downloads", config["downloads_dir"])):
+            if os.path.isdir(root):
+                files += collect_dedupe_files(os.path.abspath(root), label, settings["min_bytes"], stop)
+        
+        # Only sizes shared by more than one distinct inode can hold duplicates
+        by_size = {}
+        for f in files:
+            by_size.setdefault(f["size"], []).append(f)
+        candidates = _multi_inode_groups({size: group_by_inode(members) for size, members in by_size.items()})
+        set_phase("partial_hash", files=len(files), size_candidates=sum(len(g) for g in candidates.values()))
+        
+        conn = open_media_index()
+        try:
+            cache = {row["path"]: dict(row) for row in conn.execute("SELECT path, size, mtime_ns, partial, full FROM file_hashes")}
+            candidates = _regroup_by_hash("partial", candidates, cache, conn, settings, stop)
+            set_phase("full_hash", partial_candidates=sum(len(g) for g in candidates.values()),
+                      bytes_to_hash=sum(size * len(g) for (size, _), g in candidates.items()))
+            duplicates = _regroup_by_hash("full", candidates, cache, conn, settings, stop)
+            
+            # Forget hashes of files that no longer exist
+            listed = {f["path"] for f in files}
+            if not stop.is_set():
+                with conn:
+                    conn.executemany("DELETE FROM file_hashes WHERE path = ?", [(p,) for p in cache if p not in listed])
+        finally:
+            conn.close()
+        
+        if stop.is_set():
+            set_phase("stopped")
+            return None
+        report = build_dedupe_report(files, duplicates, settings)
+        report["seconds"] = round(time.monotonic() - started, 1)
+        with _dedupe_lock:
+            report["bytes_hashed"] = _dedupe_state["progress"]["bytes_hashed"]
+        with open(DEDUPE_REPORT_FILE, "w") as f:
+            json.dump(report, f, indent=2)
+        set_phase("finished")
+        return report
+    except Exception as e:
+        print(f"Warning: Duplicate analysis failed: {e}")
+        with _dedupe_lock:
+            _dedupe_state.update(phase="failed", error=str(e))
+        raise
+    finally:
+        with _dedupe_lock:
+            _dedupe_state["running"] = False
+
+# Load the last duplicate report
+def load_dedupe_report():
+    if os.path.exists(DEDUPE_REPORT_FILE):
+        with open(DEDUPE_REPORT_FILE, "r") as f:
+            return json.load(f)
+    return None
+
+# Replace duplicate copies with hardlinks to the kept copy, where both are on one filesystem
+def hardlink_duplicates(group_ids=None, dry_run=False):
+    report = load_dedupe_report()
+    if report is None:
+        raise ValueError("No duplicate report; run an analysis first")
+    groups = [g for g in report["groups"] if group_ids is None or g["id"] in group_ids]
+    
+    result = {"dry_run": dry_run, "linked": [], "skipped": [], "reclaimed_bytes": 0}
+    for group in groups:
+        keeper = group["copies"][0]
+        keeper_path = keeper["paths"][0]
+        try:
+            st = os.stat(keeper_path)
+        except OSError as e:
+            result["skipped"].append({"path": keeper_path, "reason": str(e)})
+            continue
+        if st.st_ino != keeper["inode"] or st.st_size != group["size"] or st.st_mtime_ns != keeper["mtime_ns"]:
+            result["skipped"].append({"path": keeper_path, "reason": "changed since analysis"})
+            continue
+        
+        for copy in group["copies"][1:]:
+            if copy["dev"] != keeper["dev"]:
+                result["skipped"].extend({"path": p, "reason": "different filesystem"} for p in copy["paths"])
+                continue
+            replaced = False
+            for path in copy["paths"]:
+                try:
+                    st = os.lstat(path)
+                except OSError as e:
+                    result["skipped"].append({"path": path, "reason": str(e)})
+                    continue
+                # Only replace the exact file that was hashed
+                if st.st_ino != copy["inode"] or st.st_size != group["size"] or st.st_mtime_ns != copy["mtime_ns"]:
+                    result["skipped"].append({"path": path, "reason": "changed since analysis"})
+                    continue
+                if not dry_run:
+                    # Link next to the copy, then rename over it so the path never goes missing
+                    temp_path = path + DEDUPE_LINK_SUFFIX
+                    try:
+                        # Only this function creates these, so one left by an interrupted run is safe to remove
+                        if os.path.lexists(temp_path):
+                            os.unlink(temp_path)
+                        os.link(keeper_path, temp_path)
+                        os.replace(temp_path, path)
+                    except OSError as e:
+                        # e.g. EXDEV between bind mounts of one disk, or EPERM
+                        result["skipped"].append({"path": path, "reason": str(e)})
+                        continue
+                    finally:
+                        if os.path.lexists(temp_path):
+                            os.unlink(temp_path)
+                result["linked"].append({"path": path, "target": keeper_path})
+                replaced = True
+            if replaced:
+                result["reclaimed_bytes"] += group["size"]
+    return result
+
+# VPN benchmark settings
+VPN_BENCHMARK_HISTORY = 50
+VPN_BENCHMARK_DEFAULTS = {
+    "target_url": "https://speed.cloudflare.com/__down?bytes=25000000",
+    "latency_samples": 5,
+    "timeout": 60,
+    "curl_image": "curlimages/curl:latest",
+    "regions": []  # candidate regions compared by POST /api/vpn/benchmark
+}
+VPN_HEALTHY_TIMEOUT = 180
+# Runs inside a curl container sharing the VPN's network namespace: N connection-only requests for
+# latency, then one full download. Each prints "connect starttransfer total bytes speed"
+VPN_TUNNEL_SCRIPT = (
+    'fmt="%{time_connect} %{time_starttransfer} %{time_total} %{size_download} %{speed_download}\\n"; '
+    'for i in $(seq "$2"); do curl -s -o /dev/null -r 0-0 -H "Connection: close" --max-time "$3" -w "$fmt" "$1"; done; '
+    'curl -s -o /dev/null --max-time "$3" -w "$fmt" "$1"'
+)
+
+# Get VPN benchmark settings from config.json
+def get_vpn_benchmark_settings(config):
+    settings = dict(VPN_BENCHMARK_DEFAULTS)
+    settings.update(config.get("vpn_benchmark", {}))
+    return settings
+
+# Summarise one set of latency samples and a download
+def _summarize_benchmark(connect_times, download_bytes, download_seconds, ttfb_seconds):
+    import statistics
+
+    return {
+        "latency_ms": round(statistics.median(connect_times) * 1000, 1) if connect_times else None,
+        "latency_min_ms": round(min(connect_times) * 1000, 1) if connect_times else None,
+        "ttfb_ms": round(ttfb_seconds * 1000, 1) if ttfb_seconds is not None else None,
+        "bytes": download_bytes,
+        "throughput_mbps": round(download_bytes * 8 / download_seconds / 1e6, 2) if download_seconds > 0 else None
+    }
+
+# Measure latency (TCP connect time) and download throughput from the host itself
+def measure_host_network(url, samples, timeout):
+    import socket
+    import requests
+    from urllib.parse import urlparse
+
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    connect_times = []
+    for _ in range(samples):
+        started = time.monotonic()
+        with socket.create_connection((parsed.hostname, port), timeout=timeout):
+            connect_times.append(time.monotonic() - started)
+    
+    started = time.monotonic()
+    size = 0
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        ttfb = time.monotonic() - started
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+    return _summarize_benchmark(connect_times, size, time.monotonic() - started, ttfb)
+
+# Build the command that runs the tunnel measurement inside the VPN container's network namespace
+def build_tunnel_command(url, samples, timeout, settings):
+    return ["docker", "run", "--rm", "--network", f"container:{VPN_CONTAINER_NAME}", "--entrypoint", "sh",
+            settings["curl_image"], "-c", VPN_TUNNEL_SCRIPT, "sh", url, str(samples), str(timeout)]
+
+# Measure latency and throughput through the VPN tunnel
+def measure_tunnel_network(url, samples, timeout, settings):
+    result = subprocess.run(build_tunnel_command(url, samples, timeout, settings),
+                            capture_output=True, text=True, timeout=timeout * (samples + 1) + 120)
+    lines = [line.split() for line in result.stdout.strip().splitlines() if line.strip()]
+    if len(lines) != samples + 1 or result.returncode != 0:
+        raise RuntimeError(f"Tunnel measurement failed: {result.stderr.strip() or result.stdout.strip()}")
+    connect_times = [float(line[0]) for line in lines[:-1] if float(line[0]) > 0]
+    connect, starttransfer, total, size, _ = [float(v) for v in lines[-1]]
+    return _summarize_benchmark(connect_times, int(size), total, starttransfer)
+
+# Wait until a container's healthcheck reports healthy
+def wait_for_container_healthy(container, timeout=VPN_HEALTHY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = subprocess.run(["docker", "inspect", "-f", "{{.State.Health.Status}}", container],
+                                capture_output=True, text=True, timeout=30)
+        if result.stdout.strip() == "healthy":
+            return True
+        time.sleep(3)
+    return False
+
+# Recreate the VPN container connected to another region (None restores the configured one)
+def switch_vpn_region(compose_file, region=None):
+    files = ["-f", compose_file]
+    if region is not None:
+        override = os.path.join(CONFIG_DIR, "vpn-region-override.yml")
+        with open(override, "w") as f:
+            f.write(to_compose_yaml({"services": {VPN_CONTAINER_NAME: {"environment": {"SERVER_REGIONS": region}}}}) + "\n")
+        files += ["-f", override]
+    subprocess.run(["docker", "compose", *files, "up", "-d", "--no-deps", "--force-recreate", VPN_CONTAINER_NAME],
+                   check=True, capture_output=True, timeout=300)
+    if not wait_for_container_healthy(VPN_CONTAINER_NAME):
+        raise RuntimeError(f"VPN did not become healthy in region {region or 'as configured'}")
+
+# Load benchmark history
+def load_vpn_benchmarks():
+    if os.path.exists(VPN_BENCHMARK_FILE):
+        with open(VPN_BENCHMARK_FILE, "r") as f:
+            return json.load(f)
+    return {"runs": []}
+
+# Recommend the region with the best median tunnel throughput, using latency to break near-ties
+def recommend_vpn_region(history):
+    import statistics
+
+    by_region = {}
+    for run in history["runs"]:
+        for region, result in run.get("regions", {}).items():
+            if result.get("throughput_mbps"):
+                by_region.setdefault(region, []).append(result)
+    if not by_region:
+        return None
+    
+    summary = {}
+    for region, results in by_region.items():
+        latencies = [r["latency_ms"] for r in results if r.get("latency_ms") is not None]
+        summary[region] = {
+            "throughput_mbps": round(statistics.median(r["throughput_mbps"] for r in results), 2),
+            "latency_ms": round(statistics.median(latencies), 1) if latencies else None,
+            "samples": len(results)
+        }
+    best = max(summary.values(), key=lambda s: s["throughput_mbps"])["throughput_mbps"]
+    # Within 10% of the fastest, lower latency wins
+    close = [name for name, s in summary.items() if s["throughput_mbps"] >= best * 0.9]
+    region = min(close, key=lambda name: summary[name]["latency_ms"] if summary[name]["latency_ms"] is not None else float("inf"))
+    return {"region": region, "regions": summary}
+
+# Benchmark the host and the tunnel, optionally across candidate regions, and store the results
+def run_vpn_benchmark(config, regions=None):
+    settings = get_vpn_benchmark_settings(config)
+    url = settings["target_url"]
+    samples = settings["latency_samples"]
+    timeout = settings["timeout"]
+    current_region = config["vpn"]["region"]
+    
+    scheduler_checkpoint()
+    run = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "target_url": url,
+        "current_region": current_region,
+        "host": measure_host_network(url, samples, timeout),
+        "regions": {}
+    }
+    try:
+        run["regions"][current_region] = measure_tunnel_network(url, samples, timeout, settings)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        run["regions"][current_region] = {"error": str(e)}
+    
+    candidates = [region for region in (regions or []) if region != current_region]
+    if candidates:
+        compose_file = find_compose_file()
+        # Once the VPN leaves its region the downloads are offline, so don't pause until it is back
+        scheduler_checkpoint()
+        try:
+            for region in candidates:
+                try:
+                    switch_vpn_region(compose_file, region)
+                    run["regions"][region] = measure_tunnel_network(url, samples, timeout, settings)
+                except (RuntimeError, subprocess.SubprocessError) as e:
+                    run["regions"][region] = {"error": str(e)}
+        finally:
+            # Back to the configured region; the download clients share the VPN's network
+            # namespace, so they are recreated to join the new container
+            switch_vpn_region(compose_file)
+            dependents = [name for name in VPN_DEPENDENT_SERVICES if name in get_compose_images(compose_file)]
+            if dependents:
+                subprocess.run(["docker", "compose", "-f", compose_file, "up", "-d", "--no-deps", "--force-recreate", *dependents],
+                               check=True, capture_output=True, timeout=300)
+    
+    tunnel = run["regions"][current_region]
+    if tunnel.get("throughput_mbps") and run["host"]["throughput_mbps"]:
+        run["tunnel_vs_host"] = round(tunnel["throughput_mbps"] / run["host"]["throughput_mbps"], 2)
+    
+    history = load_vpn_benchmarks()
+    history["runs"] = (history["runs"] + [run])[-VPN_BENCHMARK_HISTORY:]
+    with open(VPN_BENCHMARK_FILE, "w") as f:
+        json.dump(history, f, indent=2)
+    run["recommendation"] = recommend_vpn_region(history)
+    return run
+
+# Debug profiling settings
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_INTERVAL_MS = 10
+PROFILE_MAX_INTERVAL_MS = 1000
+TRACE_HISTORY_SIZE = 50
+
+_profile_lock = threading.Lock()
+_trace_local = threading.local()
+_trace_history = []
+_trace_history_lock = threading.Lock()
+_trace_codes = None
+
+# Get the debug token; debug endpoints are off without one. Only the environment is trusted,
+# since /api/config can be read and written without authentication
+def get_debug_token():
+    return os.environ.get("PIPVR_DEBUG_TOKEN", "")
+
+# Check the request's X-Debug-Token header against the configured token
+def is_debug_request_authorized():
+    import hmac
+
+    token = get_debug_token()
+    supplied = request.headers.get("X-Debug-Token", "")
+    return bool(token) and hmac.compare_digest(token.encode(), supplied.encode())
+
+# Label a frame for a collapsed stack: function (file:first line)
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+# Sample every thread's stack at a fixed interval and count identical stacks
+def sample_stacks(seconds, interval):
+    names = {}
+    stacks = {}
+    samples = 0
+    sampling_time = 0.0
+    me = threading.get_ident()
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        tick = time.perf_counter()
+        # Thread names change rarely; refresh them once a second
+        if samples % max(int(1 / interval), 1) == 0:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            key = ";".join([names.get(ident, f"thread-{ident}")] + labels[::-1])
+            stacks[key] = stacks.get(key, 0) + 1
+        samples += 1
+        sampling_time += time.perf_counter() - tick
+        time.sleep(max(interval - (time.perf_counter() - tick), 0))
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 3),
+        "samples": samples,
+        "interval_ms": round(interval * 1000, 2),
+        # Share of one core spent taking samples
+        "overhead_percent": round(sampling_time / elapsed * 100, 2) if elapsed else 0,
+        "stacks": stacks
+    }
+
+# Format sampled stacks in the collapsed format flamegraph.pl and speedscope read
+def format_collapsed_stacks(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+# Map the code objects worth timing in a request trace to their category
+def _get_trace_codes():
+    global _trace_codes
+    if _trace_codes is None:
+        codes = {
+            subprocess.run: "subprocess",
+            subprocess.Popen.__init__: "subprocess",
+            subprocess.Popen.communicate: "subprocess",
+            subprocess.Popen.wait: "subprocess",
+            json.load: "json_load",
+            json.loads: "json_load",
+            json.dump: "json_save",
+            json.dumps: "serialization",
+            type(app.json).response: "serialization"
+        }
+        _trace_codes = {func.__code__: category for func, category in codes.items()}
+    return _trace_codes
+
+# Profile hook for a traced request's thread; times the outermost call in each category
+def _trace_profiler(frame, event, arg):
+    if event not in ("call", "return"):
+        return
+    trace = getattr(_trace_local, "trace", None)
+    category = _get_trace_codes().get(frame.f_code)
+    if trace is None or category is None:
+        return
+    stack = trace["_stack"]
+    if event == "call":
+        stack.append((frame, category, time.perf_counter()))
+    elif stack and stack[-1][0] is frame:
+        _, category, started = stack.pop()
+        if not any(entry[1] == category for entry in stack):
+            elapsed = (time.perf_counter() - started) * 1000
+            totals = trace["categories"].setdefault(category, {"ms": 0.0, "calls": 0})
+            totals["ms"] += elapsed
+            totals["calls"] += 1
+            if category == "subprocess" and frame.f_code is subprocess.run.__code__:
+                args = frame.f_locals.get("popenargs") or [frame.f_locals.get("args")]
+                command = args[0] if args else None
+                trace["commands"].append({
+                    "command": " ".join(command[:3]) if isinstance(command, (list, tuple)) else str(command),
+                    "ms": round(elapsed, 2)
+                })
+
+# Start tracing the current request
+def start_request_trace():
+    _trace_local.trace = {
+        "id": f"{int(time.time() * 1000):x}-{threading.get_ident() % 10000}",
+        "method": request.method,
+        "path": request.path,
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "categories": {},
+        "commands": [],
+        "_stack": [],
+        "_started": time.perf_counter()
+    }
+    sys.setprofile(_trace_profiler)
+
+# Stop tracing the current request and keep the result
+def finish_request_trace():
+    sys.setprofile(None)
+    trace = getattr(_trace_local, "trace", None)
+    _trace_local.trace = None
+    if trace is None:
+        return None
+    total = (time.perf_counter() - trace.pop("_started")) * 1000
+    trace.pop("_stack")
+    for totals in trace["categories"].values():
+        totals["ms"] = round(totals["ms"], 2)
+    trace["total_ms"] = round(total, 2)
+    trace["other_ms"] = round(total - sum(t["ms"] for t in trace["categories"].values()), 2)
+    with _trace_history_lock:
+        _trace_history.append(trace)
+        del _trace_history[:-TRACE_HISTORY_SIZE]
+    return trace
+
+# Installation profiling settings
+INSTALL_TIMINGS_HISTORY = 20  # runs kept in install-timings.json
+INSTALL_REPORT_SLOWEST = 3
+INSTALL_SLOW_PHASE_FACTOR = 1.5  # flag phases this much slower than their usual time
+
+# The installation currently running (or the last one), reported by /api/install/progress
+_install_run = None
+_install_run_lock = threading.Lock()
+
+# Describe this hardware so timings are only compared between similar boards
+def get_hardware_key(system_info):
+    pi = system_info.get("raspberry_pi", {})
+    hardware = system_info.get("hardware", {})
+    board = pi.get("model") if pi.get("is_raspberry_pi") else system_info.get("architecture", platform.machine())
+    cores = hardware.get("cpu", {}).get("cores") or os.cpu_count() or 1
+    memory_gb = round(float(hardware.get("memory", {}).get("total_gb") or 0))
+    return f"{board} / {cores} cores / {memory_gb} GB"
+
+# Load timings of previous installations
+def load_install_timings():
+    if os.path.exists(INSTALL_TIMINGS_FILE):
+        try:
+            with open(INSTALL_TIMINGS_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Failed to read installation timings: {e}")
+    return {"runs": []}
+
+# Save installation timings, keeping only the most recent runs
+def save_install_timings(timings):
+    timings["runs"] = timings["runs"][-INSTALL_TIMINGS_HISTORY:]
+    with open(INSTALL_TIMINGS_FILE, "w") as f:
+        json.dump(timings, f, indent=2)
+
+# Get the median duration of each phase from previous runs, preferring this hardware
+def get_phase_estimates(hardware_key, timings=None):
+    import statistics
+
+    runs = (timings or load_install_timings())["runs"]
+    estimates = {}
+    for same_hardware in (True, False):
+        durations = {}
+        for run in runs:
+            if (run.get("hardware") == hardware_key) != same_hardware:
+                continue
+            for phase in run["phases"]:
+                if phase["status"] == "ok":
+                    durations.setdefault(phase["name"], []).append(phase["seconds"])
+        # Other hardware only fills phases this board has never completed
+        for name, values in durations.items():
+            estimates.setdefault(name, {"seconds": round(statistics.median(values), 1), "same_hardware": same_hardware, "samples": len(values)})
+    return estimates
+
+# List the phases an installation with this config will run, in order
+def plan_install_phases(config, docker_installed):
+    phases = ["generate_compose", "env_file"]
+    if not docker_installed:
+        phases.append("docker_install")
+    if config["tailscale"]["enabled"]:
+        phases.append("tailscale_install")
+    phases.append("download_tuning")
+    if has_image_bundle(get_image_bundle_settings(config)["path"]):
+        phases.append("bundle_import")
+    return phases + ["image_pull", "compose_up"]
+
+# Start profiling an installation with the phases it is expected to run
+def start_install_profile(planned_phases, system_info=None):
+    global _install_run
+    hardware_key = get_hardware_key(system_info or get_cached_system_info())
+    run = {
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "started_monotonic": time.monotonic(),
+        "hardware": hardware_key,
+        "status": "in_progress",
+        "planned": list(planned_phases),
+        "phases": [],
+        "current": None,
+        "estimates": get_phase_estimates(hardware_key)
+    }
+    with _install_run_lock:
+        _install_run = run
+    return run
+
+# Time one installation phase; set phase["status"] = "failed" for failures that don't raise
+@contextmanager
+def install_phase(name):
+    phase = {"name": name, "status": "ok", "attempts": [], "_started": time.monotonic()}
+    with _install_run_lock:
+        run = _install_run
+        if run is not None:
+            run["current"] = phase
+    try:
+        yield phase
+    except Exception as e:
+        phase["status"] = "failed"
+        phase["error"] = str(e)
+        raise
+    finally:
+        with _install_run_lock:
+            phase["seconds"] = round(time.monotonic() - phase.pop("_started"), 2)
+            if run is not None:
+                run["phases"].append(phase)
+                run["current"] = None
+
+# Time one attempt of a retried phase; exceptions are recorded and re-raised
+@contextmanager
+def install_attempt(phase):
+    attempt = {"attempt": len(phase["attempts"]) + 1, "status": "ok"}
+    phase["attempts"].append(attempt)
+    started = time.monotonic()
+    try:
+        yield attempt
+    except Exception as e:
+        attempt["status"] = "failed"
+        attempt["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        attempt["seconds"] = round(time.monotonic() - started, 2)
+
+# Drop a planned phase that turned out not to be needed so the ETA stops counting it
+def skip_install_phase(name):
+    with _install_run_lock:
+        if _install_run is not None and name in _install_run["planned"]:
+            _install_run["planned"].remove(name)
+
+# Build the end-of-install summary, highlighting the slowest phases
+def build_install_report(run):
+    total = sum(phase["seconds"] for phase in run["phases"])
+    slowest = []
+    for phase in sorted(run["phases"], key=lambda p: p["seconds"], reverse=True)[:INSTALL_REPORT_SLOWEST]:
+        entry = {
+            "name": phase["name"],
+            "seconds": phase["seconds"],
+            "share": round(phase["seconds"] / total, 3) if total else 0,
+            "attempts": len(phase["attempts"]) or 1
+        }
+        usual = run["estimates"].get(phase["name"])
+        if usual and usual["same_hardware"]:
+            entry["usual_seconds"] = usual["seconds"]
+            entry["slower_than_usual"] = phase["seconds"] > usual["seconds"] * INSTALL_SLOW_PHASE_FACTOR
+        slowest.append(entry)
+    return {
+        "status": run["status"],
+        "total_seconds": round(total, 1),
+        "slowest": slowest,
+        "retried": [phase["name"] for phase in run["phases"] if len(phase["attempts"]) > 1]
+    }
+
+# Format the summary report for the installation log
+def format_install_report(report):
+    lines = [f"Installation took {report['total_seconds']}s. Slowest phases:"]
+    for phase in report["slowest"]:
+        line = f"  {phase['name']}: {phase['seconds']}s ({phase['share']:.0%})"
+        if phase["attempts"] > 1:
+            line += f", {phase['attempts']} attempts"
+        if phase.get("slower_than_usual"):
+            line += f", usually {phase['usual_seconds']}s on this hardware"
+        lines.append(line)
+    return "\n".join(lines)
+
+# Finish profiling, persist the timings and return the summary report
+def finish_install_profile(status):
+    with _install_run_lock:
+        run = _install_run
+        if run is None or run["status"] != "in_progress":
+            return None
+        run["status"] = status
+        run["current"] = None
+        run["total_seconds"] = round(time.monotonic() - run["started_monotonic"], 1)
+        run["report"] = build_install_report(run)
+    
+    try:
+        timings = load_install_timings()
+        timings["runs"].append({key: run[key] for key in ("started", "hardware", "status", "total_seconds", "phases")})
+        save_install_timings(timings)
+    except OSError as e:
+        print(f"Warning: Failed to save installation timings: {e}")
+    return run["report"]
+
+# Report the running installation's phase, elapsed time and ETA
+def get_install_progress():
+    with _install_run_lock:
+        run = _install_run
+        if run is None:
+            return {"status": "idle"}
+        now = time.monotonic()
+        completed = [{"name": p["name"], "status": p["status"], "seconds": p["seconds"], "attempts": len(p["attempts"]) or 1}
+                     for p in run["phases"]]
+        current = run["current"]
+        progress = {
+            "status": run["status"],
+            "hardware": run["hardware"],
+            "started": run["started"],
+            "elapsed_seconds": round(now - run["started_monotonic"], 1) if run["status"] == "in_progress" else run["total_seconds"],
+            "completed_phases": completed,
+            "current_phase": None
+        }
+        if run["status"] != "in_progress":
+            progress["report"] = run.get("report")
+            return progress
+        
+        done = {phase["name"] for phase in run["phases"]}
+        remaining = [name for name in run["planned"] if name not in done and (current is None or name != current["name"])]
+        eta = 0.0
+        unknown = []
+        if current is not None:
+            current_elapsed = now - current["_started"]
+            progress["current_phase"] = {
+                "name": current["name"],
+                "elapsed_seconds": round(current_elapsed, 1),
+                "attempt": len(current["attempts"]) or 1
+            }
+            estimate = run["estimates"].get(current["name"])
+            if estimate:
+                eta += max(estimate["seconds"] - current_elapsed, 0)
+            else:
+                unknown.append(current["name"])
+        for name in remaining:
+            estimate = run["estimates"].get(name)
+            if estimate:
+                eta += estimate["seconds"]
+            else:
+                unknown.append(name)
+        
+        progress["remaining_phases"] = remaining
+        progress["eta_seconds"] = round(eta, 1)
+        # Phases never timed before make the ETA a lower bound
+        progress["eta_phases_without_history"] = unknown
+        return progress
+
+# Run installation in a separate thread
+def run_installation(config, services):
+    max_retries = 3  # Maximum number of retries for failed operations
+    
+    try:
+        # Update installation status
+        config["installation_status"] = "in_progress"
+        save_config(config)
+        docker_installed = is_docker_installed()
+        start_install_profile(plan_install_phases(config, docker_installed))
+        
+        # Generate docker-compose file
+        log_installation("Generating docker-compose.yml...")
+        with install_phase("generate_compose") as phase:
+            result = generate_docker_compose(config, services)
+            if not result["success"]:
+                phase["status"] = "failed"
+                log_installation(f"Failed to generate docker-compose.yml: {result.get('error', 'Unknown error')}")
+                config["installation_status"] = "failed"
+                save_config(config)
+                return
+        
+        # Create .env file
+        log_installation("Creating .env file...")
+        with install_phase("env_file") as phase:
+            try:
+                env_file_path = create_env_file(config)
+                log_installation(f"Created .env file at {env_file_path}")
+            except Exception as e:
+                phase["status"] = "failed"
+                log_installation(f"Failed to create .env file: {str(e)}")
+                config["installation_status"] = "failed"
+                save_config(config)
+                return
+        
+        # Install Docker if not installed
+        if not docker_installed:
+            log_installation("Installing Docker...")
+            with install_phase("docker_install") as phase:
+                for attempt in range(max_retries):
+                    try:
+                        with install_attempt(phase):
+                            # Download the Docker install script with timeout
+                            subprocess.run([
+                                "curl", "-fsSL", "https://get.docker.com", "-o", "get-docker.sh"
+                            ], check=True, timeout=60)
+                            
+                            # Run the Docker install script with timeout
+                            subprocess.run(["sh", "get-docker.sh"], check=True, timeout=300)
+                            
+                            # Clean up
+                            if os.path.exists("get-docker.sh"):
+                                os.remove("get-docker.sh")
+                        
+                        log_installation("Docker installed successfully")
+                        break
+                    except subprocess.TimeoutExpired:
+                        log_installation(f"Docker installation timed out (attempt {attempt+1}/{max_retries})")
+                        if attempt == max_retries - 1:
+                            phase["status"] = "failed"
+                            log_installation("Failed to install Docker: operation timed out")
+                            config["installation_status"] = "failed"
+                            save_config(config)
+                            return
+                    except subprocess.CalledProcessError as e:
+                        log_installation(f"Error installing Docker (attempt {attempt+1}/{max_retries}): {str(e)}")
+                        if attempt == max_retries - 1:
+                            phase["status"] = "failed"
+                            log_installation("Failed to install Docker after multiple attempts")
+                            config["installation_status"] = "failed"
+                            save_config(config)
+                            return
+                    
+                    # Wait before retrying
+                    time.sleep(5)
+        
+        # Install Tailscale if enabled
+        if config["tailscale"]["enabled"]:
+            log_installation("Installing Tailscale...")
+            with install_phase("tailscale_install") as phase:
+                for attempt in range(max_retries):
+                    try:
+                        with install_attempt(phase):
+                            # Download the Tailscale install script with timeout
+                            subprocess.run([
+                                "curl", "-fsSL", "https://tailscale.com/install.sh", "-o", "install-tailscale.sh"
+                            ], check=True, timeout=60)
+                            
+                            # Run the Tailscale install script with timeout
+                            subprocess.run(["sh", "install-tailscale.sh"], check=True, timeout=120)
+                            
+                            # Clean up
+                            if os.path.exists("install-tailscale.sh"):
+                                os.remove("install-tailscale.sh")
+                            
+                            # Set up Tailscale if auth key provided
+                            if config["tailscale"]["auth_key"]:
+                                subprocess.run([
+                                    "sudo", "tailscale", "up",
+                                    "--authkey", config["tailscale"]["auth_key"],
+                                    "--accept-routes=false"
+                                ], check=True, timeout=60)
+                        
+                        log_installation("Tailscale installed successfully")
+                        break
+                    except subprocess.TimeoutExpired:
+                        log_installation(f"Tailscale installation timed out (attempt {attempt+1}/{max_retries})")
+                        if attempt == max_retries - 1:
+                            phase["status"] = "failed"
+                            log_installation("Failed to install Tailscale: operation timed out")
+                            # This is non-critical, so we continue with the installation
+                    except subprocess.CalledProcessError as e:
+                        log_installation(f"Error installing Tailscale (attempt {attempt+1}/{max_retries}): {str(e)}")
+                        if attempt == max_retries - 1:
+                            phase["status"] = "failed"
+                            log_installation("Failed to install Tailscale after multiple attempts")
+                            # This is non-critical, so we continue with the installation
+                    
+                    # Wait before retrying
+                    time.sleep(5)
+        
+        # Tune download clients before their first start
+        pending_tuning = []
+        log_installation("Applying download client tuning...")
+        with install_phase("download_tuning") as phase:
+            try:
+                tuning = apply_download_tuning(config, services, restart=False)
+                for client, result in tuning["clients"].items():
+                    log_installation(f"Download client tuning for {client}: {result['status']}")
+                    if result["status"] == "pending":
+                        pending_tuning.append(client)
+            except Exception as e:
+                # Stock settings still work, so this is not fatal
+                phase["status"] = "failed"
+                log_installation(f"Failed to apply download client tuning: {str(e)}")
+        
+        # Get the path to the docker-compose.yml file
+        docker_compose_file = os.path.join(BASE_DIR, "docker-compose.yml")
+        
+        # Check if the file exists, if not, look in the docker-compose directory
+        if not os.path.exists(docker_compose_file):
+            docker_compose_file = os.path.join(DOCKER_COMPOSE_DIR, "docker-compose.yml")
+        
+        # Load images from the offline bundle so only the missing ones come from the registry
+        bundle_settings = get_image_bundle_settings(config)
+        pull_services = None  # None pulls every service
+        if os.path.exists(docker_compose_file) and has_image_bundle(bundle_settings["path"]):
+            log_installation(f"Importing Docker images from bundle at {bundle_settings['path']}...")
+            with install_phase("bundle_import") as phase:
+                try:
+                    bundle_report = import_image_bundle(config, docker_compose_file)
+                    log_installation(format_image_bundle_import(bundle_report))
+                    pull_services = bundle_report["missing_services"]
+                    if not pull_services:
+                        log_installation("All Docker images loaded from the bundle, skipping pull")
+                        skip_install_phase("image_pull")
+                except Exception as e:
+                    # Everything is pulled from the registry instead
+                    phase["status"] = "failed"
+                    log_installation(f"Failed to import image bundle: {str(e)}")
+        
+        # Pull images as their own step so download time shows up separately in the timings
+        if os.path.exists(docker_compose_file) and pull_services != []:
+            log_installation("Pulling Docker images...")
+            with install_phase("image_pull") as phase:
+                try:
+                    with install_attempt(phase):
+                        subprocess.run([
+                            "docker", "compose",
+                            "-f", docker_compose_file,
+                            "pull", *(pull_services or [])
+                        ], check=True, timeout=1800)
+                    log_installation("Docker images pulled successfully")
+                except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+                    # `up` pulls anything still missing, so carry on
+                    phase["status"] = "failed"
+                    log_installation(f"Failed to pull Docker images: {str(e)}")
+        
+        # Start Docker Compose stack
+        log_installation("Starting Docker Compose stack...")
+        with install_phase("compose_up") as phase:
+            for attempt in range(max_retries):
+                try:
+                    # Log the file path for debugging
+                    log_installation(f"Using docker-compose file: {docker_compose_file}")
+                    
+                    # Validate that the file exists
+                    if not os.path.exists(docker_compose_file):
+                        phase["status"] = "failed"
+                        log_installation(f"Error: Docker compose file not found at {docker_compose_file}")
+                        config["installation_status"] = "failed"
+                        save_config(config)
+                        return
+                    
+                    # Start the Docker Compose stack with timeout
+                    with install_attempt(phase):
+                        subprocess.run([
+                            "docker", "compose",
+                            "-f", docker_compose_file,
+                            "up", "-d"
+                        ], check=True, timeout=300)  # 5 minutes timeout
+                    
+                    log_installation("Docker Compose stack started successfully")
+                    config["installation_status"] = "completed"
+                    break
+                except subprocess.TimeoutExpired:
+                    log_installation(f"Docker Compose startup timed out (attempt {attempt+1}/{max_retries})")
+                    if attempt == max_retries - 1:
+                        phase["status"] = "failed"
+                        log_installation("Failed to start Docker Compose: operation timed out")
+                        config["installation_status"] = "failed"
+                except subprocess.CalledProcessError as e:
+                    log_installation(f"Error starting Docker Compose (attempt {attempt+1}/{max_retries}): {str(e)}")
+                    if attempt == max_retries - 1:
+                        phase["status"] = "failed"
+                        log_installation("Failed to start Docker Compose after multiple attempts")
+                        config["installation_status"] = "failed"
+                
+                # Wait before retrying
+                time.sleep(10)
+        
+        # Refresh the bundle in the background so the next install or node can skip the downloads
+        if bundle_settings["path"] and bundle_settings["export_after_install"] and \
+                config["installation_status"] == "completed":
+            submit_job("image_bundle_export", "bundle", export_image_bundle, config, docker_compose_file)
+            log_installation(f"Queued image bundle export to {bundle_settings['path']}")
+        
+        # Tune clients whose settings file only exists after their first start
+        if pending_tuning and config["installation_status"] == "completed":
+            with install_phase("download_tuning_pending") as phase:
+                try:
+                    tuning = apply_pending_download_tuning(config, services, pending_tuning)
+                    for client, result in tuning["clients"].items():
+                        log_installation(f"Download client tuning for {client}: {result['status']}")
+                except Exception as e:
+                    phase["status"] = "failed"
+                    log_installation(f"Failed to apply download client tuning: {str(e)}")
+        
+        save_config(config)
+        log_installation(f"Installation completed with status: {config['installation_status']}")
+    except Exception as e:
+        log_installation(f"Installation failed with unexpected error: {str(e)}")
+        config["installation_status"] = "failed"
+        save_config(config)
+    finally:
+        # Record phase timings for future ETAs and log where the time went
+        report = finish_install_profile(config["installation_status"])
+        if report:
+            log_installation(format_install_report(report))
+
+# Note the first request served so startup benchmarks can see it
+@app.before_request
+def note_first_request():
+    if "first_request_ms" not in STARTUP_TIMINGS:
+        record_startup_timing("first_request_ms")
+
+# Trace requests that opt in with an X-Trace header (debug token required)
+@app.before_request
+def trace_request():
+    if request.headers.get("X-Trace") and is_debug_request_authorized():
+        start_request_trace()
+
+# Report a traced request's timings in a Server-Timing header
+@app.after_request
+def add_trace_headers(response):
+    trace = finish_request_trace() if getattr(_trace_local, "trace", None) else None
+    if trace:
+        timings = [f"{name};dur={totals['ms']}" for name, totals in trace["categories"].items()]
+        timings += [f"other;dur={trace['other_ms']}", f"total;dur={trace['total_ms']}"]
+        response.headers["Server-Timing"] = ", ".join(timings)
+        response.headers["X-Trace-Id"] = trace["id"]
+    return response
+
+# Make sure tracing never outlives a request that failed
+@app.teardown_request
+def stop_request_trace(exception=None):
+    if getattr(_trace_local, "trace", None):
+        finish_request_trace()
+
+# API routes
+@app.route('/api/health', methods=['GET'])
+def api_health():
+    """Readiness check; answers without touching Docker or the hardware probes"""
+    return jsonify({
+        "status": "ok",
+        "fast_start": FAST_START,
+        "caches_warm": _caches_warm.is_set(),
+        "uptime_seconds": round(time.monotonic() - _PROCESS_START, 3),
+        "startup": STARTUP_TIMINGS,
+        "memory": get_process_memory(),
+        "pid": os.getpid()
+    })
+
+@app.route('/api/system', methods=['GET'])
+def api_system_info():
+    import psutil
+
+    system_info = get_cached_system_info()
+    
+    # Add CPU temperature for Pi health dashboard
+    temperature = get_cpu_temperature()
+    if temperature is not None:
+        system_info['temperature_celsius'] = temperature
+    # Otherwise it might already be available from get_system_info
+    
+    # Add CPU usage percentage (non-blocking once the warm-up has primed it)
+    try:
+        interval = None if _caches_warm.is_set() else 0.5
+        system_info['cpu_usage_percent'] = psutil.cpu_percent(interval=interval)
+    except Exception as e:
+        print(f"Error getting CPU usage: {e}")
+    
+    return jsonify(system_info)
+
+@app.route('/api/drives', methods=['GET'])
 def api_drives():
     drives = []
     try:
@@ -706,11 +4603,20 @@ def api_save_config():
 
 @app.route('/api/services', methods=['GET'])
 def api_get_services():
-    return jsonify(load_services())
+    """Get the enabled services, plus each container's status and health when containers=true"""
+    services = dict(load_services())
+    # Listing containers runs docker ps and starts the health prober, so only do it when asked
+    if request.args.get("containers", "").lower() in ("1", "true", "yes"):
+        services["services"] = get_container_services()
+    return jsonify(services)
 
 @app.route('/api/services', methods=['POST'])
 def api_save_services():
-    services = request.json
+    services = request.get_json(silent=True)
+    if not isinstance(services, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object of service selections"}), 400
+    # The container list is live data, not configuration
+    services.pop("services", None)
     save_services(services)
     return jsonify({"status": "success"})
 
@@ -723,38 +4629,18 @@ def api_status():
         "containers": containers
     })
 
-@app.route('/api/services', methods=['GET'])
-def api_get_container_services():
-    """Get list of services formatted for the web UI"""
+@app.route('/api/services/health', methods=['GET'])
+def api_services_health():
+    """Get probe-based health and latency for every container"""
     containers = get_container_status()
+    ensure_health_prober()
     
-    # Format containers into a list of services for the UI
-    services = []
-    for name, container in containers.items():
-        if name == "error":
-            continue
-            
-        # Create service object
-        service = {
-            "name": name,
-            "status": container["status"],
-            "type": container.get("type", "other"),
-            "description": container.get("description", ""),
-            "url": container.get("url", None)
-        }
-        
-        # Extract port from URL or use container ports
-        if service["url"] and ":" in service["url"]:
-            service["port"] = service["url"].split(":")[-1]
-        elif container.get("ports") and len(container["ports"]) > 0:
-            service["port"] = container["ports"][0].get("host", "")
-        else:
-            service["port"] = ""
-            
-        services.append(service)
+    # ?probe=true probes every running service now instead of waiting for its schedule
+    if request.args.get("probe", "").lower() in ("1", "true", "yes"):
+        probe_services(containers, force=True)
     
     return jsonify({
-        "services": services
+        "services": get_services_health(containers)
     })
 
 @app.route('/api/install', methods=['POST'])
@@ -770,6 +4656,11 @@ def api_install():
         "message": "Installation started"
     })
 
+@app.route('/api/install/progress', methods=['GET'])
+def api_install_progress():
+    """Current installation phase, elapsed time and ETA from previous runs on this hardware"""
+    return jsonify(get_install_progress())
+
 @app.route('/api/logs', methods=['GET'])
 def api_logs():
     if os.path.exists(INSTALLATION_LOG):
@@ -778,6 +4669,27 @@ def api_logs():
         return jsonify({"logs": logs})
     return jsonify({"logs": ""})
 
+@app.route('/api/containers/<name>/logs', methods=['GET'])
+def api_container_logs(name):
+    """Stream a container's logs as plain text or server-sent events"""
+    if not re.match(r'^[a-zA-Z0-9][a-zA-Z0-9_.-]*$', name):
+        return jsonify({"status": "error", "message": "Invalid container name"}), 400
+    
+    tail = request.args.get("tail", str(LOG_TAIL_DEFAULT))
+    since = request.args.get("since")
+    if not tail.isdigit():
+        return jsonify({"status": "error", "message": "tail must be a number"}), 400
+    if since and not re.match(r'^[0-9A-Za-z:.+-]+$', since):
+        return jsonify({"status": "error", "message": "Invalid since value"}), 400
+    
+    follow = request.args.get("follow", "false").lower() == "true"
+    sse = request.args.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    logs = stream_container_logs(name, min(int(tail), LOG_TAIL_MAX), since, follow, sse)
+    response = Response(logs, mimetype="text/event-stream" if sse else "text/plain")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @app.route('/api/generate-compose', methods=['POST'])
 def api_generate_compose():
     config = load_config()
@@ -785,6 +4697,359 @@ def api_generate_compose():
     result = generate_docker_compose(config, services)
     return jsonify(result)
 
+@app.route('/api/compose/plan', methods=['GET'])
+def api_compose_plan():
+    """Preview the hardware-derived compose overrides without applying them"""
+    config = load_config()
+    services = load_services()
+    overrides = build_compose_overrides(config, services, get_cached_system_info())
+    return jsonify({
+        "plan": overrides,
+        "compose": to_compose_yaml({"services": compose_overrides_to_services(overrides)})
+    })
+
+@app.route('/api/download-clients/tuning', methods=['GET'])
+def api_download_tuning_preview():
+    """Preview tuned settings for the selected download clients"""
+    measure = request.args.get("measure", "").lower() in ("1", "true", "yes")
+    return jsonify(preview_download_tuning(load_config(), load_services(), measure))
+
+@app.route('/api/download-clients/tuning', methods=['POST'])
+def api_download_tuning_apply():
+    """Apply tuned settings, keeping any values the user has changed"""
+    options = request.get_json(silent=True) or {}
+    try:
+        result = apply_download_tuning(
+            load_config(), load_services(),
+            clients=options.get("clients"),
+            restart=options.get("restart", True),
+            measure=options.get("measure", False)
+        )
+        return jsonify({"status": "success", **result})
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/fleet/nodes', methods=['GET'])
+def api_fleet_nodes():
+    return jsonify(load_fleet())
+
+@app.route('/api/fleet/nodes', methods=['POST'])
+def api_fleet_add_node():
+    node = request.get_json(silent=True) or {}
+    if not node.get("name") or not node.get("url"):
+        return jsonify({"status": "error", "message": "Node name and url are required"}), 400
+    if node["name"] == LOCAL_NODE_NAME:
+        return jsonify({"status": "error", "message": f"'{LOCAL_NODE_NAME}' is reserved for this node"}), 400
+    if not re.match(r'^https?://', node["url"]):
+        return jsonify({"status": "error", "message": "Node url must start with http:// or https://"}), 400
+    
+    # Adding a node with an existing name updates it
+    fleet = load_fleet()
+    fleet["nodes"] = [n for n in fleet.get("nodes", []) if n["name"] != node["name"]]
+    fleet["nodes"].append({
+        "name": node["name"],
+        "url": node["url"].rstrip("/"),
+        "enabled": node.get("enabled", True),
+        "timeout": node.get("timeout", FLEET_TIMEOUT)
+    })
+    save_fleet(fleet)
+    return jsonify({"status": "success"})
+
+@app.route('/api/fleet/nodes/<name>', methods=['DELETE'])
+def api_fleet_remove_node(name):
+    fleet = load_fleet()
+    nodes = [n for n in fleet.get("nodes", []) if n["name"] != name]
+    if len(nodes) == len(fleet.get("nodes", [])):
+        return jsonify({"status": "error", "message": f"Unknown node: {name}"}), 404
+    fleet["nodes"] = nodes
+    save_fleet(fleet)
+    return jsonify({"status": "success"})
+
+@app.route('/api/fleet/status', methods=['GET'])
+def api_fleet_status():
+    """Installation and container status from every node"""
+    def local_status():
+        return {"installation_status": load_config()["installation_status"], "containers": get_container_status()}
+    
+    fan_out = fleet_fan_out(get_fleet_nodes(), "GET", "/api/status", local_handler=local_status)
+    return jsonify(aggregate_fleet_status(fan_out))
+
+@app.route('/api/fleet/system', methods=['GET'])
+def api_fleet_system():
+    """System information from every node"""
+    return jsonify(fleet_fan_out(get_fleet_nodes(), "GET", "/api/system", local_handler=get_cached_system_info))
+
+@app.route('/api/fleet/containers/<action>/<container>', methods=['POST'])
+def api_fleet_container_action(action, container):
+    """Start, stop or restart a container on every node (or the nodes listed in the body)"""
+    if action not in FLEET_CONTAINER_ACTIONS:
+        return jsonify({"status": "error", "message": f"Unknown action: {action}"}), 400
+    
+    names = (request.get_json(silent=True) or {}).get("nodes")
+    local_handler = None
+    if not names or LOCAL_NODE_NAME in names:
+        def local_handler():
+            subprocess.run(["docker", action, container], check=True, capture_output=True, timeout=60)
+            return {"status": "success"}
+    
+    return jsonify(fleet_fan_out(get_fleet_nodes(names), "POST", f"/api/{action}/{container}", local_handler=local_handler))
+
+@app.route('/api/updates', methods=['GET'])
+def api_image_updates():
+    """Per-service image update status; refresh=true bypasses the digest cache"""
+    try:
+        force = request.args.get("refresh", "false").lower() == "true"
+        return jsonify(check_image_updates(get_compose_images(), force=force))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/updates/apply', methods=['POST'])
+def api_apply_image_updates():
+    """Update the listed services, or every service with an update available"""
+    data = request.get_json(silent=True) or {}
+    job = submit_job("image_updates", "pull", apply_image_updates, data.get("services"))
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
+@app.route('/api/backups', methods=['GET'])
+def api_list_backups():
+    return jsonify({"backups": list_backups(load_config())})
+
+@app.route('/api/backups/<service>', methods=['POST'])
+def api_run_backup(service):
+    """Back up a service's config directory; incremental unless full=true"""
+    data = request.get_json(silent=True) or {}
+    config = load_config()
+    try:
+        # Check the request now rather than failing later in the queue
+        if not os.path.isdir(get_backup_source(config, service)):
+            raise ValueError(f"No config directory for {service}")
+        get_backup_dir(config, service)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    job = submit_job(f"backup:{service}", "backup", run_backup, config, service,
+                     full=data.get("full", False), quiesce=data.get("quiesce", False))
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
+@app.route('/api/backups/<service>/download', methods=['GET'])
+def api_download_backup(service):
+    """Stream a full tar.gz backup of a service's config directory"""
+    try:
+        chunks = stream_backup(load_config(), service)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    response = Response(chunks, mimetype="application/gzip")
+    response.headers["Content-Disposition"] = f"attachment; filename={service}-{time.strftime('%Y%m%d-%H%M%S')}.tar.gz"
+    return response
+
+@app.route('/api/backups/<service>/restore', methods=['POST'])
+def api_restore_backup(service):
+    """Restore a service from its latest backup, or the archive named in the body"""
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(restore_backup(load_config(), service, data.get("archive"), quiesce=data.get("quiesce", True)))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except (OSError, subprocess.SubprocessError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/media/scan', methods=['GET'])
+def api_media_scan_status():
+    with _media_scan_lock:
+        return jsonify(dict(_media_scan_state))
+
+@app.route('/api/media/scan', methods=['POST'])
+def api_media_scan():
+    """Start a background scan of media_dir and downloads_dir; full=true relists every directory"""
+    with _media_scan_lock:
+        if _media_scan_state["running"]:
+            return jsonify({"status": "error", "message": "A scan is already running"}), 409
+    full = (request.get_json(silent=True) or {}).get("full", False)
+    job = submit_job("media_scan", "scan", run_media_scan, load_config(), full)
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
+@app.route('/api/media/usage', methods=['GET'])
+def api_media_usage():
+    """Disk usage by category, served from the index"""
+    return jsonify(get_media_usage(load_config()))
+
+@app.route('/api/media/largest', methods=['GET'])
+def api_media_largest():
+    category = request.args.get("category")
+    kind = request.args.get("kind", "directories")
+    limit = request.args.get("limit", "20")
+    if kind not in ("directories", "files") or not limit.isdigit():
+        return jsonify({"status": "error", "message": "kind must be directories or files and limit a number"}), 400
+    try:
+        return jsonify({"items": get_largest_media_items(load_config(), category, kind, min(int(limit), 500))})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/api/dedupe', methods=['GET'])
+def api_dedupe_status():
+    """Progress of a running analysis and the last duplicate report"""
+    with _dedupe_lock:
+        state = {key: value for key, value in _dedupe_state.items() if key != "stop"}
+    state["report"] = load_dedupe_report()
+    return jsonify(state)
+
+@app.route('/api/dedupe/scan', methods=['POST'])
+def api_dedupe_scan():
+    with _dedupe_lock:
+        if _dedupe_state["running"]:
+            return jsonify({"status": "error", "message": "An analysis is already running"}), 409
+    job = submit_job("dedupe", "dedupe", run_dedupe_analysis, load_config())
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
+@app.route('/api/dedupe/stop', methods=['POST'])
+def api_dedupe_stop():
+    """Stop the running analysis; hashes computed so far are kept for the next run"""
+    _dedupe_state["stop"].set()
+    return jsonify({"status": "success"})
+
+@app.route('/api/dedupe/hardlink', methods=['POST'])
+def api_dedupe_hardlink():
+    """Replace duplicates with hardlinks; body: {"groups": [...], "dry_run": false}"""
+    data = request.get_json(silent=True) or {}
+    with _dedupe_lock:
+        if _dedupe_state["running"]:
+            return jsonify({"status": "error", "message": "Wait for the running analysis to finish"}), 409
+    try:
+        return jsonify(hardlink_duplicates(data.get("groups"), data.get("dry_run", False)))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except OSError as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/scheduler', methods=['GET'])
+def api_scheduler():
+    """Current conditions, throttling decision and job queue of the background scheduler"""
+    settings = get_scheduler_settings(load_config())
+    conditions = get_scheduler_conditions(settings, get_selected_media_server(load_services()))
+    with _scheduler_cond:
+        current = _scheduler_state["current"]
+        jobs = [describe_job(job) for job in _scheduler_jobs]
+    return jsonify({
+        "enabled": settings["enabled"],
+        "conditions": conditions,
+        "decision": get_scheduler_decision(current["kind"] if current else "default", settings, conditions, record=False),
+        "current": describe_job(current) if current else None,
+        "jobs": jobs,
+        "settings": {key: value for key, value in settings.items() if key != "media_server_api_key"}
+    })
+
+@app.route('/api/scheduler/jobs/<job_id>', methods=['GET'])
+def api_scheduler_job(job_id):
+    with _scheduler_cond:
+        for job in _scheduler_jobs:
+            if job["id"] == job_id:
+                return jsonify(describe_job(job))
+    return jsonify({"status": "error", "message": f"Unknown job: {job_id}"}), 404
+
+@app.route('/api/scheduler/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    job = cancel_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job: {job_id}"}), 404
+    return jsonify(describe_job(job))
+
+@app.route('/api/vpn/benchmark', methods=['GET'])
+def api_vpn_benchmarks():
+    """Benchmark history and the recommended region"""
+    history = load_vpn_benchmarks()
+    return jsonify({"runs": history["runs"], "recommendation": recommend_vpn_region(history)})
+
+@app.route('/api/vpn/benchmark', methods=['POST'])
+def api_vpn_benchmark():
+    """Queue a benchmark; listing regions switches the VPN through each one, interrupting downloads"""
+    config = load_config()
+    data = request.get_json(silent=True) or {}
+    regions = data.get("regions", get_vpn_benchmark_settings(config)["regions"])
+    if not isinstance(regions, list) or not all(isinstance(r, str) and r for r in regions):
+        return jsonify({"status": "error", "message": "regions must be a list of region names"}), 400
+    job = submit_job("vpn_benchmark", "benchmark", run_vpn_benchmark, config, regions)
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
+@app.route('/api/debug/profile', methods=['GET'])
+def api_debug_profile():
+    """Sample all threads' stacks for a while and return them collapsed, for a flamegraph"""
+    if not is_debug_request_authorized():
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    import math
+
+    try:
+        seconds = float(request.args.get("seconds", 5))
+        interval_ms = float(request.args.get("interval_ms", PROFILE_DEFAULT_INTERVAL_MS))
+    except ValueError:
+        return jsonify({"status": "error", "message": "seconds and interval_ms must be numbers"}), 400
+    # Comparisons with NaN are always false, so check for it explicitly
+    if math.isnan(seconds) or math.isnan(interval_ms) or seconds <= 0 or interval_ms <= 0:
+        return jsonify({"status": "error", "message": "seconds and interval_ms must be positive numbers"}), 400
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    interval = min(max(interval_ms, 1), PROFILE_MAX_INTERVAL_MS) / 1000
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({"status": "error", "message": "A profile is already running"}), 409
+    try:
+        profile = sample_stacks(seconds, interval)
+    finally:
+        _profile_lock.release()
+    
+    if request.args.get("format") == "json":
+        return jsonify(profile)
+    response = Response(format_collapsed_stacks(profile["stacks"]), mimetype="text/plain")
+    response.headers["X-Profile-Samples"] = str(profile["samples"])
+    response.headers["X-Profile-Overhead-Percent"] = str(profile["overhead_percent"])
+    return response
+
+@app.route('/api/debug/traces', methods=['GET'])
+def api_debug_traces():
+    """Recent traces of requests sent with X-Trace"""
+    if not is_debug_request_authorized():
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    with _trace_history_lock:
+        return jsonify({"traces": list(_trace_history)})
+
+@app.route('/api/images/bundle', methods=['GET'])
+def api_image_bundle():
+    """Offline image bundle contents and the last export and import reports"""
+    path = get_image_bundle_settings(load_config())["path"]
+    bundle = load_image_bundle(path) if has_image_bundle(path) else {"images": {}, "blobs": {}}
+    images = {
+        image: {
+            "id": entry.get("id"),
+            "architecture": entry.get("architecture"),
+            "exported": entry.get("exported"),
+            "size_bytes": sum(bundle["blobs"].get(d, 0) for d in {m["digest"] for m in entry["members"] if m.get("digest")})
+        }
+        for image, entry in bundle["images"].items()
+    }
+    return jsonify({
+        "path": path,
+        "updated": bundle.get("updated"),
+        "images": images,
+        "summary": summarize_image_bundle(bundle),
+        "last_export": _image_bundle_reports["export"],
+        "last_import": _image_bundle_reports["import"]
+    })
+
+@app.route('/api/images/bundle/export', methods=['POST'])
+def api_image_bundle_export():
+    """Queue an export of the compose file's images into the bundle"""
+    config = load_config()
+    if not get_image_bundle_settings(config)["path"]:
+        return jsonify({"status": "error", "message": "No image bundle path configured (set image_bundle.path in config.json)"}), 400
+    job = submit_job("image_bundle_export", "bundle", export_image_bundle, config)
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
+@app.route('/api/images/bundle/import', methods=['POST'])
+def api_image_bundle_import():
+    """Queue loading missing images from the bundle"""
+    config = load_config()
+    path = get_image_bundle_settings(config)["path"]
+    if not has_image_bundle(path):
+        return jsonify({"status": "error", "message": f"No image bundle found at {path or '(image_bundle.path not set)'}"}), 400
+    job = submit_job("image_bundle_import", "bundle", import_image_bundle, config)
+    return jsonify({"status": "queued", "job": describe_job(job)}), 202
+
 @app.route('/api/restart', methods=['POST'])
 def api_restart():
     try:
@@ -869,12 +5134,30 @@ def serve_static(path):
 
 # Main entry point
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PI-PVR API server")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Low-footprint mode: no debug reloader, probes deferred and warmed in the background")
+    args = parser.parse_args()
+    FAST_START = FAST_START or args.fast_start
+
     # Ensure config and services files exist
+    ensure_directories()
     if not os.path.exists(CONFIG_FILE):
         save_config(DEFAULT_CONFIG)
     
     if not os.path.exists(SERVICES_FILE):
         save_services(DEFAULT_SERVICES)
     
+    record_startup_timing("app_init_ms")
+    
     # Start the server
-    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    if FAST_START:
+        # The debug reloader runs a second copy of the process, doubling RSS
+        start_cache_warmup()
+        app.run(host=args.host, port=args.port, debug=False, use_reloader=False, threaded=True)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
\ No newline at end of file
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the PI-PVR API server
+Measures time to first /api/health response, time until caches are warm
+and resident memory, so results can be compared across releases
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+API_SCRIPT = os.path.join(SCRIPT_DIR, "api.py")
+
+# Find a free local port for the server under test
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Fetch a JSON endpoint, returning None if the server is not answering yet
+def fetch_json(url, timeout=1.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except (urllib.error.URLError, ConnectionError, socket.timeout, ValueError):
+        return None
+
+# Get a label for this release from git, falling back to "unknown"
+def get_release_label():
+    try:
+        result = subprocess.run(
+            ["git", "-C", BASE_DIR, "describe", "--tags", "--always", "--dirty"],
+            capture_output=True, text=True, check=True, timeout=5
+        )
+        return result.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+        return "unknown"
+
+# Start the API server once and measure its startup
+def run_once(mode, timeout):
+    port = find_free_port()
+    cmd = [sys.executable, API_SCRIPT, "--host", "127.0.0.1", "--port", str(port)]
+    if mode == "fast":
+        cmd.append("--fast-start")
+
+    health_url = f"http://127.0.0.1:{port}/api/health"
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {"mode": mode}
+    try:
+        # Poll until the readiness endpoint answers
+        health = None
+        while health is None:
+            if time.monotonic() - started > timeout:
+                raise TimeoutError(f"API did not answer within {timeout}s")
+            if proc.poll() is not None:
+                raise RuntimeError(f"API exited with code {proc.returncode}")
+            health = fetch_json(health_url, timeout=0.5)
+            if health is None:
+                time.sleep(0.005)
+        result["time_to_health_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["rss_at_health_bytes"] = health["memory"]["rss_bytes"]
+
+        # In fast-start mode wait for the background warm-up as well
+        if mode == "fast":
+            while not health.get("caches_warm"):
+                if time.monotonic() - started > timeout:
+                    raise TimeoutError(f"Caches not warm within {timeout}s")
+                time.sleep(0.05)
+                health = fetch_json(health_url) or health
+            result["time_to_warm_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+        # First dashboard request, which used to trigger the full hardware probe
+        request_started = time.monotonic()
+        fetch_json(f"http://127.0.0.1:{port}/api/system", timeout=timeout)
+        result["first_system_request_ms"] = round((time.monotonic() - request_started) * 1000, 1)
+
+        health = fetch_json(health_url) or health
+        result["rss_bytes"] = health["memory"]["rss_bytes"]
+        result["peak_rss_bytes"] = health["memory"]["peak_rss_bytes"]
+        result["startup"] = health["startup"]
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+# Reduce per-run results to median/min/max for each numeric metric
+def summarize(runs):
+    summary = {}
+    metrics = ["time_to_health_ms", "time_to_warm_ms", "first_system_request_ms",
+               "rss_at_health_bytes", "rss_bytes", "peak_rss_bytes"]
+    for metric in metrics:
+        values = [run[metric] for run in runs if run.get(metric) is not None]
+        if values:
+            summary[metric] = {
+                "median": round(statistics.median(values), 1),
+                "min": min(values),
+                "max": max(values)
+            }
+    return summary
+
+# Print the change in median values against a previous result
+def print_comparison(previous, current):
+    print(f"Comparison with {previous['label']} ({previous['mode']}):")
+    for metric, stats in current["summary"].items():
+        before = previous.get("summary", {}).get(metric, {}).get("median")
+        if not before:
+            continue
+        change = (stats["median"] - before) / before * 100
+        print(f"  {metric}: {before} -> {stats['median']} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PI-PVR API startup time and memory")
+    parser.add_argument("--runs", type=int, default=5, help="Number of server starts to measure")
+    parser.add_argument("--mode", choices=["fast", "normal"], default="fast", help="Server start mode")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for each start")
+    parser.add_argument("--label", default=None, help="Release label (default: git describe)")
+    parser.add_argument("--output", default=None, help="JSON history file to append results to")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare with the last result for the same mode in --output")
+    args = parser.parse_args()
+
+    runs = [run_once(args.mode, args.timeout) for _ in range(args.runs)]
+    result = {
+        "label": args.label or get_release_label(),
+        "mode": args.mode,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python_version": sys.version.split()[0],
+        "runs": runs,
+        "summary": summarize(runs)
+    }
+    print(json.dumps(result["summary"], indent=2))
+
+    if args.output:
+        history = []
+        if os.path.exists(args.output):
+            with open(args.output, "r") as f:
+                history = json.load(f)
+        if args.compare:
+            previous = [entry for entry in history if entry["mode"] == args.mode]
+            if previous:
+                print_comparison(previous[-1], result)
+        history.append(result)
+        with open(args.output, "w") as f:
+            json.dump(history, f, indent=2)
+
+if __name__ == "__main__":
+    main()
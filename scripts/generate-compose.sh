@@ -13,6 +13,10 @@ SERVICES=(
   "base"
 )
 
+# Compose profiles and extra override files (e.g. generated resource limits)
+PROFILES=()
+EXTRA_FILES=()
+
 # Variables for service selections
 MEDIA_SERVER=""
 TORRENT_CLIENT="transmission"
@@ -46,6 +50,7 @@ print_help() {
   echo "  --monitoring               Include Tautulli for Plex monitoring"
   echo "  --proxy                    Include Nginx Proxy Manager"
   echo "  --all                      Include all services"
+  echo "  --extra-file FILE          Merge an additional compose file last (can be repeated)"
   echo ""
   echo "Examples:"
   echo "  $0 -a -m jellyfin -t transmission -u nzbget"
@@ -104,6 +109,10 @@ while [[ $# -gt 0 ]]; do
       USE_PROXY="true"
       shift
       ;;
+    --extra-file)
+      EXTRA_FILES+=("$2")
+      shift 2
+      ;;
     --all)
       FULL_ARR_STACK="true"
       MEDIA_SERVER="all"
@@ -133,6 +142,9 @@ fi
 SERVICES+=("download")
 
 # Add media server based on selection
+if [[ -n "$MEDIA_SERVER" ]]; then
+  SERVICES+=("media")
+fi
 if [[ "$MEDIA_SERVER" == "jellyfin" || "$MEDIA_SERVER" == "all" ]]; then
   PROFILES+=("--profile jellyfin")
 fi
@@ -175,60 +187,17 @@ if [[ "$USE_PROXY" == "true" ]]; then
   PROFILES+=("--profile proxy")
 fi
 
-# Detect system and set hardware acceleration options
-echo "Detecting system for hardware acceleration..."
-if [[ -x "${SCRIPT_DIR}/detect-system.sh" ]]; then
-  SYSTEM_INFO=$(bash "${SCRIPT_DIR}/detect-system.sh")
-  
-  # Extract transcoding info
-  V4L2_AVAILABLE=$(echo "$SYSTEM_INFO" | grep -o '"v4l2_available": [^,]*' | cut -d' ' -f2)
-  VAAPI_AVAILABLE=$(echo "$SYSTEM_INFO" | grep -o '"vaapi_available": [^,]*' | cut -d' ' -f2)
-  NVDEC_AVAILABLE=$(echo "$SYSTEM_INFO" | grep -o '"nvdec_available": [^,]*' | cut -d' ' -f2)
-  RECOMMENDED_TRANSCODING=$(echo "$SYSTEM_INFO" | grep -o '"recommended_method": "[^"]*"' | cut -d'"' -f4)
-  
-  # Set hardware acceleration devices based on detected capabilities
-  if [[ "$V4L2_AVAILABLE" == "true" ]]; then
-    echo "Raspberry Pi hardware acceleration detected, using V4L2"
-    export HW_ACCEL_JELLYFIN="devices:
-      - /dev/video10:/dev/video10
-      - /dev/video11:/dev/video11
-      - /dev/video12:/dev/video12
-      - /dev/vchiq:/dev/vchiq"
-    export HW_ACCEL_PLEX="$HW_ACCEL_JELLYFIN"
-    export HW_ACCEL_EMBY="$HW_ACCEL_JELLYFIN"
-  elif [[ "$VAAPI_AVAILABLE" == "true" ]]; then
-    echo "Intel/AMD GPU hardware acceleration detected, using VAAPI"
-    export HW_ACCEL_JELLYFIN="devices:
-      - /dev/dri:/dev/dri"
-    export HW_ACCEL_PLEX="$HW_ACCEL_JELLYFIN"
-    export HW_ACCEL_EMBY="$HW_ACCEL_JELLYFIN"
-  elif [[ "$NVDEC_AVAILABLE" == "true" ]]; then
-    echo "NVIDIA GPU hardware acceleration detected, using NVDEC"
-    export HW_ACCEL_JELLYFIN="runtime: nvidia
-    devices:
-      - /dev/nvidia0:/dev/nvidia0
-      - /dev/nvidiactl:/dev/nvidiactl
-      - /dev/nvidia-modeset:/dev/nvidia-modeset"
-    export HW_ACCEL_PLEX="$HW_ACCEL_JELLYFIN"
-    export HW_ACCEL_EMBY="$HW_ACCEL_JELLYFIN"
-  else
-    echo "No hardware acceleration detected, using software transcoding"
-    export HW_ACCEL_JELLYFIN=""
-    export HW_ACCEL_PLEX=""
-    export HW_ACCEL_EMBY=""
-  fi
-else
-  echo "System detection script not found, using software transcoding"
-  export HW_ACCEL_JELLYFIN=""
-  export HW_ACCEL_PLEX=""
-  export HW_ACCEL_EMBY=""
-fi
+# Hardware acceleration devices, transcode tmpfs mounts and resource limits are
+# computed by the API from the detected hardware and passed in with --extra-file
 
 # Generate docker-compose file paths
 COMPOSE_FILES=""
 for SERVICE in "${SERVICES[@]}"; do
   COMPOSE_FILES+=" -f ${COMPOSE_DIR}/docker-compose.${SERVICE}.yml"
 done
+for EXTRA_FILE in "${EXTRA_FILES[@]}"; do
+  COMPOSE_FILES+=" -f ${EXTRA_FILE}"
+done
 
 # Create the command
 CMD="docker-compose ${COMPOSE_FILES} ${PROFILES[*]} config > ${OUTPUT_FILE}"
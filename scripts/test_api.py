@@ -1,9 +1,32 @@
 import scripts.api
 import os
+import sys
 import json
+import time
 import subprocess
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
 from unittest.mock import patch, MagicMock
 
+# Start a local stand-in HTTP server on a free port, answering with the given status
+def start_stub_server(status=200, body=b"ok"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_POST = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
 def test_import_api():
     assert True
 
@@ -43,6 +66,14 @@ def test_save_config():
     # Clean up the temporary file
     os.remove("test_config.json")
 
+def test_save_config_creates_config_dir():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_dir = os.path.join(temp_dir, "config")
+        with patch("scripts.api.CONFIG_DIR", config_dir), \
+             patch("scripts.api.CONFIG_FILE", os.path.join(config_dir, "config.json")):
+            scripts.api.save_config({"test": "value"})
+            assert scripts.api.load_config() == {"test": "value"}
+
 def test_load_services():
     # Create a temporary services file
     test_services = {"test": "value"}
@@ -168,3 +199,941 @@ def test_get_container_status():
         mock_run.side_effect = subprocess.CalledProcessError(1, "docker ps")
         container_status = scripts.api.get_container_status()
         assert container_status == {"error": {"status": "error", "message": "Command 'docker ps' returned non-zero exit status 1."}}
+
+def test_health_endpoint():
+    client = scripts.api.app.test_client()
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["status"] == "ok"
+    assert "imports_ms" in data["startup"]
+    assert "rss_bytes" in data["memory"]
+
+def test_get_cached_system_info():
+    # The hardware probe should only run once while the cache is fresh
+    with patch("scripts.api.get_system_info") as mock_get_system_info, \
+         patch.dict(scripts.api._system_info_cache, {"data": None, "timestamp": 0}):
+        mock_get_system_info.return_value = {"hostname": "pi", "memory_available": 0, "disk_free": 0}
+        first = scripts.api.get_cached_system_info()
+        second = scripts.api.get_cached_system_info()
+        assert mock_get_system_info.call_count == 1
+        assert first["hostname"] == second["hostname"] == "pi"
+        assert second["memory_available"] > 0
+
+def test_probe_services_health_and_backoff():
+    healthy = start_stub_server(200)
+    failing = start_stub_server(500)
+    containers = {
+        "vpn": {"status": "running", "url": None, "docker_health": "unhealthy"},
+        "sonarr": {"status": "running", "url": f"http://127.0.0.1:{healthy.server_port}"},
+        "transmission": {"status": "running", "url": f"http://127.0.0.1:{healthy.server_port}"},
+        "radarr": {"status": "running", "url": f"http://127.0.0.1:{failing.server_port}"},
+        "lidarr": {"status": "stopped", "url": None}
+    }
+    try:
+        with patch.dict(scripts.api._health_state, clear=True):
+            assert scripts.api.probe_services(containers) == 3
+            health = scripts.api.get_services_health(containers)
+            assert health["sonarr"]["status"] == "healthy"
+            assert health["sonarr"]["latency_ms"] is not None
+            assert health["radarr"]["status"] == "unhealthy"
+            assert health["radarr"]["consecutive_failures"] == 1
+            assert health["transmission"]["status"] == "degraded"
+            assert health["lidarr"]["status"] == "stopped"
+
+            # Nothing is due again until its interval or backoff expires
+            assert scripts.api.probe_services(containers) == 0
+            scripts.api.probe_services(containers, force=True)
+            first_wait = scripts.api._health_state["radarr"]["next_probe_at"]
+            assert scripts.api._health_state["radarr"]["consecutive_failures"] == 2
+            assert first_wait - time.time() > scripts.api.HEALTH_PROBE_INTERVAL
+            assert len(scripts.api.get_service_health("sonarr")["history"]) == 2
+    finally:
+        healthy.shutdown()
+        failing.shutdown()
+
+def test_build_resource_plan():
+    system_info = {"hardware": {"memory": {"total_gb": 2.0}, "cpu": {"cores": 4}}}
+    config = {"resource_limits": {"services": {"sonarr": {"memory_mb": 300}}}}
+    plan = scripts.api.build_resource_plan(config, scripts.api.DEFAULT_SERVICES, system_info)
+    limits = plan["services"]
+
+    # Only deployed services get limits, and the media server gets the largest share
+    assert "plex" not in limits
+    assert limits["jellyfin"]["memory_mb"] == max(l["memory_mb"] for l in limits.values())
+    assert limits["jellyfin"]["cpu_shares"] > limits["transmission"]["cpu_shares"]
+    assert limits["jellyfin"]["memory_mb"] + plan["reserved_mb"] <= 2048
+    assert all(l["memory_mb"] <= plan["pool_mb"] for n, l in limits.items() if n != "jellyfin")
+    assert all(0 < l["cpus"] <= 4 for l in limits.values())
+    assert limits["sonarr"]["memory_mb"] == 300
+
+def test_generate_docker_compose_writes_overrides():
+    with patch("subprocess.run") as mock_run, \
+         patch("scripts.api.get_cached_system_info") as mock_system_info, \
+         patch("scripts.api.COMPOSE_OVERRIDE_FILE", "test_overrides.yml"):
+        mock_system_info.return_value = {"hardware": {"memory": {"total_gb": 4.0}, "cpu": {"cores": 4}}}
+        result = scripts.api.generate_docker_compose({}, scripts.api.DEFAULT_SERVICES)
+        cmd = mock_run.call_args[0][0]
+        assert cmd[cmd.index("--extra-file") + 1] == "test_overrides.yml"
+        assert result["success"]
+
+        with open("test_overrides.yml", "r") as f:
+            content = f.read()
+        assert "  jellyfin:\n    mem_limit:" in content
+        assert "pids_limit:" in content
+
+    os.remove("test_overrides.yml")
+
+def test_build_media_server_plan():
+    system_info = {
+        "hardware": {"memory": {"total_gb": 4.0}, "cpu": {"cores": 4}},
+        "transcoding": {"recommended_method": "vaapi"}
+    }
+    with patch("os.path.exists") as mock_os_path_exists:
+        mock_os_path_exists.side_effect = lambda path: path == "/dev/dri"
+        overrides = scripts.api.build_compose_overrides({}, scripts.api.DEFAULT_SERVICES, system_info)
+
+    media = overrides["media_server"]
+    assert media["service"] == "jellyfin"
+    assert media["hardware_acceleration"]["method"] == "vaapi"
+    assert media["transcode_tmpfs"]["enabled"]
+    assert media["transcode_tmpfs"]["size_mb"] < overrides["resources"]["services"]["jellyfin"]["memory_mb"]
+
+    jellyfin = scripts.api.compose_overrides_to_services(overrides)["jellyfin"]
+    assert jellyfin["devices"] == ["/dev/dri:/dev/dri"]
+    assert jellyfin["volumes"][0]["type"] == "tmpfs"
+    assert jellyfin["volumes"][0]["tmpfs"]["size"] == media["transcode_tmpfs"]["size_mb"] * 1024 * 1024
+
+    # Small boards skip the tmpfs, and config.json can turn acceleration off
+    system_info["hardware"]["memory"]["total_gb"] = 1.0
+    config = {"transcode": {"hardware_acceleration": "none"}}
+    media = scripts.api.build_compose_overrides(config, scripts.api.DEFAULT_SERVICES, system_info)["media_server"]
+    assert not media["transcode_tmpfs"]["enabled"]
+    assert media["hardware_acceleration"]["method"] == "software"
+    assert media["hardware_acceleration"]["source"] == "config"
+
+def test_apply_download_tuning_keeps_user_changes():
+    services = {"download_clients": {"transmission": True, "qbittorrent": True, "nzbget": True, "sabnzbd": False}}
+    small_pi = {"hardware": {"memory": {"total_gb": 1.0}, "cpu": {"cores": 4}}}
+    big_pi = {"hardware": {"memory": {"total_gb": 8.0}, "cpu": {"cores": 4}}}
+
+    with tempfile.TemporaryDirectory() as docker_dir, \
+         patch("scripts.api.DOWNLOAD_TUNING_STATE_FILE", os.path.join(docker_dir, "state.json")), \
+         patch("scripts.api.get_cached_system_info") as mock_system_info:
+        config = {"docker_dir": docker_dir, "downloads_dir": docker_dir, "download_tuning": {"storage_type": "ssd"}}
+
+        # An existing qBittorrent config with one stock and one user-chosen value
+        qbittorrent_conf = os.path.join(docker_dir, "qbittorrent", "qBittorrent", "qBittorrent.conf")
+        os.makedirs(os.path.dirname(qbittorrent_conf))
+        with open(qbittorrent_conf, "w") as f:
+            f.write("[BitTorrent]\nSession\\MaxConnections=500\nSession\\MaxActiveDownloads=7\n\n[Preferences]\nWebUI\\Port=8080\n")
+
+        mock_system_info.return_value = small_pi
+        result = scripts.api.apply_download_tuning(config, services, restart=False)
+        assert result["clients"]["transmission"]["status"] == "applied"
+        assert result["clients"]["nzbget"]["status"] == "pending"
+        assert result["clients"]["qbittorrent"]["kept_user_values"] == {"BitTorrent/Session\\MaxActiveDownloads": "7"}
+
+        with open(qbittorrent_conf, "r") as f:
+            conf = f.read()
+        assert "Session\\MaxConnections=102\n" in conf
+        assert "Session\\MaxActiveDownloads=7\n" in conf
+        assert "WebUI\\Port=8080\n" in conf
+
+        # The user edits one tuned value, then the profile changes on bigger hardware
+        settings_file = os.path.join(docker_dir, "transmission", "settings.json")
+        with open(settings_file, "r") as f:
+            settings = json.load(f)
+        assert settings["download-dir"] == "/downloads/complete"
+        settings["peer-limit-global"] = 999
+        with open(settings_file, "w") as f:
+            json.dump(settings, f)
+
+        mock_system_info.return_value = big_pi
+        result = scripts.api.apply_download_tuning(config, services, clients=["transmission"], restart=False)
+        with open(settings_file, "r") as f:
+            settings = json.load(f)
+        assert settings["peer-limit-global"] == 999
+        assert settings["cache-size-mb"] == 64
+        assert "peer-limit-global" in result["clients"]["transmission"]["kept_user_values"]
+
+def test_fleet_status_reports_partial_results():
+    from werkzeug.serving import make_server
+
+    # Two peer nodes running this API, plus one node that is down
+    servers = [make_server("127.0.0.1", 0, scripts.api.app, threaded=True) for _ in range(2)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    nodes = [{"name": f"pi{i}", "url": f"http://127.0.0.1:{server.server_port}", "enabled": True, "timeout": 2}
+             for i, server in enumerate(servers)]
+    nodes.append({"name": "down", "url": "http://127.0.0.1:1", "enabled": True, "timeout": 1})
+    nodes.append({"name": "disabled", "url": "http://127.0.0.1:1", "enabled": False})
+
+    try:
+        with patch("scripts.api.load_fleet") as mock_load_fleet, \
+             patch("scripts.api.load_config") as mock_load_config, \
+             patch("scripts.api.get_container_status") as mock_status:
+            # Peers serve their own /api/status from the same patched functions
+            mock_load_fleet.return_value = {"nodes": nodes}
+            mock_load_config.return_value = {"installation_status": "completed"}
+            mock_status.return_value = {"sonarr": {"status": "running", "uptime": "Up 1 hour"}}
+
+            client = scripts.api.app.test_client()
+            data = client.get("/api/fleet/status").get_json()
+
+        assert [r["node"] for r in data["nodes"]] == ["local", "pi0", "pi1", "down"]
+        assert data["summary"]["ok"] == 3
+        assert data["summary"]["failed"] == ["down"]
+        assert "error" in data["nodes"][-1]
+        assert len(data["containers"]) == 3
+        assert {c["node"] for c in data["containers"]} == {"local", "pi0", "pi1"}
+        assert data["summary"]["running"] == 3
+    finally:
+        for server in servers:
+            server.shutdown()
+
+def test_fleet_container_action_reports_peer_errors():
+    # The peer's /api/restart answers 200 with an error body when docker fails
+    failing = start_stub_server(200, json.dumps({"status": "error", "message": "No such container: sonarr"}).encode())
+    working = start_stub_server(200, json.dumps({"status": "success"}).encode())
+    nodes = [{"name": "pi0", "url": f"http://127.0.0.1:{failing.server_port}", "enabled": True},
+             {"name": "pi1", "url": f"http://127.0.0.1:{working.server_port}", "enabled": True}]
+    try:
+        with patch("scripts.api.load_fleet", return_value={"nodes": nodes}):
+            data = scripts.api.app.test_client().post(
+                "/api/fleet/containers/restart/sonarr", json={"nodes": ["pi0", "pi1"]}).get_json()
+    finally:
+        failing.shutdown()
+        working.shutdown()
+    assert data["summary"]["ok"] == 1
+    assert data["summary"]["failed"] == ["pi0"]
+    assert data["nodes"][0]["error"] == "No such container: sonarr"
+
+def test_container_log_streams_are_shared_and_bounded():
+    import sys
+
+    # Stand-in for `docker logs`: a short backlog, or a chatty follower that keeps running
+    def fake_logs_command(name, tail=None, since=None, follow=False):
+        if follow:
+            script = ("import sys, time\n"
+                      "time.sleep(0.5)\n"
+                      "for i in range(50): print(f'2024-01-01T00:00:{i:02d}.000000000Z live {i}')\n"
+                      "sys.stdout.flush(); time.sleep(30)")
+        else:
+            script = "print('2024-01-01T00:00:00.000000000Z old 0'); print('2024-01-01T00:00:01.000000000Z old 1')"
+        return [sys.executable, "-c", script]
+
+    with patch("scripts.api.build_docker_logs_command", side_effect=fake_logs_command), \
+         patch("scripts.api.LOG_STREAM_BUFFER_LINES", 5):
+        viewers = [scripts.api.stream_container_logs("sonarr", tail=2, follow=True) for _ in range(2)]
+        assert next(viewers[0]) == "2024-01-01T00:00:00.000000000Z old 0\n"
+        next(viewers[1])
+
+        # Both viewers share one upstream reader
+        stream = scripts.api._log_streams["sonarr"]
+        assert len(stream["subscribers"]) == 2
+        process = stream["process"]
+
+        # Neither viewer is reading, so each buffer stays at its cap and the oldest lines are dropped
+        deadline = time.monotonic() + 10
+        while any(s["dropped"] < 45 for s in stream["subscribers"]) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert all(s["queue"].qsize() == 5 for s in stream["subscribers"])
+
+        assert next(viewers[0]) == "2024-01-01T00:00:01.000000000Z old 1\n"
+        assert next(viewers[0]) == "[45 lines dropped]\n"
+        assert next(viewers[0]) == "2024-01-01T00:00:45.000000000Z live 45\n"
+
+        # The upstream reader stops once the last viewer disconnects
+        viewers[0].close()
+        assert "sonarr" in scripts.api._log_streams
+        viewers[1].close()
+        assert "sonarr" not in scripts.api._log_streams
+        assert process.wait(timeout=5) is not None
+
+def test_container_log_text_stream_sends_keepalives():
+    import sys
+
+    # A quiet container: no backlog, and the follower never prints
+    def fake_logs_command(name, tail=None, since=None, follow=False):
+        return [sys.executable, "-c", "import time; time.sleep(30)" if follow else "pass"]
+
+    with patch("scripts.api.build_docker_logs_command", side_effect=fake_logs_command), \
+         patch("scripts.api.LOG_KEEPALIVE_SECONDS", 0.1):
+        viewer = scripts.api.stream_container_logs("radarr", tail=10, follow=True)
+        assert next(viewer) == "\n"
+        process = scripts.api._log_streams["radarr"]["process"]
+
+        # The keepalive write is where a server notices a disconnected viewer and closes the stream
+        viewer.close()
+        assert "radarr" not in scripts.api._log_streams
+        assert process.wait(timeout=5) is not None
+
+def test_install_profile_eta_and_report():
+    system_info = {"architecture": "aarch64", "hardware": {"cpu": {"cores": 4}, "memory": {"total_gb": 3.8}}}
+    history = {"runs": [
+        {"hardware": "aarch64 / 4 cores / 4 GB", "status": "completed", "phases": [
+            {"name": "generate_compose", "status": "ok", "seconds": 2.0, "attempts": []},
+            {"name": "image_pull", "status": "ok", "seconds": 300.0, "attempts": []},
+            {"name": "compose_up", "status": "ok", "seconds": 40.0, "attempts": []}
+        ]},
+        # Slower board; only used for phases this hardware has never timed
+        {"hardware": "armv7l / 4 cores / 1 GB", "status": "completed", "phases": [
+            {"name": "image_pull", "status": "ok", "seconds": 900.0, "attempts": []},
+            {"name": "env_file", "status": "ok", "seconds": 1.0, "attempts": []}
+        ]}
+    ]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        timings_file = os.path.join(temp_dir, "install-timings.json")
+        with open(timings_file, "w") as f:
+            json.dump(history, f)
+
+        with patch("scripts.api.INSTALL_TIMINGS_FILE", timings_file):
+            scripts.api.start_install_profile(
+                ["generate_compose", "env_file", "download_tuning", "image_pull", "compose_up"], system_info)
+            with scripts.api.install_phase("generate_compose"):
+                pass
+            with scripts.api.install_phase("env_file"):
+                progress = scripts.api.get_install_progress()
+            assert progress["current_phase"]["name"] == "env_file"
+            assert progress["remaining_phases"] == ["download_tuning", "image_pull", "compose_up"]
+            assert 340.0 <= progress["eta_seconds"] <= 341.0
+            assert progress["eta_phases_without_history"] == ["download_tuning"]
+
+            # A retried phase records every attempt, including the failed one
+            with scripts.api.install_phase("image_pull") as phase:
+                for attempt in range(2):
+                    try:
+                        with scripts.api.install_attempt(phase):
+                            if attempt == 0:
+                                raise subprocess.CalledProcessError(1, "docker")
+                    except subprocess.CalledProcessError:
+                        continue
+            assert [a["status"] for a in phase["attempts"]] == ["failed", "ok"]
+
+            report = scripts.api.finish_install_profile("completed")
+            assert report["slowest"][0]["name"] in ("generate_compose", "env_file", "image_pull")
+            assert report["retried"] == ["image_pull"]
+            assert "Slowest phases" in scripts.api.format_install_report(report)
+            assert scripts.api.get_install_progress()["status"] == "completed"
+
+            # The finished run is kept for the next ETA
+            with open(timings_file, "r") as f:
+                runs = json.load(f)["runs"]
+            assert len(runs) == 3
+            assert runs[-1]["hardware"] == "aarch64 / 4 cores / 4 GB"
+            assert [p["name"] for p in runs[-1]["phases"]] == ["generate_compose", "env_file", "image_pull"]
+
+def start_stub_registry(manifests):
+    """Minimal registry: bearer-token auth, manifest HEAD with ETag and If-None-Match"""
+    requests_seen = []
+
+    class RegistryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(("GET", self.path))
+            body = json.dumps({"token": "t0ken", "expires_in": 300}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_HEAD(self):
+            requests_seen.append(("HEAD", self.path))
+            if self.headers.get("Authorization") != "Bearer t0ken":
+                self.send_response(401)
+                realm = f"http://127.0.0.1:{self.server.server_port}/token"
+                self.send_header("WWW-Authenticate", f'Bearer realm="{realm}",service="stub",scope="repository:pi:pull"')
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            digest = manifests.get(self.path)
+            if digest is None:
+                self.send_response(404)
+            elif self.headers.get("If-None-Match") == f'"{digest}"':
+                self.send_response(304)
+            else:
+                self.send_response(200)
+                self.send_header("Docker-Content-Digest", digest)
+                self.send_header("ETag", f'"{digest}"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), RegistryHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests_seen
+
+def test_check_image_updates_against_stub_registry():
+    manifests = {"/v2/pi/sonarr/manifests/latest": "sha256:new", "/v2/pi/radarr/manifests/latest": "sha256:same"}
+    server, requests_seen = start_stub_registry(manifests)
+    registry = f"127.0.0.1:{server.server_port}"
+    images = {
+        "sonarr": f"{registry}/pi/sonarr:latest",
+        "radarr": f"{registry}/pi/radarr",
+        "lidarr": f"{registry}/pi/lidarr:latest",
+        "pinned": f"{registry}/pi/bazarr@sha256:abc"
+    }
+    local = {images["sonarr"]: ["sha256:old"], images["radarr"]: ["sha256:same"]}
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir, \
+             patch("scripts.api.IMAGE_UPDATES_FILE", os.path.join(temp_dir, "image-updates.json")), \
+             patch("scripts.api.get_local_image_digests", side_effect=lambda names: {n: local.get(n, []) for n in names}):
+            result = scripts.api.check_image_updates(images)
+            assert result["services"]["sonarr"]["status"] == "update_available"
+            assert result["services"]["radarr"]["status"] == "up_to_date"
+            assert result["services"]["lidarr"]["status"] == "error"
+            assert result["services"]["pinned"]["status"] == "pinned"
+            assert result["summary"]["updates_available"] == ["sonarr"]
+            # One token fetch serves every request with the same scope
+            assert sum(1 for method, _ in requests_seen if method == "GET") == 1
+
+            # Within the TTL nothing is sent to the registry
+            requests_seen.clear()
+            result = scripts.api.check_image_updates(images)
+            assert result["summary"]["images_cached"] == 3
+            assert requests_seen == [("HEAD", "/v2/pi/lidarr/manifests/latest"), ("HEAD", "/v2/pi/lidarr/manifests/latest")]
+
+            # A forced refresh revalidates with If-None-Match and gets 304 for unchanged tags
+            manifests["/v2/pi/radarr/manifests/latest"] = "sha256:newer"
+            result = scripts.api.check_image_updates(images, force=True)
+            assert result["services"]["sonarr"]["cached"] is True
+            assert result["services"]["radarr"]["cached"] is False
+            assert result["services"]["radarr"]["status"] == "update_available"
+    finally:
+        server.shutdown()
+
+def test_incremental_backup_and_restore():
+    def write(path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def read_tree(root):
+        tree = {}
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                with open(os.path.join(dirpath, name), "r") as f:
+                    tree[os.path.relpath(os.path.join(dirpath, name), root)] = f.read()
+        return tree
+
+    with tempfile.TemporaryDirectory() as docker_dir, tempfile.TemporaryDirectory() as destination:
+        config = {"docker_dir": docker_dir, "backup": {"destination": destination, "allow_same_disk": True}}
+        service_dir = os.path.join(docker_dir, "sonarr")
+        write(os.path.join(service_dir, "sonarr.db"), "x" * 10000)
+        write(os.path.join(service_dir, "config.xml"), "<Config/>")
+        write(os.path.join(service_dir, "logs", "old.txt"), "old log")
+        os.makedirs(os.path.join(service_dir, "Backups"))
+
+        full = scripts.api.run_backup(config, "sonarr")
+        assert full["type"] == "full"
+        assert full["archived_files"] == 3
+        assert full["compressed_bytes"] < full["source_bytes"]
+
+        # Change one file, touch another without changing it, delete one, add one
+        write(os.path.join(service_dir, "sonarr.db"), "y" * 10000)
+        os.utime(os.path.join(service_dir, "config.xml"), (time.time() + 10, time.time() + 10))
+        os.remove(os.path.join(service_dir, "logs", "old.txt"))
+        write(os.path.join(service_dir, "logs", "new.txt"), "new log")
+        time.sleep(1)  # archive names have one-second resolution
+
+        incremental = scripts.api.run_backup(config, "sonarr")
+        assert incremental["type"] == "incremental"
+        assert incremental["archived_files"] == 2
+        assert incremental["unchanged_files"] == 1
+        assert incremental["deleted_files"] == 1
+        assert incremental["saved_vs_full_percent"] > 0
+        expected = read_tree(service_dir)
+
+        # Restore the chain over a damaged directory
+        write(os.path.join(service_dir, "sonarr.db"), "corrupt")
+        result = scripts.api.restore_backup(config, "sonarr", quiesce=False)
+        assert result["chain"] == [full["archive"], incremental["archive"]]
+        assert read_tree(service_dir) == expected
+        assert os.path.isdir(os.path.join(service_dir, "Backups"))
+
+        # The first backup alone restores the original files
+        scripts.api.restore_backup(config, "sonarr", full["archive"], quiesce=False)
+        assert read_tree(service_dir)["logs/old.txt"] == "old log"
+        assert not os.path.exists(os.path.join(docker_dir, ".sonarr.restore"))
+
+        # Streamed download is a complete archive
+        import io
+        import tarfile
+        data = b"".join(scripts.api.stream_backup(config, "sonarr"))
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+            assert "sonarr.db" in tar.getnames()
+
+def test_backup_and_restore_with_hardlinks():
+    with tempfile.TemporaryDirectory() as docker_dir, tempfile.TemporaryDirectory() as destination:
+        config = {"docker_dir": docker_dir, "backup": {"destination": destination, "allow_same_disk": True}}
+        service_dir = os.path.join(docker_dir, "radarr")
+        os.makedirs(os.path.join(service_dir, "d"))
+        for name, content in [("a", "first"), ("c", "third"), (os.path.join("d", "e"), "nested")]:
+            with open(os.path.join(service_dir, name), "w") as f:
+                f.write(content)
+        os.link(os.path.join(service_dir, "a"), os.path.join(service_dir, "b"))
+
+        backup = scripts.api.run_backup(config, "radarr")
+        assert backup["archived_files"] == 4
+        # Deleting a file after the hardlink must still be replayed on restore
+        os.remove(os.path.join(service_dir, "c"))
+        time.sleep(1)  # archive names have one-second resolution
+        scripts.api.run_backup(config, "radarr")
+
+        import shutil
+        shutil.rmtree(service_dir)
+        os.makedirs(service_dir)
+        scripts.api.restore_backup(config, "radarr", quiesce=False)
+        restored = {}
+        for dirpath, _, names in os.walk(service_dir):
+            for name in names:
+                with open(os.path.join(dirpath, name)) as f:
+                    restored[os.path.relpath(os.path.join(dirpath, name), service_dir)] = f.read()
+        assert restored == {"a": "first", "b": "first", os.path.join("d", "e"): "nested"}
+
+def test_media_scan_index_and_incremental_rescan():
+    def write(path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        media_dir = os.path.join(temp_dir, "media")
+        downloads_dir = os.path.join(temp_dir, "downloads")
+        config = {"media_dir": media_dir, "downloads_dir": downloads_dir}
+        write(os.path.join(media_dir, "tv", "Show A", "Season 1", "e1.mkv"), 3000)
+        write(os.path.join(media_dir, "tv", "Show A", "Season 1", "e2.mkv"), 3000)
+        write(os.path.join(media_dir, "tv", "Show B", "e1.mkv"), 1000)
+        write(os.path.join(media_dir, "movies", "Film (2020)", "film.mkv"), 5000)
+        write(os.path.join(media_dir, "photos", "p.jpg"), 200)
+        write(os.path.join(downloads_dir, "incomplete", "part.bin"), 700)
+
+        with patch("scripts.api.MEDIA_INDEX_FILE", os.path.join(temp_dir, "media-index.db")), \
+             patch("scripts.api.MEDIA_LARGE_FILE_BYTES", 2000):
+            results = scripts.api.run_media_scan(config)
+            assert [r["rescanned"] for r in results] == [r["directories"] for r in results]
+
+            usage = scripts.api.get_media_usage(config)["categories"]
+            assert usage["tv"]["size"] == 7000
+            assert usage["tv"]["files"] == 3
+            assert usage["movies"]["size"] == 5000
+            assert usage["music"] is None
+            assert usage["other"]["size"] == 200
+            assert usage["downloads"]["size"] == 700
+
+            largest = scripts.api.get_largest_media_items(config, "tv")
+            assert [os.path.basename(item["path"]) for item in largest] == ["Show A", "Show B"]
+            files = scripts.api.get_largest_media_items(config, kind="files", limit=2)
+            assert [os.path.basename(item["path"]) for item in files] == ["film.mkv", "e1.mkv"]
+
+            # Only directories whose entries changed are listed again
+            write(os.path.join(media_dir, "tv", "Show B", "e2.mkv"), 1000)
+            import shutil
+            shutil.rmtree(os.path.join(media_dir, "movies", "Film (2020)"))
+            media_result = scripts.api.run_media_scan(config)[0]
+            assert media_result["rescanned"] == 2
+            assert media_result["removed"] == 1
+
+            usage = scripts.api.get_media_usage(config)["categories"]
+            assert usage["tv"]["size"] == 8000
+            assert usage["movies"]["size"] == 0
+            files = scripts.api.get_largest_media_items(config, kind="files")
+            assert "film.mkv" not in [os.path.basename(item["path"]) for item in files]
+
+def test_dedupe_analysis_and_hardlink():
+    def write(path, content, age_days=0):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        if age_days:
+            old = time.time() - age_days * 86400
+            os.utime(path, (old, old))
+
+    episode = os.urandom(3000)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        media_dir = os.path.join(temp_dir, "media")
+        downloads_dir = os.path.join(temp_dir, "downloads")
+        config = {"media_dir": media_dir, "downloads_dir": downloads_dir, "dedupe": {"min_bytes": 1000, "max_read_mb_s": 0}}
+        write(os.path.join(media_dir, "tv", "Show", "e1.mkv"), episode)
+        write(os.path.join(downloads_dir, "complete", "Show.e1.mkv"), episode)
+        # Same size and same first/last blocks, different middle: only the full hash tells them apart
+        write(os.path.join(downloads_dir, "complete", "lookalike.mkv"), episode[:1000] + os.urandom(1000) + episode[2000:], age_days=30)
+        # Already a hardlink of the library copy
+        os.link(os.path.join(media_dir, "tv", "Show", "e1.mkv"), os.path.join(downloads_dir, "linked.mkv"))
+        write(os.path.join(downloads_dir, "complete", "small.nfo"), b"x" * 10)
+
+        with patch("scripts.api.MEDIA_INDEX_FILE", os.path.join(temp_dir, "media-index.db")), \
+             patch("scripts.api.DEDUPE_REPORT_FILE", os.path.join(temp_dir, "dedupe-report.json")), \
+             patch("scripts.api.DEDUPE_PARTIAL_BYTES", 500):
+            report = scripts.api.run_dedupe_analysis(config)
+            assert report["files_scanned"] == 4
+            assert report["duplicate_groups"] == 1
+            group = report["groups"][0]
+            assert group["copies"][0]["roots"] == ["downloads", "media"]
+            assert group["reclaimable_bytes"] == 3000
+            assert report["already_linked"] == {"files": 2, "bytes_saved": 3000}
+            assert [os.path.basename(o["path"]) for o in report["orphans"]] == ["lookalike.mkv"]
+
+            # A second run reuses the stored hashes
+            report = scripts.api.run_dedupe_analysis(config)
+            assert report["bytes_hashed"] == 0
+
+            dry = scripts.api.hardlink_duplicates(dry_run=True)
+            assert dry["reclaimed_bytes"] == 3000
+            assert os.stat(os.path.join(downloads_dir, "complete", "Show.e1.mkv")).st_nlink == 1
+
+            # A failed link is reported per file and leaves nothing behind
+            copy_path = os.path.join(downloads_dir, "complete", "Show.e1.mkv")
+            with patch("scripts.api.os.link", side_effect=PermissionError(1, "Operation not permitted")):
+                result = scripts.api.hardlink_duplicates([group["id"]])
+            assert result["linked"] == []
+            assert result["skipped"] == [{"path": copy_path, "reason": "[Errno 1] Operation not permitted"}]
+            assert not os.path.exists(copy_path + scripts.api.DEDUPE_LINK_SUFFIX)
+
+            # A temp link left by an interrupted run does not block the next one
+            write(copy_path + scripts.api.DEDUPE_LINK_SUFFIX, b"stale")
+            result = scripts.api.hardlink_duplicates([group["id"]])
+            assert not os.path.exists(copy_path + scripts.api.DEDUPE_LINK_SUFFIX)
+            assert result["reclaimed_bytes"] == 3000
+            assert os.stat(os.path.join(downloads_dir, "complete", "Show.e1.mkv")).st_ino == \
+                os.stat(os.path.join(media_dir, "tv", "Show", "e1.mkv")).st_ino
+
+            # Replacing again is refused because the copy is no longer the file that was hashed
+            result = scripts.api.hardlink_duplicates()
+            assert result["linked"] == []
+
+def test_scheduler_decisions():
+    settings = scripts.api.get_scheduler_settings({"scheduler": {"windows": {"backup": ["23:00-06:00"]}}})
+    decide = scripts.api.get_scheduler_decision
+    cool = {"temperature_c": 55.0, "load_per_core": 0.3, "iowait_percent": 2.0, "active_streams": 0}
+
+    assert decide("scan", settings, cool)["action"] == "run"
+    assert decide("scan", settings, dict(cool, temperature_c=72.0))["action"] == "throttle"
+    assert decide("scan", settings, dict(cool, active_streams=2))["reasons"] == ["2 active streams"]
+    assert decide("scan", settings, dict(cool, iowait_percent=60.0))["action"] == "pause"
+    # Paused on I/O wait: stays paused until it drops below the throttle level
+    assert decide("scan", settings, dict(cool, iowait_percent=30.0))["action"] == "pause"
+    assert decide("scan", settings, dict(cool, iowait_percent=10.0))["action"] == "run"
+    assert decide("scan", dict(settings, enabled=False), dict(cool, temperature_c=90.0))["action"] == "run"
+
+    night = time.struct_time((2024, 1, 1, 2, 30, 0, 0, 1, 0))
+    day = time.struct_time((2024, 1, 1, 14, 0, 0, 0, 1, 0))
+    assert scripts.api.in_time_window(["23:00-06:00"], night)
+    assert not scripts.api.in_time_window(["23:00-06:00"], day)
+    assert scripts.api.in_time_window([], day)
+
+def test_scheduler_pauses_and_resumes_jobs():
+    conditions = {"temperature_c": 85.0, "load_per_core": 0.1, "iowait_percent": 0.0, "active_streams": None}
+    progress = []
+
+    def job_body():
+        for step in range(3):
+            scripts.api.scheduler_checkpoint()
+            progress.append(step)
+        return "finished"
+
+    with patch("scripts.api.load_config", return_value={"scheduler": {}}), \
+         patch("scripts.api.load_services", return_value=scripts.api.DEFAULT_SERVICES), \
+         patch("scripts.api.get_scheduler_conditions", side_effect=lambda *args: conditions), \
+         patch("scripts.api.SCHEDULER_SAMPLE_SECONDS", 0.05):
+        job = scripts.api.submit_job("test-job", "scan", job_body)
+        # Submitting the same job again returns the queued one
+        assert scripts.api.submit_job("test-job", "scan", job_body) is job
+
+        deadline = time.monotonic() + 5
+        while job["state"] != "paused" and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert job["state"] == "paused"
+        assert progress == []
+        assert job["reasons"] == ["temperature 85.0 >= 80"]
+
+        # Threads that are not working for the job, like a streamed download, are not held up
+        other = threading.Thread(target=scripts.api.scheduler_checkpoint)
+        other.start()
+        other.join(1)
+        assert not other.is_alive()
+        # Reading the scheduler state does not touch the pause hysteresis
+        paused_on = set(scripts.api._scheduler_state["paused_on"])
+        conditions["temperature_c"] = 75.0
+        response = scripts.api.app.test_client().get('/api/scheduler')
+        assert response.json["decision"]["action"] == "pause"
+        assert scripts.api._scheduler_state["paused_on"] == paused_on
+        
+        conditions["temperature_c"] = 50.0
+        while job["state"] != "done" and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert job["result"] == "finished"
+        assert progress == [0, 1, 2]
+        assert job["paused_seconds"] > 0
+        assert "call" not in scripts.api.describe_job(job)
+
+def start_throughput_server(size):
+    """Stand-in speed test target: serves `size` bytes, or one byte for a range request"""
+    payload = os.urandom(size)
+
+    class ThroughputHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = payload[:1] if self.headers.get("Range") else payload
+            self.send_response(206 if self.headers.get("Range") else 200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThroughputHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_vpn_benchmark_against_stub_server():
+    server = start_throughput_server(2 * 1024 * 1024)
+    url = f"http://127.0.0.1:{server.server_port}/download"
+    config = {"vpn": {"region": "Netherlands"}, "vpn_benchmark": {"target_url": url, "latency_samples": 3, "timeout": 10}}
+
+    # Run the tunnel script with the local curl instead of inside a container on the VPN's network
+    def local_tunnel_command(url, samples, timeout, settings):
+        return ["sh", "-c", scripts.api.VPN_TUNNEL_SCRIPT, "sh", url, str(samples), str(timeout)]
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir, \
+             patch("scripts.api.VPN_BENCHMARK_FILE", os.path.join(temp_dir, "vpn-benchmark.json")), \
+             patch("scripts.api.build_tunnel_command", side_effect=local_tunnel_command):
+            run = scripts.api.run_vpn_benchmark(config)
+            assert run["host"]["bytes"] == 2 * 1024 * 1024
+            assert run["host"]["throughput_mbps"] > 0
+            assert run["host"]["latency_ms"] is not None
+            tunnel = run["regions"]["Netherlands"]
+            assert tunnel["bytes"] == 2 * 1024 * 1024
+            assert tunnel["throughput_mbps"] > 0
+            assert "tunnel_vs_host" in run
+            assert run["recommendation"]["region"] == "Netherlands"
+            assert len(scripts.api.load_vpn_benchmarks()["runs"]) == 1
+    finally:
+        server.shutdown()
+
+def test_recommend_vpn_region():
+    history = {"runs": [
+        {"regions": {"Netherlands": {"throughput_mbps": 80.0, "latency_ms": 40.0},
+                     "Switzerland": {"throughput_mbps": 85.0, "latency_ms": 60.0},
+                     "US East": {"throughput_mbps": 20.0, "latency_ms": 110.0},
+                     "Broken": {"error": "VPN did not become healthy"}}},
+        {"regions": {"Netherlands": {"throughput_mbps": 84.0, "latency_ms": 42.0}}}
+    ]}
+    recommendation = scripts.api.recommend_vpn_region(history)
+    # Switzerland is marginally faster but Netherlands is within 10% and much closer
+    assert recommendation["region"] == "Netherlands"
+    assert recommendation["regions"]["Netherlands"] == {"throughput_mbps": 82.0, "latency_ms": 41.0, "samples": 2}
+    assert "Broken" not in recommendation["regions"]
+    assert scripts.api.recommend_vpn_region({"runs": []}) is None
+
+def test_debug_profile_requires_token_and_samples_threads():
+    client = scripts.api.app.test_client()
+    stop = threading.Event()
+    worker = threading.Thread(target=stop.wait, name="profiled-worker", daemon=True)
+    worker.start()
+    try:
+        with patch.dict(os.environ, {"PIPVR_DEBUG_TOKEN": "s3cret"}):
+            assert client.get('/api/debug/profile').status_code == 404
+            assert client.get('/api/debug/profile', headers={"X-Debug-Token": "wrong"}).status_code == 404
+            for query in ("seconds=nan", "seconds=-1", "interval_ms=nan", "interval_ms=0", "seconds=x"):
+                assert client.get(f'/api/debug/profile?{query}', headers={"X-Debug-Token": "s3cret"}).status_code == 400
+            # An infinite interval is clamped rather than passed to time.sleep
+            assert client.get('/api/debug/profile?seconds=0.05&interval_ms=inf',
+                              headers={"X-Debug-Token": "s3cret"}).status_code == 200
+            response = client.get('/api/debug/profile?seconds=0.3&interval_ms=5',
+                                  headers={"X-Debug-Token": "s3cret"})
+    finally:
+        stop.set()
+    assert response.status_code == 200
+    lines = response.data.decode().splitlines()
+    worker_lines = [line for line in lines if line.startswith("profiled-worker;")]
+    assert len(worker_lines) == 1
+    stack, count = worker_lines[0].rsplit(" ", 1)
+    assert stack.split(";")[-1].startswith("wait (threading.py")
+    assert int(count) == int(response.headers["X-Profile-Samples"])
+
+def test_request_trace_times_subprocess_and_json():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_file = os.path.join(tmpdir, "config.json")
+        with open(config_file, "w") as f:
+            json.dump({"installation_status": "completed"}, f)
+        headers = {"X-Debug-Token": "s3cret", "X-Trace": "1"}
+        with patch("scripts.api.CONFIG_FILE", config_file), \
+             patch.dict(os.environ, {"PIPVR_DEBUG_TOKEN": "s3cret"}), \
+             scripts.api.app.test_request_context('/api/config', headers=headers):
+            scripts.api.app.preprocess_request()
+            subprocess.run(["true"])
+            scripts.api.save_config(scripts.api.load_config())
+            response = scripts.api.app.process_response(scripts.api.jsonify({"ok": True}))
+        trace = scripts.api._trace_history[-1]
+    assert trace["path"] == "/api/config"
+    assert trace["categories"]["subprocess"]["calls"] == 1
+    assert trace["commands"][0]["command"] == "true"
+    assert trace["categories"]["json_load"]["calls"] == 1
+    assert trace["categories"]["json_save"]["calls"] == 1
+    assert trace["categories"]["serialization"]["calls"] == 1
+    assert "subprocess;dur=" in response.headers["Server-Timing"]
+    assert response.headers["X-Trace-Id"] == trace["id"]
+    assert sys.getprofile() is None
+
+FAKE_DOCKER = """#!{python}
+import io, json, os, sys, tarfile
+state = os.environ["FAKE_DOCKER_DIR"]
+def path(tag):
+    return os.path.join(state, tag.replace("/", "_").replace(":", "+") + ".tar")
+args = sys.argv[1:]
+if args[:2] == ["image", "inspect"]:
+    found = []
+    for tag in args[2:]:
+        if os.path.exists(path(tag)):
+            found.append({{"Id": "sha256:" + str(os.path.getsize(path(tag))), "RepoTags": [tag], "Architecture": "arm64"}})
+    print(json.dumps(found))
+    sys.exit(0 if len(found) == len(args) - 2 else 1)
+elif args[0] == "save":
+    with open(path(args[1]), "rb") as f:
+        sys.stdout.buffer.write(f.read())
+elif args[0] == "load":
+    data = sys.stdin.buffer.read()
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        tag = json.load(tar.extractfile("manifest.json"))[0]["RepoTags"][0]
+    with open(path(tag), "wb") as f:
+        f.write(data)
+    print("Loaded image: " + tag)
+elif args[0] == "version":
+    print("arm64")
+"""
+
+# Build a `docker save`-style archive with one layer per entry in layers
+def build_image_archive(tag, layers):
+    import io
+    import tarfile
+
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w") as tar:
+        names = []
+        for index, layer in enumerate(layers):
+            info = tarfile.TarInfo(f"layer{index}-{len(layer)}")
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+            info = tarfile.TarInfo(f"layer{index}-{len(layer)}/layer.tar")
+            info.size = len(layer)
+            tar.addfile(info, io.BytesIO(layer))
+            names.append(info.name)
+        manifest = json.dumps([{"RepoTags": [tag], "Layers": names}]).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+    return out.getvalue()
+
+def test_image_bundle_export_and_import():
+    import tarfile
+
+    base = os.urandom(256 * 1024)
+    archives = {
+        "lscr.io/linuxserver/sonarr:latest": build_image_archive("lscr.io/linuxserver/sonarr:latest", [base, b"sonarr" * 1000]),
+        "lscr.io/linuxserver/radarr:latest": build_image_archive("lscr.io/linuxserver/radarr:latest", [base, b"radarr" * 2000])
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        state = os.path.join(tmpdir, "docker")
+        bin_dir = os.path.join(tmpdir, "bin")
+        os.makedirs(state)
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, "docker"), "w") as f:
+            f.write(FAKE_DOCKER.format(python=sys.executable))
+        os.chmod(os.path.join(bin_dir, "docker"), 0o755)
+        for tag, data in archives.items():
+            with open(os.path.join(state, tag.replace("/", "_").replace(":", "+") + ".tar"), "wb") as f:
+                f.write(data)
+        compose_file = os.path.join(tmpdir, "docker-compose.yml")
+        with open(compose_file, "w") as f:
+            f.write("services:\n"
+                    "  sonarr:\n    image: lscr.io/linuxserver/sonarr:latest\n"
+                    "  radarr:\n    image: lscr.io/linuxserver/radarr:latest\n"
+                    "  lidarr:\n    image: lscr.io/linuxserver/lidarr:latest\n")
+        config = {"image_bundle": {"path": os.path.join(tmpdir, "bundle")}}
+        
+        with patch.dict(os.environ, {"FAKE_DOCKER_DIR": state, "PATH": bin_dir + os.pathsep + os.environ["PATH"]}):
+            export = scripts.api.export_image_bundle(config, compose_file)
+            assert sorted(export["exported"]) == sorted(archives)
+            assert export["not_present"] == ["lscr.io/linuxserver/lidarr:latest"]
+            # The shared base layer is stored once
+            assert export["logical_bytes"] - export["size_bytes"] == len(base)
+            assert scripts.api.export_image_bundle(config, compose_file)["exported"] == []
+            
+            # Simulate a fresh node: nothing is present until the bundle is imported
+            os.remove(os.path.join(state, "lscr.io_linuxserver_radarr+latest.tar"))
+            report = scripts.api.import_image_bundle(config, compose_file)
+            assert report["loaded"] == ["lscr.io/linuxserver/radarr:latest"]
+            assert report["present"] == ["lscr.io/linuxserver/sonarr:latest"]
+            # Only the radarr layer and manifest count; the base layer was already on disk with sonarr
+            assert len(b"radarr" * 2000) < report["download_bytes_saved"] < len(b"radarr" * 2000) + 1024
+            assert report["missing_services"] == ["lidarr"]
+            assert report["bundle_bytes"] == export["size_bytes"]
+        
+        with tarfile.open(os.path.join(state, "lscr.io_linuxserver_radarr+latest.tar")) as tar:
+            assert tar.extractfile("layer0-262144/layer.tar").read() == base
+            assert tar.extractfile("layer1-12000/layer.tar").read() == b"radarr" * 2000
+
+def test_services_endpoint_includes_health():
+    healthy = start_stub_server(200)
+    containers = {"sonarr": {"status": "running", "url": f"http://127.0.0.1:{healthy.server_port}"}}
+    client = scripts.api.app.test_client()
+    with tempfile.TemporaryDirectory() as tmpdir, \
+         patch("scripts.api.SERVICES_FILE", os.path.join(tmpdir, "services.json")), \
+         patch("scripts.api.get_container_status", return_value=containers), \
+         patch("scripts.api.ensure_health_prober"), \
+         patch.dict(scripts.api._health_state, clear=True):
+        scripts.api.probe_services(containers)
+        # The plain load used by the settings form does not touch Docker
+        with patch("scripts.api.get_container_services") as mock_containers:
+            assert "services" not in client.get('/api/services').json
+            mock_containers.assert_not_called()
+        data = client.get('/api/services?containers=true').json
+        assert data["arr_apps"] == scripts.api.DEFAULT_SERVICES["arr_apps"]
+        assert data["services"][0]["name"] == "sonarr"
+        assert data["services"][0]["health"]["status"] == "healthy"
+        
+        # Posting the response back saves only the selections
+        assert client.post('/api/services', json=data).json["status"] == "success"
+        assert "services" not in scripts.api.load_services()
+        assert client.post('/api/services', data="not json").status_code == 400
+        assert client.post('/api/services').status_code == 400
+    healthy.shutdown()
+
+def test_quiesced_service_is_not_paused():
+    cancelled = {"id": "job", "cancel": threading.Event()}
+    cancelled["cancel"].set()
+    running = MagicMock(returncode=0, stdout="true\n")
+    with patch("scripts.api.get_current_job", return_value=cancelled), \
+         patch("scripts.api.subprocess.run", return_value=running) as mock_run:
+        # A checkpoint while the container is stopped must not stop the job and leave it down
+        with scripts.api.quiesced_service("sonarr") as stopped:
+            assert stopped
+            scripts.api.scheduler_checkpoint()
+        assert mock_run.call_args[0][0] == ["docker", "start", "sonarr"]
+        # Outside the block the cancel is seen again
+        try:
+            scripts.api.scheduler_checkpoint()
+            raised = False
+        except scripts.api.SchedulerJobCancelled:
+            raised = True
+        assert raised
+
+def test_debug_token_is_not_taken_from_config():
+    client = scripts.api.app.test_client()
+    config = {"installation_status": "completed", "debug": {"token": "from-config"}}
+    with patch("scripts.api.load_config", return_value=config), \
+         patch.dict(os.environ, {"PIPVR_DEBUG_TOKEN": "s3cret"}):
+        # Anyone can read or write /api/config, so a token there must not open the debug endpoints
+        assert client.get('/api/debug/traces', headers={"X-Debug-Token": "from-config"}).status_code == 404
+        assert "s3cret" not in client.get('/api/config').get_data(as_text=True)
+        assert client.get('/api/debug/traces', headers={"X-Debug-Token": "s3cret"}).status_code == 200
@@ -38,7 +38,7 @@ export const systemApi = {
 
 // Services API
 export const servicesApi = {
-  getAllServices: () => apiRequest('/services'),
+  getAllServices: () => apiRequest('/services?containers=true'),
   startService: (serviceName) => apiRequest(`/services/${serviceName}/start`, { method: 'POST' }),
   stopService: (serviceName) => apiRequest(`/services/${serviceName}/stop`, { method: 'POST' }),
   restartService: (serviceName) => apiRequest(`/services/${serviceName}/restart`, { method: 'POST' }),